@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+# Бенчмарки WireGuard Manager на синтетических конфигах.
+#
+# Для каждого размера (по умолчанию 100, 10000 и 100000 клиентов) генерируется
+# воспроизводимый набор: wg0.conf, папка keys/ и состояние интерфейса для
+# имитации wg из fake-bin/. Каждая операция запускается в отдельном процессе
+# на свежей копии набора, чтобы пиковое потребление памяти относилось только
+# к ней. Результат - JSON, который можно сравнивать между версиями:
+#
+#   python3 bench/wg-bench.py --output new.json
+#   python3 bench/wg-bench.py --script old/wg-manager.py --output old.json
+import argparse
+import base64
+import builtins
+import contextlib
+import datetime
+import hashlib
+import importlib.util
+import io
+import ipaddress
+import json
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_BIN = os.path.join(BENCH_DIR, 'fake-bin')
+DEFAULT_SCRIPT = os.path.join(os.path.dirname(BENCH_DIR), 'wg_manager.py')
+DEFAULT_SIZES = (100, 10000, 100000)
+
+# Пара ключей сервера из документации wg(8)
+SERVER_PRIVATE_KEY = "yAnz5TF+lXXJte14tji3zlMNq+hd2rYUIgJBgB3fBmk="
+SERVER_PUBLIC_KEY = "HIgo9xNzJMWLKASShiTqIybxZ0U3wGLiUeJ1PKf8ykw="
+SUBNET = "10.0.0.0/14"
+ENDPOINT = "203.0.113.1:51820"
+# Старые версии задают подсеть префиксом "10.8.0." и выдают адреса только в нём.
+# Для них набор строится в 10.8.0.0/24: первые LEGACY_POOL клиентов - в пуле
+# (остаток пула свободен для add_client), остальные - за его пределами.
+LEGACY_SUBNET = "10.8.0.0/24"
+LEGACY_POOL = 200
+LEGACY_OVERFLOW = "10.9.0.0/16"
+
+# Операции: имя -> (функция в дочернем процессе, меняет ли она keys/, нужен ли
+# прогрев). Прогрев - загрузка конфига до замера: у копии набора новый inode,
+# и без него каждая операция мерила бы перестроение индекса конфига.
+OPERATIONS = {}
+
+def operation(name, writes_keys=False, warm=True):
+    def register(func):
+        OPERATIONS[name] = (func, writes_keys, warm)
+        return func
+    return register
+
+def client_name(index):
+    return f"bench-{index:06d}"
+
+def fake_key(rnd):
+    return base64.b64encode(bytes(rnd.getrandbits(8) for _ in range(32))).decode()
+
+# В новых версиях wg-manager.py - только точка входа, код лежит в wg_manager.py рядом
+def resolve_script(script):
+    module = os.path.join(os.path.dirname(os.path.abspath(script)), 'wg_manager.py')
+    if os.path.basename(script) == 'wg-manager.py' and os.path.exists(module):
+        return module
+    return script
+
+# Подсеть по умолчанию из исходника проверяемой версии (без её запуска)
+def script_subnet(script):
+    with open(script, 'r') as f:
+        match = re.search(r'^SUBNET\s*=\s*["\']([^"\']*)["\']', f.read(), re.M)
+    return match.group(1) if match else None
+
+def is_legacy(script):
+    subnet = script_subnet(script)
+    return subnet is not None and subnet.endswith('.')
+
+def client_address(index, legacy):
+    if not legacy:
+        return ipaddress.ip_address(int(ipaddress.ip_network(SUBNET).network_address) + 2 + index)
+    if index < LEGACY_POOL:
+        return ipaddress.ip_address(int(ipaddress.ip_network(LEGACY_SUBNET).network_address) + 2 + index)
+    return ipaddress.ip_address(int(ipaddress.ip_network(LEGACY_OVERFLOW).network_address) + index - LEGACY_POOL)
+
+# Генерация набора данных. Одинаковый seed даёт одинаковые файлы.
+def generate_dataset(directory, size, seed=0, legacy=False):
+    rnd = random.Random(seed * 1000003 + size)
+    keys_dir = os.path.join(directory, 'keys')
+    os.makedirs(keys_dir, exist_ok=True)
+    subnet = LEGACY_SUBNET if legacy else SUBNET
+    network = ipaddress.ip_network(subnet)
+    base = int(network.network_address)
+    now = int(time.time())
+
+    conf_lines = [
+        "[Interface]\n",
+        f"PrivateKey = {SERVER_PRIVATE_KEY}\n",
+        f"Address = {ipaddress.ip_address(base + 1)}/{network.prefixlen}\n",
+        "ListenPort = 51820\n",
+    ]
+    dump_lines = [f"{SERVER_PRIVATE_KEY}\t{SERVER_PUBLIC_KEY}\t51820\toff\n"]
+    for index in range(size):
+        name = client_name(index)
+        ip = str(client_address(index, legacy))
+        private_key, public_key, psk = fake_key(rnd), fake_key(rnd), fake_key(rnd)
+        conf_lines.append(f"\n# Client: {name}\n[Peer]\nPublicKey = {public_key}\nPresharedKey = {psk}\nAllowedIPs = {ip}/32\n")
+        with open(os.path.join(keys_dir, f"{name}.conf"), 'w') as f:
+            f.write(f"[Interface]\nPrivateKey = {private_key}\nAddress = {ip}/{network.prefixlen}\nDNS = 1.1.1.1\n\n"
+                    f"[Peer]\nPublicKey = {SERVER_PUBLIC_KEY}\nPresharedKey = {psk}\nAllowedIPs = {subnet}\n"
+                    f"Endpoint = {ENDPOINT}\nPersistentKeepalive = 25\n")
+        # Треть клиентов никогда не подключалась, остальные - с разной давностью
+        if rnd.random() < 0.33:
+            handshake, endpoint, rx, tx = 0, '(none)', 0, 0
+        else:
+            handshake = now - rnd.randrange(0, 7 * 86400)
+            endpoint = f"198.51.{rnd.randrange(256)}.{rnd.randrange(1, 255)}:{rnd.randrange(1024, 65535)}"
+            rx, tx = rnd.randrange(10 ** 9), rnd.randrange(10 ** 9)
+        dump_lines.append(f"{public_key}\t{psk}\t{endpoint}\t{ip}/32\t{handshake}\t{rx}\t{tx}\toff\n")
+
+    with open(os.path.join(directory, 'wg0.conf'), 'w') as f:
+        f.writelines(conf_lines)
+    with open(os.path.join(directory, 'wg-state.dump'), 'w') as f:
+        f.writelines(dump_lines)
+
+# Копия набора для одного запуска: файлы конфига копируются, папка keys/
+# связывается жёсткими ссылками только для операций, которые её меняют
+def prepare_run(dataset, run_dir, writes_keys):
+    os.makedirs(run_dir)
+    for name in os.listdir(dataset):
+        source = os.path.join(dataset, name)
+        if os.path.isfile(source):
+            shutil.copy2(source, os.path.join(run_dir, name))
+    keys_dir = os.path.join(dataset, 'keys')
+    if writes_keys:
+        run_keys = os.path.join(run_dir, 'keys')
+        os.makedirs(run_keys)
+        for name in os.listdir(keys_dir):
+            os.link(os.path.join(keys_dir, name), os.path.join(run_keys, name))
+        keys_dir = run_keys
+    return keys_dir
+
+# Ответы на input() для версий, где операция доступна только из меню
+def scripted(func, answers):
+    def call():
+        queue = list(answers)
+        original = builtins.input
+        builtins.input = lambda prompt='': queue.pop(0) if queue else ''
+        try:
+            func()
+        finally:
+            builtins.input = original
+    return call
+
+# Операции выполняются в дочернем процессе над загруженным модулем wg-manager
+@operation('load_config_cold', warm=False)
+def op_load_config_cold(wg, size):
+    index_path = f"{wg.CONF}.idx"
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    return lambda: wg.load_config()
+
+@operation('load_config')
+def op_load_config(wg, size):
+    return lambda: wg.load_config()
+
+@operation('find_free_ip')
+def op_find_free_ip(wg, size):
+    return lambda: wg.find_free_ip()
+
+@operation('get_all_clients')
+def op_get_all_clients(wg, size):
+    return lambda: wg.get_all_clients()
+
+@operation('add_client', writes_keys=True)
+def op_add_client(wg, size):
+    if not hasattr(wg, 'provision_clients'):
+        return scripted(wg.add_client, ['bench-new', 'н'])
+    return lambda: wg.provision_clients(['bench-new'])
+
+@operation('delete_client', writes_keys=True)
+def op_delete_client(wg, size):
+    if not hasattr(wg, 'revoke_clients'):
+        names = [name for name, _ in wg.get_all_clients()]
+        return scripted(wg.delete_client, [str(names.index(client_name(size // 2)) + 1), 'д'])
+    return lambda: wg.revoke_clients([client_name(size // 2)])
+
+@operation('diagnose')
+def op_diagnose(wg, size):
+    if not hasattr(wg, 'check_config'):
+        return scripted(wg.diagnose_connection, [])
+    return lambda: wg.check_config()
+
+@operation('status')
+def op_status(wg, size):
+    return lambda: wg.read_peer_status()
+
+@operation('hot_reload')
+def op_hot_reload(wg, size):
+    return lambda: wg.hot_reload()
+
+def read_proc_io():
+    try:
+        with open('/proc/self/io', 'r') as f:
+            return {key: int(value) for key, _, value in (line.partition(': ') for line in f)}
+    except OSError:
+        return {}
+
+# Пик RSS процесса. На Linux пик сбрасывается перед замером (clear_refs),
+# чтобы прогрев не попал в результат; иначе - ru_maxrss за всё время жизни.
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def peak_rss_kb():
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_child(args):
+    spawned = {}
+    def audit(event, event_args):
+        if event == 'subprocess.Popen':
+            executable, command = event_args[0], event_args[1]
+            if isinstance(command, (str, bytes)):
+                command = os.fsdecode(command).split()
+            name = os.path.basename(os.fsdecode(executable or command[0]))
+            # Для shell=True учитываем и запущенную через sh команду
+            if name == 'sh' and len(command) > 2 and command[1] == '-c':
+                name = f"sh:{os.path.basename(command[2].split()[0])}"
+            spawned[name] = spawned.get(name, 0) + 1
+        elif event == 'os.system':
+            name = f"system:{os.path.basename(os.fsdecode(event_args[0]).split()[0])}"
+            spawned[name] = spawned.get(name, 0) + 1
+    if hasattr(sys, 'addaudithook'):
+        sys.addaudithook(audit)
+
+    spec = importlib.util.spec_from_file_location('wg_manager', args.script)
+    wg = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(wg)
+    wg.CONF = os.path.join(args.workdir, 'wg0.conf')
+    wg.KEYS_DIR = args.keys_dir
+    # Версия с префиксом "10.8.0." работает со своей подсетью и набором в /24
+    if not args.legacy:
+        wg.SUBNET = SUBNET
+    wg.ENDPOINT = ENDPOINT
+
+    func, _, warm = OPERATIONS[args.op]
+    call = func(wg, args.size)
+    if warm and hasattr(wg, 'load_config'):
+        with contextlib.redirect_stdout(io.StringIO()):
+            wg.load_config()
+    spawned.clear()
+    reset_peak_rss()
+    rss_before = peak_rss_kb()
+    io_before = read_proc_io()
+    started = time.perf_counter()
+    # Вывод самих функций (предупреждения и т.п.) не должен попасть в JSON
+    with contextlib.redirect_stdout(io.StringIO()):
+        call()
+    wall = time.perf_counter() - started
+    io_after = read_proc_io()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    with open(args.result, 'w') as f:
+        json.dump({
+            'wall_ms': round(wall * 1000, 3),
+            'spawns': sum(spawned.values()),
+            'spawned': spawned,
+            'bytes_read': io_after.get('rchar', 0) - io_before.get('rchar', 0),
+            'bytes_written': io_after.get('wchar', 0) - io_before.get('wchar', 0),
+            'peak_rss_kb': peak_rss_kb(),
+            'rss_before_kb': rss_before,
+            'children_cpu_ms': round((children.ru_utime + children.ru_stime) * 1000, 3),
+        }, f)
+
+def script_version(script):
+    with open(script, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    revision = None
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(script)),
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+        if result.returncode == 0:
+            revision = result.stdout.strip()
+    except OSError:
+        pass
+    return {'script': os.path.abspath(script), 'sha256': digest, 'git_revision': revision}
+
+def run_benchmarks(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='wg-bench-')
+    env = dict(os.environ)
+    env['PATH'] = FAKE_BIN + os.pathsep + env.get('PATH', '')
+    env.pop('WG_MANAGER_BACKEND', None)
+    legacy = is_legacy(args.script)
+    results = []
+    try:
+        for size in args.sizes:
+            dataset = os.path.join(workdir, f"dataset-{size}{'-legacy' if legacy else ''}")
+            if not os.path.exists(os.path.join(dataset, 'wg0.conf')):
+                print(f"Генерация набора на {size} клиентов...", file=sys.stderr)
+                started = time.time()
+                generate_dataset(dataset, size, args.seed, legacy)
+                print(f"  готово за {time.time() - started:.1f} с", file=sys.stderr)
+
+            for op in args.ops:
+                _, writes_keys, _ = OPERATIONS[op]
+                runs = []
+                for repeat in range(args.repeat):
+                    run_dir = os.path.join(workdir, f"run-{size}-{op}-{repeat}")
+                    shutil.rmtree(run_dir, ignore_errors=True)
+                    keys_dir = prepare_run(dataset, run_dir, writes_keys)
+                    env['WG_FAKE_STATE'] = os.path.join(run_dir, 'wg-state.dump')
+                    result_path = os.path.join(run_dir, 'result.json')
+                    command = [sys.executable, os.path.abspath(__file__), 'child', '--script', args.script,
+                               '--workdir', run_dir, '--keys-dir', keys_dir, '--op', op, '--size', str(size),
+                               '--result', result_path] + (['--legacy'] if legacy else [])
+                    # Вывод меню и clear старых версий отбрасываем, результат - в файле
+                    result = subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                            universal_newlines=True)
+                    if result.returncode == 0:
+                        with open(result_path, 'r') as f:
+                            runs.append(json.load(f))
+                    if not args.keep:
+                        shutil.rmtree(run_dir, ignore_errors=True)
+                    if result.returncode != 0:
+                        runs.append({'error': result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"код {result.returncode}"})
+                        break
+
+                measured = [run for run in runs if 'error' not in run]
+                if measured:
+                    # Метрики берём из запуска с медианным временем
+                    median = statistics.median_low([run['wall_ms'] for run in measured])
+                    entry = dict(next(run for run in measured if run['wall_ms'] == median))
+                    entry['wall_ms_runs'] = [run['wall_ms'] for run in measured]
+                else:
+                    entry = runs[-1]
+                entry = dict({'size': size, 'op': op}, **entry)
+                results.append(entry)
+                status = entry.get('error') or f"{entry['wall_ms']:.1f} мс, процессов: {entry['spawns']}, RSS: {entry['peak_rss_kb']} КиБ"
+                print(f"  {size:>7} {op:<18} {status}", file=sys.stderr)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'version': script_version(args.script),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'seed': args.seed,
+        'subnet': LEGACY_SUBNET if legacy else SUBNET,
+        'repeat': args.repeat,
+        'results': results,
+    }
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Бенчмарки WireGuard Manager на синтетических конфигах")
+    parser.add_argument('--script', default=DEFAULT_SCRIPT, help="проверяемая версия wg-manager.py")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        type=lambda value: [int(size) for size in value.split(',')], help="размеры наборов через запятую")
+    parser.add_argument('--ops', default=','.join(OPERATIONS),
+                        type=lambda value: value.split(','), help=f"операции через запятую: {', '.join(OPERATIONS)}")
+    parser.add_argument('--repeat', type=int, default=3, help="число запусков каждой операции")
+    parser.add_argument('--seed', type=int, default=0, help="seed генератора наборов")
+    parser.add_argument('--workdir', help="каталог для наборов (сохраняется между запусками)")
+    parser.add_argument('--keep', action='store_true', help="не удалять рабочие файлы")
+    parser.add_argument('--output', help="файл для JSON (по умолчанию stdout)")
+
+    commands = parser.add_subparsers(dest='command')
+    child = commands.add_parser('child')
+    child.add_argument('--script', required=True)
+    child.add_argument('--workdir', required=True)
+    child.add_argument('--keys-dir', required=True)
+    child.add_argument('--op', required=True, choices=list(OPERATIONS))
+    child.add_argument('--size', type=int, required=True)
+    child.add_argument('--result', required=True)
+    child.add_argument('--legacy', action='store_true')
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.script = resolve_script(args.script)
+    if args.command == 'child':
+        run_child(args)
+        return 0
+    unknown = [op for op in args.ops if op not in OPERATIONS]
+    if unknown:
+        print(f"Неизвестные операции: {', '.join(unknown)}", file=sys.stderr)
+        return 1
+    report = json.dumps(run_benchmarks(args), ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -21,6 +21,7 @@ GITHUB_BASE_URL="https://raw.githubusercontent.com/Wonkiest29/wg-privatenet/refs
 FILES=(
     "wg-manager.sh"
     "wg-manager.py"
+    "wg_manager.py"
     "wg-manager"
 )
 
@@ -0,0 +1,68 @@
+import ipaddress
+import random
+
+import pytest
+
+# Одни и те же операции в разреженном режиме сверяются с множеством адресов
+@pytest.fixture
+def sparse(wg):
+    return wg.IPAllocator("fd00::/64", 'lowest')
+
+def test_overlapping_ranges_counted_once(sparse):
+    assert sparse.used_count == 0
+    assert sparse.reserve_network("fd00::100/120") == 256
+    assert sparse.reserve_network("fd00::180/121") == 0
+    assert sparse.reserve_network("fd00::1c0/122") == 0
+    assert sparse.used_count == 256
+    assert sparse.reserve_network("fd00::200/120") == 256
+    assert sparse._ranges == [(0x100, 0x2ff)]
+    assert sparse.used_count == 512
+    assert "fd00::180" in sparse.collisions
+
+def test_single_addresses_inside_range(sparse):
+    assert sparse.reserve("fd00::105")
+    assert sparse.used_count == 1
+    assert sparse.reserve_network("fd00::100/120") == 255
+    assert sparse.used_count == 256
+    assert not sparse.reserve("fd00::1ff")
+    assert "fd00::105" in sparse.collisions
+
+def test_release_inside_range(sparse):
+    sparse.reserve("fd00::1")
+    sparse.reserve_network("fd00::100/120")
+    assert sparse.release("fd00::180")
+    assert sparse.is_free("fd00::180")
+    assert not sparse.is_free("fd00::17f") and not sparse.is_free("fd00::181")
+    assert sparse.used_count == 256
+    assert sparse._ranges == [(0x100, 0x17f), (0x181, 0x1ff)]
+    assert not sparse.release("fd00::180")
+    # Курсор возвращается к освобождённому адресу, а занятые подсети пропускаются
+    assert sparse.allocate() == "fd00::2"
+    sparse.reserve_network("fd00::0/120")
+    assert sparse.allocate() == "fd00::180"
+    assert sparse.allocate() == "fd00::200"
+
+def test_matches_reference_set(wg):
+    rnd = random.Random(7)
+    allocator = wg.IPAllocator("fd00::/64", 'lowest')
+    network = ipaddress.ip_network("fd00::/64")
+    used = set()
+    for _ in range(300):
+        base = rnd.randrange(0, 4096)
+        action = rnd.random()
+        if action < 0.2:
+            prefix = rnd.choice((120, 121, 122, 124))
+            subnet = ipaddress.ip_network(f"{network.network_address + base}/{prefix}", strict=False)
+            allocator.reserve_network(subnet)
+            used.update(range(int(subnet.network_address) - int(network.network_address),
+                              int(subnet.broadcast_address) - int(network.network_address) + 1))
+        elif action < 0.6:
+            if allocator.reserve(str(network.network_address + base)):
+                used.add(base)
+        else:
+            if allocator.release(str(network.network_address + base)):
+                used.discard(base)
+        used_in_pool = sum(1 for offset in used if offset >= 1)
+        assert allocator.used_count == used_in_pool
+    for offset in range(0, 4600):
+        assert allocator.is_free(str(network.network_address + offset)) == (offset not in used and offset >= 1)
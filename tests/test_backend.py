@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+CONFIG = """[Interface]
+PrivateKey = yAnz5TF+lXXJte14tji3zlMNq+hd2rYUIgJBgB3fBmk=
+Address = 10.8.0.1/24
+ListenPort = 51820
+"""
+
+# Полный цикл через команды CLI с состоянием имитации wg в файле
+@pytest.fixture
+def cli(wg, monkeypatch, tmp_path, capsys):
+    conf = tmp_path / 'wg0.conf'
+    conf.write_text(CONFIG)
+    state = tmp_path / 'fake-wg.json'
+    for name in ('CONF', 'KEYS_DIR', 'SHARDS', 'PROFILES', 'SUBNET'):
+        monkeypatch.setattr(wg, name, getattr(wg, name))
+    monkeypatch.setattr(wg, 'SUBNET', "10.8.0.0/24")
+    monkeypatch.setattr(wg, '_journals', {})
+    monkeypatch.setattr(wg, '_backends', {})
+    monkeypatch.setattr(wg, '_client_stores', {})
+    monkeypatch.setenv('WG_MANAGER_BACKEND', 'fake')
+    monkeypatch.setenv('WG_MANAGER_FAKE_STATE', str(state))
+
+    def run(*argv):
+        # Каждая команда - как отдельный запуск: бэкенд заново читает состояние из файла
+        wg._backends.clear()
+        code = wg.main(list(argv) + ['--conf', str(conf), '--keys-dir', str(tmp_path / 'keys'), '-f', 'json'])
+        out = capsys.readouterr().out
+        return code, json.loads(out) if out.strip() else None
+
+    def live():
+        with open(state, 'r') as f:
+            return {fields[0]: fields[3] for fields in json.load(f)}
+
+    return wg, run, live
+
+def test_add_delete_reload_round_trip(cli):
+    wg, run, live = cli
+    code, added = run('add', 'alice', 'bob', 'carol')
+    assert code == wg.EXIT_OK
+    keys = {client['name']: client['public_key'] for client in added}
+    assert live() == {keys['alice']: '10.8.0.2/32', keys['bob']: '10.8.0.3/32', keys['carol']: '10.8.0.4/32'}
+
+    code, removed = run('delete', 'bob')
+    assert code == wg.EXIT_OK and [client['name'] for client in removed] == ['bob']
+    assert live() == {keys['alice']: '10.8.0.2/32', keys['carol']: '10.8.0.4/32'}
+
+    # Интерфейс разошёлся с конфигом: лишний пир, пропавший клиент и чужой адрес
+    backend = wg.get_backend('wg0')
+    stray = "S" * 43 + "="
+    backend.peers.pop(keys['alice'])
+    backend.peers[stray] = wg.DumpPeer([stray, '(none)', '(none)', '10.8.0.9/32', '0', '0', '0', 'off'])
+    backend.peers[keys['carol']].allowed_ips = ['10.8.0.99/32']
+    backend._save()
+
+    code, diff = run('reload')
+    assert code == wg.EXIT_OK
+    assert (diff['added'], diff['updated'], diff['removed'], diff['unchanged']) == (1, 1, 1, 0)
+    assert live() == {keys['alice']: '10.8.0.2/32', keys['carol']: '10.8.0.4/32'}
+
+    # Повторный reload ничего не меняет
+    code, diff = run('reload')
+    assert (diff['added'], diff['updated'], diff['removed'], diff['unchanged']) == (0, 0, 0, 2)
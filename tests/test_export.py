@@ -0,0 +1,75 @@
+import os
+import stat
+import tarfile
+import zipfile
+
+import pytest
+
+CONFIG = f"""[Interface]
+PrivateKey = yAnz5TF+lXXJte14tji3zlMNq+hd2rYUIgJBgB3fBmk=
+Address = 10.8.0.1/24
+ListenPort = 51820
+
+# Client: legacy
+[Peer]
+PublicKey = {"L" * 43 + "="}
+AllowedIPs = 10.8.0.2/32
+"""
+
+# Клиенты alice и bob созданы через provision_clients, legacy есть только в конфиге
+@pytest.fixture(params=['files', 'sqlite'])
+def store(wg, monkeypatch, tmp_path, request):
+    if request.param == 'sqlite' and not wg._sqlite_available():
+        pytest.skip("sqlite3 недоступен")
+    conf = tmp_path / 'wg0.conf'
+    conf.write_text(CONFIG)
+    monkeypatch.setattr(wg, 'CONF', str(conf))
+    monkeypatch.setattr(wg, 'KEYS_DIR', str(tmp_path / 'keys'))
+    monkeypatch.setattr(wg, 'SUBNET', "10.8.0.0/24")
+    monkeypatch.setattr(wg, 'SHARDS', [])
+    monkeypatch.setattr(wg, '_journals', {})
+    monkeypatch.setattr(wg, '_backends', {})
+    monkeypatch.setattr(wg, '_client_stores', {})
+    monkeypatch.setenv('WG_MANAGER_BACKEND', 'fake')
+    monkeypatch.delenv('WG_MANAGER_FAKE_STATE', raising=False)
+    monkeypatch.setenv('WG_MANAGER_CLIENT_STORE', request.param)
+    wg.provision_clients(['alice', 'bob'])
+    return wg
+
+def read_tar(path):
+    with tarfile.open(path, 'r:gz') as archive:
+        return {member.name: (member.mode, archive.extractfile(member).read()) for member in archive.getmembers()}
+
+def read_zip(path):
+    with zipfile.ZipFile(path) as archive:
+        return {info.filename: (info.external_attr >> 16, archive.read(info)) for info in archive.infolist()}
+
+@pytest.mark.parametrize('suffix, read', [('.tar.gz', read_tar), ('.zip', read_zip)])
+def test_archive_members(store, tmp_path, suffix, read):
+    wg = store
+    output = str(tmp_path / f'clients{suffix}')
+    exported, missing = wg.export_clients(output, qr_format='text', workers=1)
+    assert exported == 2 and missing == ['legacy']
+    # Архив с приватными ключами доступен только владельцу
+    assert stat.S_IMODE(os.stat(output).st_mode) == 0o600
+
+    members = read(output)
+    assert list(members) == ['alice.conf', 'alice.txt', 'bob.conf', 'bob.txt']
+    assert all(mode == 0o600 for mode, _ in members.values())
+    for name in ('alice', 'bob'):
+        content = wg.get_client_store().config_text(name)
+        assert members[f'{name}.conf'][1] == content.encode()
+        assert members[f'{name}.txt'][1] == wg.qr_to_text(wg.qr_encode(content)).encode()
+
+def test_selected_clients_with_png(store, tmp_path):
+    wg = store
+    output = str(tmp_path / 'clients.zip')
+    exported, missing = wg.export_clients(output, selectors=['bob'], qr_format='png', workers=1)
+    assert (exported, missing) == (1, [])
+    members = read_zip(output)
+    assert list(members) == ['bob.conf', 'bob.png']
+    assert members['bob.png'][1].startswith(b'\x89PNG\r\n\x1a\n')
+    # Повторный экспорт берёт QR-код из кэша
+    assert os.listdir(wg.get_qr_cache_dir()) != []
+    wg.export_clients(str(tmp_path / 'again.zip'), selectors=['bob'], qr_format='png', workers=1)
+    assert read_zip(str(tmp_path / 'again.zip'))['bob.png'] == members['bob.png']
@@ -0,0 +1,114 @@
+import re
+
+import pytest
+
+KEYS = {name: name.upper() * 43 + "=" for name in ('a', 'b', 'c', 'd')}
+NOW = 10000
+
+CONFIG = f"""[Interface]
+PrivateKey = yAnz5TF+lXXJte14tji3zlMNq+hd2rYUIgJBgB3fBmk=
+Address = 10.8.0.1/24
+ListenPort = 51820
+
+# Client: a
+[Peer]
+PublicKey = {KEYS['a']}
+AllowedIPs = 10.8.0.2/32
+
+# Client: b
+[Peer]
+PublicKey = {KEYS['b']}
+AllowedIPs = 10.8.0.3/32
+
+# Client: c
+[Peer]
+PublicKey = {KEYS['c']}
+AllowedIPs = 10.8.0.4/32
+"""
+
+# Пир d есть на интерфейсе, но не в конфиге; c ни разу не подключался
+def dump_text():
+    peers = [
+        ('a', "1.1.1.1:1", NOW - 10, 100, 1000),
+        ('b', "2.2.2.2:2", NOW - 500, 200, 2000),
+        ('c', "(none)", 0, 0, 0),
+        ('d', "4.4.4.4:4", NOW - 20, 400, 4000),
+    ]
+    lines = ["cHJpdmF0ZQ==\tcHVibGlj\t51820\toff"]
+    lines += [f"{KEYS[name]}\t(none)\t{endpoint}\t10.8.0.{ord(name) - 95}/32\t{handshake}\t{rx}\t{tx}\toff"
+              for name, endpoint, handshake, rx, tx in peers]
+    return "\n".join(lines) + "\n"
+
+@pytest.fixture
+def exporter(wg, monkeypatch, tmp_path):
+    conf = tmp_path / 'wg0.conf'
+    conf.write_text(CONFIG)
+    dump = tmp_path / 'dump.txt'
+    dump.write_text(dump_text())
+    monkeypatch.setattr(wg, 'CONF', str(conf))
+    monkeypatch.setattr(wg, 'SUBNET', "10.8.0.0/24")
+    return wg, dump
+
+# Разбор текстового формата: {(имя, метки): значение} и список имён из # TYPE
+def parse_metrics(payload):
+    samples, types = {}, []
+    for line in payload.decode().splitlines():
+        if line.startswith('# TYPE '):
+            types.append(line.split()[2])
+            continue
+        if line.startswith('#'):
+            continue
+        match = re.fullmatch(r'(\w+)\{(.*)\} (\S+)', line)
+        assert match, line
+        labels = tuple(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', match.group(2)))
+        samples[match.group(1), labels] = float(match.group(3))
+    return samples, types
+
+def client_labels(name, ip):
+    return (('interface', 'wg0'), ('client', name), ('ip', ip))
+
+def test_series_and_labels(exporter):
+    wg, dump = exporter
+    samples, types = parse_metrics(wg.MetricsCollector(str(dump), max_peers=10).collect(now=NOW))
+    assert len(types) == len(set(types))
+    assert samples['wireguard_peer_receive_bytes_total', client_labels('a', '10.8.0.2')] == 100
+    assert samples['wireguard_peer_transmit_bytes_total', client_labels('b', '10.8.0.3')] == 2000
+    # Пир не из конфига подписан публичным ключом и адресом из AllowedIPs
+    assert samples['wireguard_peer_receive_bytes_total', client_labels(KEYS['d'], '10.8.0.5')] == 400
+    assert samples['wireguard_peer_last_handshake_age_seconds', client_labels('b', '10.8.0.3')] == 500
+    # Без рукопожатия возраст не выдаётся
+    assert ('wireguard_peer_last_handshake_age_seconds', client_labels('c', '10.8.0.4')) not in samples
+    interface = (('interface', 'wg0'),)
+    assert samples['wireguard_peers', interface + (('state', 'configured'),)] == 3
+    assert samples['wireguard_peers', interface + (('state', 'live'),)] == 4
+    assert samples['wireguard_peers', interface + (('state', 'online'),)] == 2
+    assert samples['wireguard_peers', interface + (('state', 'unknown'),)] == 1
+    assert samples['wireguard_pool_size_addresses', interface] == 254
+    assert samples['wireguard_pool_free_addresses', interface] == 250
+    assert samples['wg_manager_exporter_omitted_peers', interface] == 0
+    assert samples['wg_manager_exporter_other_receive_bytes', interface] == 0
+
+def test_max_peers_cutoff_and_omitted_gauges(exporter):
+    wg, dump = exporter
+    collector = wg.MetricsCollector(str(dump), max_peers=2)
+    samples, _ = parse_metrics(collector.collect(now=NOW))
+    clients = {dict(labels)['client'] for name, labels in samples if name == 'wireguard_peer_receive_bytes_total'}
+    # Выбираются самые свежие рукопожатия
+    assert clients == {'a', KEYS['d']}
+    interface = (('interface', 'wg0'),)
+    assert samples['wg_manager_exporter_omitted_peers', interface] == 2
+    assert samples['wg_manager_exporter_other_receive_bytes', interface] == 200
+    assert samples['wg_manager_exporter_other_transmit_bytes', interface] == 2000
+    # Общие счётчики не урезаются
+    assert samples['wireguard_peers', interface + (('state', 'live'),)] == 4
+
+def test_selection_is_sticky(exporter):
+    wg, dump = exporter
+    collector = wg.MetricsCollector(str(dump), max_peers=2)
+    collector.collect(now=NOW)
+    # b стал самым активным по трафику, но выбранные в прошлый раз клиенты остаются
+    dump.write_text(dump_text().replace("\t200\t2000\t", "\t900000\t900000\t"))
+    samples, _ = parse_metrics(collector.collect(now=NOW + 1))
+    clients = {dict(labels)['client'] for name, labels in samples if name == 'wireguard_peer_receive_bytes_total'}
+    assert clients == {'a', KEYS['d']}
+    assert samples['wg_manager_exporter_other_receive_bytes', (('interface', 'wg0'),)] == 900000
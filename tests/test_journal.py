@@ -0,0 +1,135 @@
+import pytest
+
+KEY_A = "A" * 43 + "="
+KEY_B = "B" * 43 + "="
+KEY_C = "C" * 43 + "="
+
+CONFIG = f"""[Interface]
+PrivateKey = yAnz5TF+lXXJte14tji3zlMNq+hd2rYUIgJBgB3fBmk=
+Address = 10.8.0.1/24
+ListenPort = 51820
+
+# Client: a
+[Peer]
+PublicKey = {KEY_A}
+AllowedIPs = 10.8.0.2/32
+
+# Client: b
+[Peer]
+PublicKey = {KEY_B}
+AllowedIPs = 10.8.0.3/32
+"""
+
+PEER_C = f"""
+# Client: c
+[Peer]
+PublicKey = {KEY_C}
+AllowedIPs = 10.8.0.4/32
+"""
+
+@pytest.fixture
+def journal(wg, monkeypatch, tmp_path):
+    conf = tmp_path / 'wg0.conf'
+    conf.write_text(CONFIG)
+    monkeypatch.setattr(wg, 'CONF', str(conf))
+    monkeypatch.setattr(wg, 'KEYS_DIR', str(tmp_path / 'keys'))
+    monkeypatch.setattr(wg, 'SUBNET', "10.8.0.0/24")
+    monkeypatch.setattr(wg, 'PROFILES', {'slow': {'rate': '5mbit'}})
+    monkeypatch.setattr(wg, 'SHAPING_LINK_RATE', None)
+    monkeypatch.setattr(wg, '_journals', {})
+    monkeypatch.setattr(wg, '_backends', {})
+    monkeypatch.setattr(wg, '_client_stores', {})
+    monkeypatch.setenv('WG_MANAGER_BACKEND', 'fake')
+    monkeypatch.delenv('WG_MANAGER_FAKE_STATE', raising=False)
+    return wg
+
+def journal_path(wg):
+    return wg.get_journal_path(wg.CONF)
+
+def read_text(path):
+    with open(path, 'r') as f:
+        return f.read()
+
+# Добавление c и удаление a одной транзакцией
+def add_and_remove(wg):
+    with wg.get_journal().transaction() as txn:
+        txn.add_peer_block(PEER_C)
+        txn.remove_peers([txn.config.by_name['a']])
+        return txn.config.text()
+
+def test_changes_go_to_journal_and_replay(journal):
+    expected = add_and_remove(journal)
+    # Конфиг не переписан, обе записи - в журнале
+    assert read_text(journal.CONF) == CONFIG
+    records, offset, size = journal._read_journal(journal.CONF)
+    assert [record['op'] for record in records] == ['add', 'remove']
+    assert offset == size
+    config = journal.load_config()
+    assert config.text() == expected
+    assert set(config.by_name) == {'b', 'c'}
+
+    assert journal.ConfigJournal(journal.CONF).compact() == 2
+    assert read_text(journal.CONF) == expected
+    assert read_text(journal_path(journal)) == ''
+
+def test_torn_tail_is_dropped_and_truncated(journal):
+    add_and_remove(journal)
+    _, valid, _ = journal._read_journal(journal.CONF)
+    with open(journal_path(journal), 'ab') as f:
+        f.write(b'0badc0de {"op":"add","key":')
+    records, offset, size = journal._read_journal(journal.CONF)
+    assert len(records) == 2 and offset == valid and size > valid
+    assert set(journal.load_config().by_name) == {'b', 'c'}
+
+    # Следующая транзакция отрезает хвост до своих записей
+    with journal.ConfigJournal(journal.CONF).transaction() as txn:
+        txn.remove_peers([txn.config.by_name['b']])
+    records, offset, size = journal._read_journal(journal.CONF)
+    assert [record['op'] for record in records] == ['add', 'remove', 'remove']
+    assert offset == size
+    assert set(journal.load_config().by_name) == {'c'}
+
+def test_bad_checksum_stops_replay(journal):
+    add_and_remove(journal)
+    data = read_text(journal_path(journal)).splitlines(True)
+    # Запись с неверной контрольной суммой и всё после неё не применяются
+    data[0] = '00000000' + data[0][8:]
+    with open(journal_path(journal), 'w') as f:
+        f.writelines(data)
+    records, offset, _ = journal._read_journal(journal.CONF)
+    assert records == [] and offset == 0
+    assert journal.load_config().text() == CONFIG
+
+def test_replay_after_crash_before_truncate_is_idempotent(journal):
+    expected = add_and_remove(journal)
+    with open(journal_path(journal), 'rb') as f:
+        saved = f.read()
+    journal.ConfigJournal(journal.CONF).compact()
+    assert read_text(journal.CONF) == expected
+    # Сбой между save_config и _truncate_journal: журнал остался рядом с новым конфигом
+    with open(journal_path(journal), 'wb') as f:
+        f.write(saved)
+    assert journal.load_config().text() == expected
+    journal.ConfigJournal(journal.CONF).compact()
+    assert read_text(journal.CONF) == expected
+    assert read_text(journal_path(journal)) == ''
+
+def test_set_client_profile_is_remove_then_add(journal):
+    updated, applied, _ = journal.set_client_profile(['a'], 'slow')
+    assert applied and [peer.name for peer in updated] == ['a']
+    records, _, _ = journal._read_journal(journal.CONF)
+    assert [(record['op'], record.get('keys') or [record['key']]) for record in records] == [
+        ('remove', [KEY_A]), ('add', [KEY_A])]
+    assert '# Profile: slow' in records[1]['text']
+
+    expected = journal.load_config().text()
+    assert journal.load_config().by_name['a'].profile == 'slow'
+    with open(journal_path(journal), 'rb') as f:
+        saved = f.read()
+    journal.ConfigJournal(journal.CONF).compact()
+    # Повтор remove+add поверх уже записанного конфига даёт тот же результат
+    with open(journal_path(journal), 'wb') as f:
+        f.write(saved)
+    config = journal.load_config()
+    assert config.text() == expected
+    assert [peer.name for peer in config.peers] == ['b', 'a']
@@ -0,0 +1,50 @@
+import base64
+
+import pytest
+
+# RFC 7748, раздел 6.1: X25519(k, 9) для ключей Алисы и Боба
+RFC7748_VECTORS = [
+    ("77076d0a7318a57d3c16c17251b26645df4c2f87ebc0992ab177fba51db92c2a",
+     "8520f0098930a754748b7ddcb43ef75a0dbf3a0d26381af4eba4a98eaa9b4e6a"),
+    ("5dab087e624a8a4b79e17f8b83800ee66f3bb1292618b6fd1c2f8b27ff88e0eb",
+     "de9edb7d7b7dc1b4d35b61c2ece435373f8343c85b78674dadfc7e146f882b4f"),
+]
+
+# Пара из документации WireGuard (wg genkey | tee privatekey | wg pubkey)
+WG_PRIVATE_KEY = "yAnz5TF+lXXJte14tji3zlMNq+hd2rYUIgJBgB3fBmk="
+WG_PUBLIC_KEY = "HIgo9xNzJMWLKASShiTqIybxZ0U3wGLiUeJ1PKf8ykw="
+
+def b64(hex_value):
+    return base64.b64encode(bytes.fromhex(hex_value)).decode()
+
+@pytest.mark.parametrize('private_hex, public_hex', RFC7748_VECTORS)
+def test_public_key_rfc7748(wg, private_hex, public_hex):
+    assert wg.public_key_from_private(b64(private_hex)) == b64(public_hex)
+
+def test_public_key_wg_pair(wg):
+    assert wg.public_key_from_private(WG_PRIVATE_KEY) == WG_PUBLIC_KEY
+
+def test_public_keys_batch(wg):
+    private_keys = [b64(private_hex) for private_hex, _ in RFC7748_VECTORS] + [WG_PRIVATE_KEY]
+    expected = [b64(public_hex) for _, public_hex in RFC7748_VECTORS] + [WG_PUBLIC_KEY]
+    assert wg.public_keys_from_private(private_keys) == expected
+    assert wg.public_keys_from_private([]) == []
+
+def test_public_key_rejects_invalid(wg):
+    with pytest.raises(ValueError):
+        wg.public_key_from_private("not a key")
+    with pytest.raises(ValueError):
+        wg.public_keys_from_private([WG_PRIVATE_KEY, base64.b64encode(b'short').decode()])
+
+def test_generate_keypairs(wg):
+    pairs = wg.generate_keypairs(20)
+    assert len(pairs) == 20
+    assert len({private for private, _, _ in pairs}) == 20
+    for private, public, psk in pairs:
+        raw = base64.b64decode(private)
+        # Приватный ключ уже ограничен (clamped), как у wg genkey
+        assert len(raw) == 32 and raw[0] & 7 == 0 and raw[31] & 0xc0 == 0x40
+        assert public == wg.public_key_from_private(private)
+        assert len(base64.b64decode(psk)) == 32
+    assert all(psk is None for _, _, psk in wg.generate_keypairs(3, with_psk=False))
+    assert wg.generate_keypairs(0) == []
@@ -0,0 +1,142 @@
+import pytest
+
+# Эталонная матрица для b"wg" (ECC M, маска выбрана по штрафам)
+WG_MATRIX = [
+    '#######.......#######',
+    '#.....#..#..#.#.....#',
+    '#.###.#.##.#..#.###.#',
+    '#.###.#.#####.#.###.#',
+    '#.###.#.##.##.#.###.#',
+    '#.....#.##..#.#.....#',
+    '#######.#.#.#.#######',
+    '........##.##........',
+    '#.#####..#..#.#####..',
+    '..#....#..#.#..#.##.#',
+    '#.###.#..###.#..##.#.',
+    '.##.#..#.......##.###',
+    '.#.#..##.###.#..#.##.',
+    '........##.####..#.##',
+    '#######..##.#.##...#.',
+    '#.....#.##.####..#..#',
+    '#.###.#.#.#.#..#..#..',
+    '#.###.#.###.#..#..#..',
+    '#.###.#.####.#..###..',
+    '#.....#..##....##.#..',
+    '#######.#..#.#..####.',
+]
+
+# Таблицы из стандарта, независимые от кодировщика: строки формата (старший бит
+# первым), координаты выравнивающих узоров, число блоков и длина ECC в блоке
+FORMAT_STRINGS = {
+    '111011111000100': ('L', 0), '111001011110011': ('L', 1), '111110110101010': ('L', 2), '111100010011101': ('L', 3),
+    '110011000101111': ('L', 4), '110001100011000': ('L', 5), '110110001000001': ('L', 6), '110100101110110': ('L', 7),
+    '101010000010010': ('M', 0), '101000100100101': ('M', 1), '101111001111100': ('M', 2), '101101101001011': ('M', 3),
+    '100010111111001': ('M', 4), '100000011001110': ('M', 5), '100111110010111': ('M', 6), '100101010100000': ('M', 7),
+}
+VERSION_7_INFO = '000111110010010100'
+ALIGNMENT = {1: [], 7: [6, 22, 38]}
+BLOCKS = {(1, 'M'): (1, 10), (1, 'L'): (1, 7), (7, 'M'): (4, 18)}
+MASKS = (
+    lambda i, j: (i + j) % 2 == 0,
+    lambda i, j: i % 2 == 0,
+    lambda i, j: j % 3 == 0,
+    lambda i, j: (i + j) % 3 == 0,
+    lambda i, j: (i // 2 + j // 3) % 2 == 0,
+    lambda i, j: (i * j) % 2 + (i * j) % 3 == 0,
+    lambda i, j: ((i * j) % 2 + (i * j) % 3) % 2 == 0,
+    lambda i, j: ((i + j) % 2 + (i * j) % 3) % 2 == 0,
+)
+
+def gf_mul(a, b):
+    result = 0
+    while b:
+        if b & 1:
+            result ^= a
+        a <<= 1
+        if a & 0x100:
+            a ^= 0x11D
+        b >>= 1
+    return result
+
+def is_function(version, size, x, y):
+    if (x < 9 and y < 9) or (x >= size - 8 and y < 9) or (x < 9 and y >= size - 8):
+        return True
+    if x == 6 or y == 6:
+        return True
+    positions = ALIGNMENT[version]
+    for cx in positions:
+        for cy in positions:
+            if (cx, cy) not in ((6, 6), (6, positions[-1]), (positions[-1], 6)) and abs(x - cx) <= 2 and abs(y - cy) <= 2:
+                return True
+    if version >= 7 and ((size - 11 <= x < size - 8 and y < 6) or (size - 11 <= y < size - 8 and x < 6)):
+        return True
+    return False
+
+# Независимое чтение матрицы: формат, маска, кодовые слова, проверка Рида-Соломона и данные
+def decode(matrix):
+    size = len(matrix)
+    version = (size - 17) // 4
+    dark = lambda x, y: matrix[y][x] == '#'
+    bits = [dark(8, i) for i in range(6)] + [dark(8, 7), dark(8, 8), dark(7, 8)] + [dark(14 - i, 8) for i in range(9, 15)]
+    ecl, mask = FORMAT_STRINGS[''.join('1' if bit else '0' for bit in reversed(bits))]
+    # Вторая копия формата совпадает с первой
+    copy = [dark(size - 1 - i, 8) for i in range(8)] + [dark(8, size - 15 + i) for i in range(8, 15)]
+    assert copy == bits and dark(8, size - 8)
+    if version >= 7:
+        info = ''.join('1' if dark(size - 11 + i % 3, i // 3) else '0' for i in reversed(range(18)))
+        assert info == VERSION_7_INFO
+
+    stream = []
+    right = size - 1
+    while right >= 1:
+        if right == 6:
+            right = 5
+        upward = (right + 1) & 2 == 0
+        for vert in range(size):
+            y = size - 1 - vert if upward else vert
+            for x in (right, right - 1):
+                if not is_function(version, size, x, y):
+                    stream.append(dark(x, y) != MASKS[mask](y, x))
+        right -= 2
+    codewords = [int(''.join('1' if bit else '0' for bit in stream[i:i + 8]), 2) for i in range(0, len(stream) - 7, 8)]
+
+    blocks_count, ecc_len = BLOCKS[version, ecl]
+    block_len = len(codewords) // blocks_count
+    assert len(codewords) % blocks_count == 0
+    blocks = [[] for _ in range(blocks_count)]
+    for i, codeword in enumerate(codewords):
+        blocks[i % blocks_count].append(codeword)
+    data = []
+    for block in blocks:
+        # Синдромы S_i = C(alpha^i) для корректного кода равны нулю
+        root = 1
+        for _ in range(ecc_len):
+            value = 0
+            for codeword in block:
+                value = gf_mul(value, root) ^ codeword
+            assert value == 0
+            root = gf_mul(root, 2)
+        data.extend(block[:block_len - ecc_len])
+
+    bits = ''.join(f'{codeword:08b}' for codeword in data)
+    assert bits[:4] == '0100'
+    length = int(bits[4:12], 2)
+    payload = bytes(int(bits[12 + i * 8:20 + i * 8], 2) for i in range(length))
+    return version, ecl, mask, payload
+
+def to_rows(modules):
+    return [''.join('#' if cell else '.' for cell in row) for row in modules]
+
+def test_known_matrix(wg):
+    assert to_rows(wg.qr_encode('wg')) == WG_MATRIX
+    assert decode(WG_MATRIX) == (1, 'M', 2, b'wg')
+
+@pytest.mark.parametrize('mask', range(8))
+def test_explicit_mask_and_level(wg, mask):
+    assert decode(to_rows(wg.qr_encode(b'wg', ecl='L', mask=mask))) == (1, 'L', mask, b'wg')
+
+def test_version_7_with_blocks(wg):
+    payload = bytes(range(32, 142))
+    rows = to_rows(wg.qr_encode(payload, mask=2))
+    assert len(rows) == 45
+    assert decode(rows) == (7, 'M', 2, payload)
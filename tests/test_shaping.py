@@ -0,0 +1,137 @@
+import os
+
+import pytest
+
+PROFILES = {
+    'slow': {'rate': '5mbit', 'upload': '2mbit'},
+    'down': {'rate': '10mbit'},
+    'mtu': {'mtu': 1380},
+}
+
+CONFIG = """[Interface]
+PrivateKey = yAnz5TF+lXXJte14tji3zlMNq+hd2rYUIgJBgB3fBmk=
+Address = 10.8.0.1/24, fd00::1/64
+ListenPort = 51820
+
+# Client: a
+# Profile: slow
+[Peer]
+PublicKey = a
+AllowedIPs = 10.8.0.2/32
+
+# Client: b
+# Profile: down
+[Peer]
+PublicKey = b
+AllowedIPs = 10.8.0.3/32
+
+# Client: c
+[Peer]
+PublicKey = c
+AllowedIPs = 10.8.0.4/32
+
+# Client: d
+# Profile: slow
+[Peer]
+PublicKey = d
+AllowedIPs = fd00::a/128
+
+# Client: e
+# Profile: mtu
+[Peer]
+PublicKey = e
+AllowedIPs = 10.8.0.5/32
+
+# Client: f
+# Profile: gone
+[Peer]
+PublicKey = f
+AllowedIPs = 10.8.0.6/32
+"""
+
+@pytest.fixture
+def shaping(wg, monkeypatch, tmp_path):
+    conf = tmp_path / 'wg0.conf'
+    conf.write_text(CONFIG)
+    monkeypatch.setattr(wg, 'CONF', str(conf))
+    monkeypatch.setattr(wg, 'PROFILES', dict(PROFILES))
+    monkeypatch.setattr(wg, 'SHAPING_LINK_RATE', None)
+    monkeypatch.setattr(wg, '_backends', {})
+    monkeypatch.setenv('WG_MANAGER_BACKEND', 'fake')
+    monkeypatch.delenv('WG_MANAGER_FAKE_STATE', raising=False)
+    return wg
+
+def batch_lines(wg):
+    return wg.build_shaping_batch('wg0', wg.load_config()).splitlines()
+
+def test_classes_and_hash_buckets(shaping):
+    lines = batch_lines(shaping)
+    classes = [line for line in lines if line.startswith('class add')]
+    # Классы только для клиентов с rate, по порядку в конфиге начиная с SHAPING_FIRST_CLASS
+    assert classes == [
+        "class add dev wg0 parent 1: classid 1:10 htb rate 5000000bit ceil 5000000bit",
+        "class add dev wg0 parent 1: classid 1:11 htb rate 10000000bit ceil 10000000bit",
+        "class add dev wg0 parent 1: classid 1:12 htb rate 5000000bit ceil 5000000bit",
+    ]
+    # Фильтр клиента лежит в корзине по последнему байту адреса своей хэш-таблицы
+    assert "filter add dev wg0 parent 1: prio 1 protocol ip u32 ht 2:2: match ip dst 10.8.0.2/32 flowid 1:10" in lines
+    assert "filter add dev wg0 parent 1: prio 1 protocol ip u32 ht 2:3: match ip dst 10.8.0.3/32 flowid 1:11" in lines
+    assert "filter add dev wg0 parent 1: prio 2 protocol ipv6 u32 ht 3:a: match ip6 dst fd00::a/128 flowid 1:12" in lines
+    assert "filter add dev wg0 parent 1: prio 1 handle 2: protocol ip u32 divisor 256" in lines
+    assert ("filter add dev wg0 parent 1: prio 1 protocol ip u32 match u32 0 0 hashkey mask 0x000000ff at 16 link 2:"
+            in lines)
+    assert ("filter add dev wg0 parent 1: prio 2 protocol ipv6 u32 match u32 0 0 hashkey mask 0x000000ff at 36 link 3:"
+            in lines)
+    # Клиенты без ограничения скорости, с неизвестным профилем и без профиля пропускаются
+    assert not any(address in line for line in lines for address in ('10.8.0.4', '10.8.0.5', '10.8.0.6'))
+
+def test_ingress_policing(shaping):
+    lines = batch_lines(shaping)
+    ingress = [line for line in lines if 'parent ffff:' in line]
+    assert ingress[0] == "filter del dev wg0 parent ffff:"
+    assert ("filter add dev wg0 parent ffff: prio 1 protocol ip u32 ht 2:2: match ip src 10.8.0.2/32 "
+            "police rate 2000000bit burst 25000 drop flowid :1") in ingress
+    assert ("filter add dev wg0 parent ffff: prio 2 protocol ipv6 u32 ht 3:a: match ip6 src fd00::a/128 "
+            "police rate 2000000bit burst 25000 drop flowid :1") in ingress
+    assert "filter add dev wg0 parent ffff: prio 1 protocol ip u32 match u32 0 0 hashkey mask 0x000000ff at 12 link 2:" in ingress
+    # У профиля down нет upload - на входе клиент b не ограничивается
+    assert not any('10.8.0.3' in line for line in ingress)
+    assert lines.index("qdisc replace dev wg0 handle ffff: ingress") < lines.index("filter del dev wg0 parent ffff:")
+
+def test_default_class_without_link_rate(shaping):
+    lines = batch_lines(shaping)
+    # Без SHAPING_LINK_RATE трафик без класса идёт мимо HTB и не ограничивается
+    assert "qdisc replace dev wg0 root handle 1: htb" in lines
+    assert not any('default' in line or 'classid 1:2 ' in line for line in lines)
+
+def test_default_class_with_link_rate(shaping, monkeypatch):
+    monkeypatch.setattr(shaping, 'SHAPING_LINK_RATE', '1gbit')
+    lines = batch_lines(shaping)
+    assert lines[1:4] == [
+        "qdisc replace dev wg0 root handle 1: htb default 2",
+        "class add dev wg0 parent 1: classid 1:1 htb rate 1000000000bit",
+        "class add dev wg0 parent 1:1 classid 1:2 htb rate 1000000000bit",
+    ]
+    assert "class add dev wg0 parent 1:1 classid 1:10 htb rate 5000000bit ceil 5000000bit" in lines
+
+def test_sync_shaping_clears_when_profiles_removed(shaping, monkeypatch):
+    config = shaping.load_config()
+    assert shaping.sync_shaping(config) == (True, '')
+    backend = shaping.get_backend('wg0')
+    assert 'classid 1:10' in backend.shaping
+    assert os.path.exists(shaping.get_shaping_marker())
+
+    monkeypatch.setattr(shaping, 'PROFILES', {})
+    backend.shaping = None
+    # Изменение отдельных пиров правила не трогает, полная синхронизация снимает их
+    assert shaping.sync_shaping(config, [config.peers[0]]) == (True, '')
+    assert backend.shaping is None
+    assert shaping.sync_shaping(config) == (True, '')
+    assert backend.shaping == shaping.build_shaping_clear('wg0')
+    assert "qdisc del dev wg0 root" in backend.shaping and "qdisc del dev wg0 ingress" in backend.shaping
+    assert not os.path.exists(shaping.get_shaping_marker())
+
+    # Правил больше нет - следующая синхронизация tc не вызывает
+    backend.shaping = None
+    assert shaping.sync_shaping(config) == (True, '')
+    assert backend.shaping is None
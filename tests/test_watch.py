@@ -0,0 +1,104 @@
+import json
+import sys
+
+import pytest
+
+KEY_A = "A" * 43 + "="
+KEY_B = "B" * 43 + "="
+OFFLINE = 180
+
+# Снимок wg show dump: строка интерфейса и строки пиров (ключ, эндпоинт, рукопожатие, rx)
+def dump(*peers):
+    lines = ["cHJpdmF0ZQ==\tcHVibGlj\t51820\toff"]
+    for key, endpoint, handshake, rx in peers:
+        lines.append("\t".join([key, "(none)", endpoint or "(none)", "10.8.0.2/32", str(handshake), str(rx), "0", "off"]))
+    return "\n".join(lines) + "\n"
+
+@pytest.fixture
+def watcher(wg):
+    return wg.PeerWatcher('wg0', OFFLINE)
+
+def test_first_snapshot_is_silent(watcher):
+    assert watcher.poll(dump((KEY_A, "1.1.1.1:1", 990, 10)), now=1000) == []
+    # Подключённый в первом снимке клиент не даёт повторного connect
+    assert watcher.poll(dump((KEY_A, "1.1.1.1:1", 995, 20)), now=1005) == []
+    assert KEY_A in watcher.online
+
+def test_connect(watcher):
+    watcher.poll(dump((KEY_A, None, 0, 0)), now=1000)
+    events = watcher.poll(dump((KEY_A, "1.1.1.1:1", 1004, 100)), now=1005)
+    assert [event['event'] for event in events] == ['connect']
+    event = events[0]
+    assert event['public_key'] == KEY_A and event['interface'] == 'wg0'
+    assert event['endpoint'] == "1.1.1.1:1" and event['latest_handshake'] == 1004 and event['rx'] == 100
+    assert event['time'] == 1005
+
+def test_roam(watcher):
+    watcher.poll(dump((KEY_A, "1.1.1.1:1", 1000, 0)), now=1000)
+    events = watcher.poll(dump((KEY_A, "2.2.2.2:2", 1010, 50)), now=1010)
+    assert [event['event'] for event in events] == ['roam']
+    assert events[0]['previous_endpoint'] == "1.1.1.1:1" and events[0]['endpoint'] == "2.2.2.2:2"
+    # Новое рукопожатие с тем же эндпоинтом - не роуминг
+    assert watcher.poll(dump((KEY_A, "2.2.2.2:2", 1100, 60)), now=1100) == []
+
+def test_timeout_from_deadline_without_dump_changes(watcher):
+    text = dump((KEY_A, "1.1.1.1:1", 1000, 0), (KEY_B, "3.3.3.3:3", 1100, 0))
+    watcher.poll(text, now=1100)
+    # Строки не менялись, срок первого клиента истёк, второго - ещё нет
+    assert watcher.poll(text, now=1000 + OFFLINE - 1) == []
+    events = watcher.poll(text, now=1000 + OFFLINE)
+    assert [(event['event'], event['public_key'], event['reason']) for event in events] == [('disconnect', KEY_A, 'timeout')]
+    assert events[0]['online_since'] == 1000 and events[0]['endpoint'] == "1.1.1.1:1"
+    assert KEY_A not in watcher.online and KEY_B in watcher.online
+
+def test_new_handshake_postpones_timeout(watcher):
+    watcher.poll(dump((KEY_A, "1.1.1.1:1", 1000, 0)), now=1000)
+    assert watcher.poll(dump((KEY_A, "1.1.1.1:1", 1150, 10)), now=1150) == []
+    # Устаревший срок из кучи пропускается
+    assert watcher.poll(dump((KEY_A, "1.1.1.1:1", 1150, 10)), now=1000 + OFFLINE) == []
+    events = watcher.poll(dump((KEY_A, "1.1.1.1:1", 1150, 10)), now=1150 + OFFLINE)
+    assert [event['reason'] for event in events] == ['timeout']
+    assert events[0]['duration'] == 150
+
+def test_changed_line_with_old_handshake_disconnects(watcher):
+    watcher.poll(dump((KEY_A, "1.1.1.1:1", 1000, 0)), now=1000)
+    # Счётчик изменился, но рукопожатие старше порога
+    events = watcher.poll(dump((KEY_A, "1.1.1.1:1", 1000, 5)), now=1000 + OFFLINE + 10)
+    assert [(event['event'], event['reason']) for event in events] == [('disconnect', 'timeout')]
+
+def test_removed_peer_disconnects(watcher):
+    watcher.poll(dump((KEY_A, "1.1.1.1:1", 1000, 7), (KEY_B, None, 0, 0)), now=1000)
+    events = watcher.poll(dump((KEY_B, None, 0, 0)), now=1010)
+    assert [(event['event'], event['reason']) for event in events] == [('disconnect', 'removed')]
+    # Данные берутся из последней строки удалённого пира
+    assert events[0]['rx'] == 7 and events[0]['endpoint'] == "1.1.1.1:1"
+    assert watcher.poll(dump(), now=1020) == []
+
+# Команда-обработчик записывает stdin и переменные окружения в файл
+HOOK = ("import json, os, sys; "
+        "open(sys.argv[1], 'a').write(json.dumps({'stdin': json.load(sys.stdin), 'env': os.environ['WG_EVENT']}) + '\\n')")
+
+def test_hook_runner_passes_event(wg, tmp_path):
+    out = tmp_path / 'events.jsonl'
+    runner = wg.HookRunner({'connect': [[sys.executable, '-c', HOOK, str(out)]],
+                            '*': [[sys.executable, '-c', HOOK, str(out)]]})
+    runner.submit({'event': 'connect', 'public_key': KEY_A, 'endpoint': None})
+    runner.submit({'event': 'roam', 'public_key': KEY_A, 'endpoint': "2.2.2.2:2"})
+    runner.close()
+    calls = [json.loads(line) for line in out.read_text().splitlines()]
+    assert sorted(call['env'] for call in calls) == ['connect', 'connect', 'roam']
+    assert all(call['stdin']['public_key'] == KEY_A for call in calls)
+
+def test_hook_runner_drops_over_queue_limit(wg):
+    runner = wg.HookRunner({'*': [[sys.executable, '-c', 'import time; time.sleep(0.3)']]}, workers=1, queue=1)
+    for _ in range(3):
+        runner.submit({'event': 'connect', 'public_key': KEY_A})
+    runner.close()
+    assert runner.dropped == 2
+
+def test_hook_timeout_is_reported(wg, monkeypatch, capsys):
+    monkeypatch.setattr(wg, 'WATCH_HOOK_TIMEOUT', 0.2)
+    runner = wg.HookRunner({'disconnect': [[sys.executable, '-c', 'import time; time.sleep(5)']]})
+    runner.submit({'event': 'disconnect', 'public_key': KEY_A})
+    runner.close()
+    assert 'timed out' in capsys.readouterr().err
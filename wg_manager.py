@@ -0,0 +1,5964 @@
+#!/usr/bin/env python3
+import os
+import re
+import subprocess
+import sys
+import datetime
+import time
+import shutil
+import base64
+import binascii
+import csv
+import json
+import tempfile
+import ipaddress
+import random
+import socket
+import hashlib
+import hmac
+import marshal
+import fnmatch
+import shlex
+import abc
+import argparse
+import contextlib
+import signal
+import threading
+import urllib.parse
+import collections
+import io
+import struct
+import zlib
+import heapq
+import bisect
+import array
+import mmap
+import itertools
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Модули отдельных команд (asyncio, sqlite3, пулы, архивы, профилировщик) импортируются
+# внутри функций, которые ими пользуются: короткие команды их не загружают
+
+# Настройки
+CONF = "./wg0.conf"
+SUBNET = "10.8.0.0/24"  # Подсеть клиентов (IPv4 или IPv6 в нотации CIDR)
+IP_STRATEGY = "lowest"  # Стратегия выдачи адресов: lowest или random
+KEYS_DIR = "./keys"
+ENDPOINT = "92.113.151.201:51820"  # Внешний эндпоинт сервера
+INDEX_CACHE = True  # Кэш разобранного конфига рядом с ним (wg0.conf.idx)
+BACKEND = "wg"  # Управление пирами ядра: wg или fake (в памяти, для тестов)
+# Шарды: список (конфиг, подсеть, эндпоинт) для работы с несколькими интерфейсами,
+# например [("./wg0.conf", "10.8.0.0/24", "92.113.151.201:51820"),
+#           ("./wg1.conf", "10.8.1.0/24", "92.113.151.201:51821")]. Пустой список - один CONF.
+SHARDS = []
+SHARD_PLACEMENT = "peers"  # Выбор шарда для нового клиента: peers (меньше пиров) или traffic
+CLIENT_STORE = "auto"  # Хранилище клиентов: sqlite (KEYS_DIR/clients.db), files (<имя>.conf) или auto
+# Профили клиентов: rate - скорость к клиенту, upload - от клиента (ограничиваются
+# через tc), mtu, keepalive и dns попадают в конфиг клиента. Например:
+# {"slow": {"rate": "5mbit", "upload": "2mbit", "mtu": 1380, "keepalive": 25}}
+PROFILES = {}
+SHAPING_LINK_RATE = None  # Полоса интерфейса для HTB (например, "1gbit"); None - трафик без профиля не ограничивается
+
+# Цвета для терминала
+class Colors:
+    HEADER = '\033[95m'
+    BLUE = '\033[94m'
+    CYAN = '\033[96m'
+    GREEN = '\033[92m'
+    WARNING = '\033[93m'
+    FAIL = '\033[91m'
+    ENDC = '\033[0m'
+    BOLD = '\033[1m'
+    UNDERLINE = '\033[4m'
+
+# Создание директории для ключей, если её нет
+def ensure_keys_dir(path=None):
+    path = path or KEYS_DIR
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+# Очистка экрана
+def clear_screen():
+    command = 'cls' if os.name == 'nt' else 'clear'
+    with timed('command', command):
+        os.system(command)
+
+# Декоратор для красивого вывода функций
+def menu_decorator(func):
+    def wrapper(*args, **kwargs):
+        clear_screen()
+        print_header()
+        with timed('operation', func.__name__):
+            result = func(*args, **kwargs)
+        return result
+    return wrapper
+
+# Красивый заголовок
+def print_header():
+    width = shutil.get_terminal_size().columns
+    print(Colors.CYAN + "=" * width + Colors.ENDC)
+    title = "WireGuard Manager"
+    print(Colors.BOLD + Colors.GREEN + title.center(width) + Colors.ENDC)
+    print(Colors.CYAN + "=" * width + Colors.ENDC)
+    print()
+
+# Инструментирование: время каждой операции меню/CLI и каждой внешней команды
+# (число вызовов и суммарное время по командам), JSON-лог и файл трассировки.
+# Лог включается через --log или WG_MANAGER_LOG (путь или - для stderr),
+# трассировка - через --trace или WG_MANAGER_TRACE.
+_stats = {'operation': {}, 'command': {}, 'stage': {}}
+_log_sinks = {'log': None, 'trace': None}
+
+def open_log_sink(kind, target):
+    if not target:
+        return
+    if target == '-':
+        _log_sinks[kind] = sys.stderr
+    else:
+        _log_sinks[kind] = open(target, 'a', buffering=1)
+
+# Строка JSON-лога. Поля detail (аргументы команд, stderr) попадают только в трассировку.
+def log_event(event, detail=None, **fields):
+    log, trace = _log_sinks['log'], _log_sinks['trace']
+    if log is None and trace is None:
+        return
+    record = {'ts': round(time.time(), 6), 'pid': os.getpid(), 'event': event}
+    record.update(fields)
+    if log is not None:
+        log.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    if trace is not None:
+        if detail:
+            record.update(detail)
+        trace.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+def _record(kind, name, elapsed):
+    entry = _stats[kind].get(name)
+    if entry is None:
+        entry = _stats[kind][name] = [0, 0.0]
+    entry[0] += 1
+    entry[1] += elapsed
+
+# Замер участка кода: operation - действие пользователя, stage - этап внутри него
+@contextlib.contextmanager
+def timed(kind, name, **fields):
+    started = time.perf_counter()
+    status = 'ok'
+    try:
+        yield
+    except BaseException as e:
+        status = 'interrupted' if isinstance(e, (KeyboardInterrupt, SystemExit)) else 'error'
+        fields['error'] = str(e) or type(e).__name__
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        _record(kind, name, elapsed)
+        log_event(kind, name=name, elapsed_ms=round(elapsed * 1000, 3), status=status, **fields)
+
+# Имя команды для статистики: программа и подкоманда, sudo учитывается отдельно
+def command_name(command):
+    words = command.split() if isinstance(command, str) else [str(word) for word in command]
+    name = []
+    for word in words:
+        name.append(os.path.basename(word) if not name else word)
+        if name[-1] != 'sudo' and (len(name) >= 3 or (len(name) == 2 and name[0] != 'sudo')):
+            break
+    while len(name) > 1 and name[-1].startswith('-'):
+        name.pop()
+    return " ".join(name)
+
+# Запуск внешней команды с учётом времени (аналог subprocess.run)
+def run_external(command, **kwargs):
+    name = command_name(command)
+    started = time.perf_counter()
+    returncode = None
+    stderr = None
+    try:
+        result = subprocess.run(command, **kwargs)
+        returncode = result.returncode
+        stderr = result.stderr
+        return result
+    finally:
+        elapsed = time.perf_counter() - started
+        _record('command', name, elapsed)
+        detail = {'args': command}
+        if returncode and stderr:
+            detail['stderr'] = (stderr if isinstance(stderr, str) else stderr.decode(errors='replace'))[-2000:]
+        log_event('command', detail, name=name, elapsed_ms=round(elapsed * 1000, 3),
+                  status='ok' if returncode == 0 else 'error', returncode=returncode)
+
+# Сводка по операциям и командам: число вызовов и суммарное время
+def instrumentation_summary():
+    return {
+        kind: {name: {'calls': calls, 'total_ms': round(total * 1000, 3)} for name, (calls, total) in entries.items()}
+        for kind, entries in _stats.items()
+    }
+
+def close_instrumentation():
+    log_event('summary', **instrumentation_summary())
+    for kind, sink in _log_sinks.items():
+        if sink is not None and sink is not sys.stderr:
+            sink.close()
+        _log_sinks[kind] = None
+
+# Профилирование: --profile-out FILE.prof сохраняет статистику cProfile (pstats,
+# snakeviz), FILE.folded - свёрнутые стеки для flamegraph.pl/speedscope,
+# --profile выводит топ функций по накопленному времени в stderr
+PROFILE_INTERVAL = 0.005  # Не чаще интервала переключения потоков (sys.getswitchinterval)
+
+# Выборка стеков по реальному времени: ожидание sudo, systemctl и других
+# процессов тоже попадает в профиль. Стеки всех потоков читает отдельный поток
+# через sys._current_frames(), без сигналов: таймер не прерывает системные
+# вызовы и не мешает чужим обработчикам SIGALRM. Корень стека - имя потока.
+class StackSampler:
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            frames.append(names.get(ident, f"thread-{ident}"))
+            stack = ";".join(reversed(frames))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+@contextlib.contextmanager
+def profiling(target):
+    if target is None:
+        yield
+        return
+    folded = target.endswith(('.folded', '.collapsed'))
+    if folded:
+        profiler = StackSampler()
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+    profiler.enable() if not folded else profiler.start()
+    try:
+        yield
+    finally:
+        profiler.disable() if not folded else profiler.stop()
+        if folded:
+            profiler.write(target)
+        elif target == '-':
+            import pstats
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(30)
+        else:
+            profiler.dump_stats(target)
+        log_event('profile', path=target)
+
+# Проверка доступности команды wg
+def check_wg_command():
+    try:
+        run_external(["wg", "--version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        print(f"{Colors.FAIL}Ошибка: команда 'wg' не найдена. Установите WireGuard и добавьте wg в PATH.{Colors.ENDC}")
+        input("\nНажмите Enter для выхода...")
+        sys.exit(1)
+
+# Выполнение команды и возврат результата
+def run_command(command):
+    result = run_external(command, shell=True, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        print(f"{Colors.FAIL}Ошибка при выполнении команды: {command}{Colors.ENDC}")
+        print(f"{Colors.FAIL}{result.stderr}{Colors.ENDC}")
+        input("\nНажмите Enter для продолжения...")
+        return None
+    return result.stdout.strip()
+
+# Работа с ключами Curve25519 (аналог wg genkey / wg pubkey / wg genpsk без запуска процессов)
+# Публичный ключ X25519 равен u-координате k*B, где B - базовая точка. Считаем k*B
+# на эквивалентной кривой Эдвардса по заранее вычисленной таблице кратных B
+# (64 окна по 4 бита), затем переводим в u = (1 + y) / (1 - y).
+_P = 2 ** 255 - 19
+_D2 = 2 * (-121665 * pow(121666, _P - 2, _P)) % _P
+_BASE_X = 15112221349535400772501151409588531511454012693041857206046113283949847762202
+_BASE_Y = 46316835694926478169428394003475163141307993866256225615783033603165251855960
+_KEY_LEN = 32
+
+# Таблица кратных базовой точки, строится при первом использовании
+_base_table = []
+
+# Кэш публичного ключа сервера на время жизни процесса
+_server_pubkey_cache = {}
+
+def _decode_key(key):
+    try:
+        raw = base64.b64decode(key.strip(), validate=True)
+    except (binascii.Error, ValueError):
+        raw = b''
+    if len(raw) != _KEY_LEN:
+        raise ValueError(f"Некорректный ключ: {key!r}")
+    return raw
+
+def _encode_key(raw):
+    return base64.b64encode(raw).decode('ascii')
+
+def _clamp(raw):
+    k = bytearray(raw)
+    k[0] &= 248
+    k[31] &= 127
+    k[31] |= 64
+    return bytes(k)
+
+# Обращение сразу многих элементов поля за одну модульную инверсию (трюк Монтгомери)
+def _batch_invert(values):
+    prefix = []
+    acc = 1
+    for v in values:
+        prefix.append(acc)
+        acc = acc * v % _P
+    inv = pow(acc, _P - 2, _P)
+    result = [0] * len(values)
+    for i in range(len(values) - 1, -1, -1):
+        result[i] = inv * prefix[i] % _P
+        inv = inv * values[i] % _P
+    return result
+
+# Сложение точек в расширенных координатах (X, Y, Z, T), формула add-2008-hwcd-3
+def _edwards_add(p, q):
+    x1, y1, z1, t1 = p
+    x2, y2, z2, t2 = q
+    a = (y1 - x1) * (y2 - x2) % _P
+    b = (y1 + x1) * (y2 + x2) % _P
+    c = t1 * _D2 * t2 % _P
+    d = 2 * z1 * z2 % _P
+    e, f, g, h = b - a, d - c, d + c, b + a
+    return (e * f % _P, g * h % _P, f * g % _P, e * h % _P)
+
+# Сложение с табличной точкой в виде (y + x, y - x, 2*d*x*y), Z = 1
+def _edwards_add_cached(p, q):
+    x1, y1, z1, t1 = p
+    yplusx, yminusx, xy2d = q
+    a = (y1 - x1) * yminusx % _P
+    b = (y1 + x1) * yplusx % _P
+    c = t1 * xy2d % _P
+    d = 2 * z1
+    e, f, g, h = b - a, d - c, d + c, b + a
+    return (e * f % _P, g * h % _P, f * g % _P, e * h % _P)
+
+def _get_base_table():
+    if _base_table:
+        return _base_table
+    points = []
+    step = (_BASE_X, _BASE_Y, 1, _BASE_X * _BASE_Y % _P)
+    for _ in range(64):
+        multiple = step
+        for _ in range(15):
+            points.append(multiple)
+            multiple = _edwards_add(multiple, step)
+        step = multiple
+    inverses = _batch_invert([p[2] for p in points])
+    table = []
+    for i, (x, y, _, _) in enumerate(points):
+        x = x * inverses[i] % _P
+        y = y * inverses[i] % _P
+        table.append(((y + x) % _P, (y - x) % _P, x * y * _D2 % _P))
+    _base_table[:] = [table[i:i + 15] for i in range(0, len(table), 15)]
+    return _base_table
+
+def _public_from_raw_batch(raws):
+    table = _get_base_table()
+    nums = []
+    dens = []
+    for raw in raws:
+        scalar = int.from_bytes(_clamp(raw), 'little')
+        point = (0, 1, 1, 0)
+        for window in table:
+            nibble = scalar & 15
+            if nibble:
+                point = _edwards_add_cached(point, window[nibble - 1])
+            scalar >>= 4
+        _, y, z, _ = point
+        nums.append((z + y) % _P)
+        dens.append((z - y) % _P)
+    return [(n * inv % _P).to_bytes(_KEY_LEN, 'little') for n, inv in zip(nums, _batch_invert(dens))]
+
+# Генерация приватного ключа (как wg genkey)
+def generate_private_key():
+    return _encode_key(_clamp(os.urandom(_KEY_LEN)))
+
+# Генерация общего ключа PSK (как wg genpsk)
+def generate_preshared_key():
+    return _encode_key(os.urandom(_KEY_LEN))
+
+# Получение публичного ключа из приватного (как wg pubkey)
+def public_key_from_private(private_key):
+    return _encode_key(_public_from_raw_batch([_decode_key(private_key)])[0])
+
+# Пакетное получение публичных ключей
+def public_keys_from_private(private_keys):
+    raws = [_decode_key(key) for key in private_keys]
+    if not raws:
+        return []
+    return [_encode_key(raw) for raw in _public_from_raw_batch(raws)]
+
+# Пакетная генерация ключей клиентов: список (приватный, публичный, PSK)
+def generate_keypairs(count, with_psk=True):
+    privs = [_clamp(os.urandom(_KEY_LEN)) for _ in range(count)]
+    with timed('stage', 'generate_keys', count=count):
+        pubs = _public_from_raw_batch(privs) if privs else []
+    return [
+        (_encode_key(priv), _encode_key(pub), generate_preshared_key() if with_psk else None)
+        for priv, pub in zip(privs, pubs)
+    ]
+
+# Публичный ключ сервера (вычисляется один раз за процесс)
+def get_server_public_key(server_priv):
+    if server_priv not in _server_pubkey_cache:
+        _server_pubkey_cache[server_priv] = public_key_from_private(server_priv)
+    return _server_pubkey_cache[server_priv]
+
+# Модель серверного конфига: один проход по файлу, секции [Peer] как компактные записи.
+# Исходные строки каждой секции сохраняются, поэтому перезапись конфига не теряет
+# комментарии и неизвестные ключи.
+class Peer:
+    __slots__ = ('name', 'profile', 'public_key', 'preshared_key', 'allowed_ips', 'endpoint', 'persistent_keepalive', '_lines')
+
+    def __init__(self, lines=None, name=None, profile=None):
+        self.name = name
+        self.profile = profile
+        self.public_key = None
+        self.preshared_key = None
+        self.allowed_ips = []
+        self.endpoint = None
+        self.persistent_keepalive = None
+        self._lines = lines if lines is not None else []
+
+    # Исходные строки секции; из индекса приходит цельный текст, он делится на строки по требованию
+    @property
+    def lines(self):
+        if isinstance(self._lines, str):
+            self._lines = self._lines.splitlines(True)
+        return self._lines
+
+    # Адрес клиента - первый маршрут хоста (/32 или /128) из AllowedIPs
+    @property
+    def ip(self):
+        for entry in self.allowed_ips:
+            address, _, prefix = entry.partition('/')
+            if prefix in ('32', '128') or not prefix:
+                return address
+        return None
+
+    def set_value(self, key, value):
+        if key == 'publickey':
+            self.public_key = value
+        elif key == 'presharedkey':
+            self.preshared_key = value
+        elif key == 'allowedips':
+            self.allowed_ips.extend(entry.strip() for entry in value.split(',') if entry.strip())
+        elif key == 'endpoint':
+            self.endpoint = value
+        elif key == 'persistentkeepalive':
+            self.persistent_keepalive = value
+
+    def text(self):
+        if isinstance(self._lines, str):
+            return self._lines
+        return "".join(self._lines)
+
+class WgConfig:
+    def __init__(self):
+        self.header_lines = []
+        self.has_interface = False
+        self.interface = {}
+        self.addresses = []
+        self.peers = []
+        self.by_name = {}
+        self.by_ip = {}
+        self.by_pubkey = {}
+
+    @classmethod
+    def parse(cls, content):
+        config = cls()
+        config._parse_into(content)
+        return config
+
+    def _parse_into(self, content):
+        target = self.header_lines if not self.peers else self.peers[-1].lines
+        peer = self.peers[-1] if self.peers else None
+        section = '[peer]' if peer else None
+        pending = []
+        for line in content.splitlines(True):
+            stripped = line.strip()
+            if not stripped or stripped.startswith('#'):
+                pending.append(line)
+                continue
+            if stripped.startswith('['):
+                section = stripped.lower()
+                if section == '[interface]':
+                    self.has_interface = True
+                if section == '[peer]':
+                    if peer is not None:
+                        self._index(peer)
+                    name = profile = None
+                    for comment in pending:
+                        comment = comment.strip()
+                        if comment.startswith('# Client:'):
+                            name = comment.replace('# Client:', '').strip()
+                        elif comment.startswith('# Profile:'):
+                            profile = comment.replace('# Profile:', '').strip() or None
+                    peer = Peer(pending + [line], name, profile)
+                    self.peers.append(peer)
+                    target = peer.lines
+                    pending = []
+                    continue
+            target.extend(pending)
+            pending = []
+            target.append(line)
+            if '=' not in stripped:
+                continue
+            key, value = stripped.split('=', 1)
+            key = key.strip().lower()
+            value = value.split('#', 1)[0].strip()
+            if section == '[peer]' and peer is not None:
+                peer.set_value(key, value)
+            elif section == '[interface]' and peer is None:
+                if key == 'address':
+                    self.addresses.extend(entry.strip() for entry in value.split(',') if entry.strip())
+                self.interface.setdefault(key, value)
+        target.extend(pending)
+        if peer is not None:
+            self._index(peer)
+
+    def _index(self, peer):
+        if peer.name:
+            self.by_name[peer.name] = peer
+        if peer.public_key:
+            self.by_pubkey[peer.public_key] = peer
+        for entry in peer.allowed_ips:
+            address, _, prefix = entry.partition('/')
+            self.by_ip[address if prefix in ('32', '128', '') else entry] = peer
+
+    def _unindex(self, peer):
+        if peer.name and self.by_name.get(peer.name) is peer:
+            del self.by_name[peer.name]
+        if peer.public_key and self.by_pubkey.get(peer.public_key) is peer:
+            del self.by_pubkey[peer.public_key]
+        for entry in peer.allowed_ips:
+            address, _, prefix = entry.partition('/')
+            key = address if prefix in ('32', '128', '') else entry
+            if self.by_ip.get(key) is peer:
+                del self.by_ip[key]
+
+    def interface_value(self, key):
+        return self.interface.get(key.lower())
+
+    # Добавление секций [Peer] из готового текста (например, render_peer_block)
+    def add_peer_block(self, text):
+        count = len(self.peers)
+        if self.peers:
+            last = self.peers[-1].lines
+        else:
+            last = self.header_lines
+        if last and not last[-1].endswith('\n'):
+            last[-1] += '\n'
+        self._parse_into(text)
+        return self.peers[count:]
+
+    def remove_peers(self, peers):
+        removed = set(id(peer) for peer in peers)
+        for peer in peers:
+            self._unindex(peer)
+        self.peers = [peer for peer in self.peers if id(peer) not in removed]
+
+    # Поиск клиента по имени, IP или публичному ключу
+    def find(self, key):
+        return self.by_name.get(key) or self.by_ip.get(key) or self.by_pubkey.get(key)
+
+    def text(self):
+        return "".join(self.header_lines) + "".join(peer.text() for peer in self.peers)
+
+# Индекс конфига хранит разобранные секции вместе с размером, mtime и inode файла.
+# Если файл не менялся, индекс загружается вместо разбора; если к файлу только
+# дописали новые секции, разбирается лишь хвост начиная с последней известной секции.
+# Что дописаны только секции, проверяется по хэшу всего проиндексированного содержимого.
+_INDEX_VERSION = 3
+
+def get_index_path(path=None):
+    return f"{path or CONF}.idx"
+
+def _config_snapshot(config, st, tail_offset, content_hash):
+    peers = [
+        (peer.name, peer.profile, peer.public_key, peer.preshared_key, peer.allowed_ips,
+         peer.endpoint, peer.persistent_keepalive, peer.text())
+        for peer in config.peers
+    ]
+    return (_INDEX_VERSION, st.st_size, st.st_mtime_ns, st.st_ino, tail_offset, content_hash,
+            "".join(config.header_lines), config.has_interface, config.interface, config.addresses, peers)
+
+def _config_from_snapshot(data):
+    config = WgConfig()
+    config.header_lines = data[6].splitlines(True)
+    config.has_interface = data[7]
+    config.interface = data[8]
+    config.addresses = data[9]
+    peers = config.peers
+    for name, profile, public_key, preshared_key, allowed_ips, endpoint, keepalive, text in data[10]:
+        peer = Peer(text, name, profile)
+        peer.public_key = public_key
+        peer.preshared_key = preshared_key
+        peer.allowed_ips = allowed_ips
+        peer.endpoint = endpoint
+        peer.persistent_keepalive = keepalive
+        peers.append(peer)
+    # Индексы строим напрямую, без вызова _index на каждую секцию
+    by_ip = config.by_ip
+    for peer in peers:
+        for entry in peer.allowed_ips:
+            address, _, prefix = entry.partition('/')
+            by_ip[address if prefix in ('32', '128', '') else entry] = peer
+    config.by_name = {peer.name: peer for peer in peers if peer.name}
+    config.by_pubkey = {peer.public_key: peer for peer in peers if peer.public_key}
+    return config
+
+def _read_index(path):
+    try:
+        with open(get_index_path(path), 'rb') as f:
+            data = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(data, tuple) or len(data) != 11 or data[0] != _INDEX_VERSION:
+        return None
+    return data
+
+# content_hash - SHA-256 содержимого файла, если он уже посчитан при чтении
+def _index_data(config, st, content_hash=None):
+    tail = config.peers[-1].text().encode() if config.peers else b''
+    tail_offset = st.st_size - len(tail)
+    content_hash = content_hash or hashlib.sha256(config.text().encode()).hexdigest()
+    return marshal.dumps(_config_snapshot(config, st, tail_offset, content_hash))
+
+# st - состояние файла, которому соответствует config (после записи - os.fstat
+# временного файла, а не повторный stat пути, который мог уже смениться)
+def write_index(config, path=None, st=None, content_hash=None):
+    path = path or CONF
+    if not INDEX_CACHE:
+        return
+    try:
+        _write_index_data(path, _index_data(config, st or os.stat(path), content_hash))
+    except OSError:
+        # Индекс - только ускорение, без прав на запись работаем без него
+        pass
+
+def _write_index_data(path, data):
+    write_file_atomic(get_index_path(path), data, mode=0o600)
+
+# Загрузка и сохранение серверного конфига (с учётом журнала изменений).
+# Под разделяемой блокировкой индекс не пишется: его данные готовятся при чтении,
+# а записываются после, под эксклюзивной блокировкой и только если конфиг не менялся
+def load_config(path=None):
+    path = path or CONF
+    deferred = []
+    with config_lock(path, shared=True):
+        config = _load_config(path, deferred)
+        _apply_journal(config, _read_journal(path)[0])
+    if deferred:
+        st, data = deferred[0]
+        try:
+            with config_lock(path):
+                current = os.stat(path)
+                if (current.st_size, current.st_mtime_ns, current.st_ino) == (st.st_size, st.st_mtime_ns, st.st_ino):
+                    _write_index_data(path, data)
+        except OSError:
+            pass
+    return config
+
+def _load_config(path, deferred=None):
+    with timed('stage', 'load_config'):
+        return _read_config(path, deferred)
+
+# deferred - список, куда вместо записи индекса кладётся (состояние файла, данные индекса)
+def _read_config(path, deferred=None):
+    with open(path, 'rb') as f:
+        if not INDEX_CACHE:
+            return WgConfig.parse(f.read().decode())
+        st = os.fstat(f.fileno())
+        index = _read_index(path)
+        if index and index[1:4] == (st.st_size, st.st_mtime_ns, st.st_ino):
+            return _config_from_snapshot(index)
+        data = f.read()
+    
+    view = memoryview(data)
+    digest = hashlib.sha256()
+    appended = False
+    # Частый случай: к файлу только дописали новые секции
+    if index and index[3] == st.st_ino and index[10] and len(data) > index[1]:
+        digest.update(view[:index[1]])
+        appended = digest.hexdigest() == index[5]
+        digest.update(view[index[1]:])
+    else:
+        digest.update(view)
+    if appended:
+        config = _config_from_snapshot(index)
+        config.remove_peers([config.peers[-1]])
+        config._parse_into(data[index[4]:].decode())
+    else:
+        config = WgConfig.parse(data.decode())
+    
+    if deferred is None:
+        write_index(config, path, st, digest.hexdigest())
+    else:
+        deferred.append((st, _index_data(config, st, digest.hexdigest())))
+    return config
+
+def save_config(config, path=None):
+    path = path or CONF
+    with timed('stage', 'save_config', peers=len(config.peers)):
+        st = write_file_atomic(path, config.text())
+        write_index(config, path, st)
+        # Полная запись уже содержит все изменения из журнала
+        _truncate_journal(path)
+
+# Журнал изменений рядом с конфигом (wg0.conf.journal). Добавления и удаления
+# дописываются в него одной записью с одним fsync на пачку вместо переписывания
+# конфига; при чтении журнал накладывается поверх конфига. Когда журнал
+# разрастается, конфиг атомарно переписывается целиком, а журнал очищается.
+# Изменения выполняются под эксклюзивной блокировкой wg0.conf.lock.
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+
+def get_journal_path(path=None):
+    return f"{path or CONF}.journal"
+
+def get_lock_path(path=None):
+    return f"{path or CONF}.lock"
+
+@contextlib.contextmanager
+def config_lock(path=None, shared=False):
+    if fcntl is None:
+        yield
+        return
+    try:
+        fd = os.open(get_lock_path(path), os.O_RDWR | os.O_CREAT, 0o600)
+    except OSError:
+        # Без прав на запись в каталог можно только читать - работаем без блокировки
+        yield
+        return
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+# Строка журнала: CRC32 записи и JSON. Оборванная при сбое строка отбрасывается.
+def _journal_line(record):
+    data = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+    return f"{binascii.crc32(data.encode()) & 0xffffffff:08x} {data}\n"
+
+def _read_journal(path):
+    try:
+        with open(get_journal_path(path), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return [], 0, 0
+    records = []
+    offset = 0
+    while offset < len(data):
+        end = data.find(b'\n', offset)
+        if end < 0:
+            break
+        line = data[offset:end]
+        checksum, _, payload = line.partition(b' ')
+        try:
+            if int(checksum, 16) != binascii.crc32(payload) & 0xffffffff:
+                break
+            records.append(json.loads(payload.decode()))
+        except ValueError:
+            break
+        offset = end + 1
+    return records, offset, len(data)
+
+# Наложение журнала на конфиг. Повторное применение безопасно: уже добавленные
+# ключи пропускаются, отсутствующие клиенты при удалении игнорируются.
+def _apply_journal(config, records):
+    for record in records:
+        if record.get('op') == 'add':
+            if record.get('key') not in config.by_pubkey:
+                config.add_peer_block(record['text'])
+        elif record.get('op') == 'remove':
+            peers = [config.find(key) for key in record.get('keys', [])]
+            config.remove_peers([peer for peer in peers if peer is not None])
+
+def _truncate_journal(path):
+    journal_path = get_journal_path(path)
+    if os.path.exists(journal_path) and os.path.getsize(journal_path):
+        with open(journal_path, 'r+b') as f:
+            f.truncate(0)
+            os.fsync(f.fileno())
+
+# Изменения внутри одной транзакции записываются в журнал одной пачкой
+class ConfigTransaction:
+    def __init__(self, config):
+        self.config = config
+        self.records = []
+        self.rewrite = False
+        self.stored = []
+
+    def add_peer_block(self, text):
+        peers = self.config.add_peer_block(text)
+        for peer in peers:
+            if not peer.public_key:
+                self.rewrite = True
+            if self.rewrite:
+                # Конфиг всё равно будет переписан целиком, записи журнала не нужны
+                continue
+            self.records.append({'op': 'add', 'key': peer.public_key, 'text': peer.text()})
+        return peers
+
+    # Имя безымянной секции: комментарий "# Client:" вставляется перед [Peer] на месте.
+    # Журнал не хранит переименований, поэтому конфиг переписывается целиком
+    def name_peer(self, peer, name):
+        lines = peer.lines
+        index = next((i for i, line in enumerate(lines) if line.strip().lower() == '[peer]'), 0)
+        lines.insert(index, f"# Client: {name}\n")
+        peer.name = name
+        self.config.by_name[name] = peer
+        self.rewrite = True
+
+    # Запись новых клиентов в хранилище до записи журнала: если хранилище
+    # недоступно, в конфиг ничего не попадает и ключи клиентов не теряются
+    def store_clients(self, clients, labels=None, profile=None):
+        self.stored.extend(name for name, *_ in clients)
+        write_client_configs(self.config, clients, labels, profile)
+
+    # То же для готовых записей (импорт) порциями по CLIENT_STORE_BATCH
+    def store_records(self, records):
+        self.stored.extend(record.name for record in records)
+        store = get_client_store()
+        for start in range(0, len(records), CLIENT_STORE_BATCH):
+            store.put_many(records[start:start + CLIENT_STORE_BATCH])
+
+    # Отмена транзакции: записи хранилища без секций в конфиге удаляются
+    def rollback(self):
+        if self.stored:
+            get_client_store().delete_many(self.stored)
+            self.stored = []
+
+    def remove_peers(self, peers):
+        keys = []
+        for peer in peers:
+            key = peer.public_key or peer.name
+            # Секцию без ключа и имени нельзя однозначно найти при повторе журнала
+            if not key or self.config.find(key) is not peer:
+                self.rewrite = True
+            keys.append(key)
+        self.config.remove_peers(peers)
+        if keys:
+            self.records.append({'op': 'remove', 'keys': keys})
+
+class ConfigJournal:
+    def __init__(self, path=None):
+        self.path = path or CONF
+        self._state = None
+
+    # Состояние файлов после нашей последней записи: если оно не изменилось,
+    # держимый в памяти конфиг актуален и перечитывать его не нужно
+    def _identity(self):
+        st = os.stat(self.path)
+        try:
+            journal_size = os.path.getsize(get_journal_path(self.path))
+        except OSError:
+            journal_size = 0
+        return (st.st_size, st.st_mtime_ns, st.st_ino, journal_size)
+
+    @contextlib.contextmanager
+    def transaction(self, config=None):
+        with config_lock(self.path):
+            if config is None or self._state is None or self._state != self._identity():
+                config = _load_config(self.path)
+                records, offset, size = _read_journal(self.path)
+                _apply_journal(config, records)
+                if offset < size:
+                    # Хвост, оборванный при сбое, отрезаем до новых записей
+                    with open(get_journal_path(self.path), 'r+b') as f:
+                        f.truncate(offset)
+                        os.fsync(f.fileno())
+            self._state = None
+            txn = ConfigTransaction(config)
+            try:
+                yield txn
+                self.commit(txn)
+            except BaseException:
+                txn.rollback()
+                raise
+            self._state = self._identity()
+
+    def commit(self, txn):
+        if txn.rewrite:
+            save_config(txn.config, self.path)
+            return
+        if not txn.records:
+            return
+        data = "".join(_journal_line(record) for record in txn.records).encode()
+        with timed('stage', 'journal_commit', records=len(txn.records)):
+            size = self._append(data)
+        if size > JOURNAL_COMPACT_BYTES:
+            save_config(txn.config, self.path)
+
+    # Дозапись пачки записей в журнал с одним fsync
+    def _append(self, data):
+        fd = os.open(get_journal_path(self.path), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            os.fsync(fd)
+            return os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+
+    # Перенос журнала в конфиг: атомарная перезапись и очистка журнала.
+    # Вызывается при запуске (восстановление после сбоя), перед перезапуском
+    # интерфейса и периодически из фонового режима. Возвращает число записей.
+    def compact(self, config=None):
+        journal_path = get_journal_path(self.path)
+        if not os.path.exists(journal_path) or not os.path.getsize(journal_path):
+            return 0
+        with self.transaction(config) as txn:
+            count = len(_read_journal(self.path)[0])
+            txn.rewrite = os.path.getsize(journal_path) > 0
+        return count
+
+_journals = {}
+
+def get_journal(path=None):
+    path = path or CONF
+    if path not in _journals:
+        _journals[path] = ConfigJournal(path)
+    return _journals[path]
+
+# Перенос в конфиг журналов, которые изменялись в этом процессе. Вызывается в
+# конце каждой команды и после каждого действия меню: wg-quick при загрузке
+# читает только wg0.conf и не знает о журнале. Журнал экономит перезаписи
+# внутри процесса (пачки, фоновый режим), а не между запусками.
+def compact_journals():
+    for journal in list(_journals.values()):
+        try:
+            journal.compact()
+        except OSError as e:
+            print(f"Предупреждение: журнал {get_journal_path(journal.path)} не перенесён в конфиг: {e}",
+                  file=sys.stderr)
+
+# Подсеть клиентов как объект ipaddress (поддерживается и старый формат "10.8.0.")
+def get_subnet():
+    subnet = SUBNET
+    if subnet.endswith('.'):
+        subnet = f"{subnet}0/24"
+    return ipaddress.ip_network(subnet, strict=False)
+
+# Адрес с маской хоста (/32 или /128) для AllowedIPs на сервере
+def host_cidr(ip):
+    address = ipaddress.ip_address(ip)
+    return f"{address}/{address.max_prefixlen}"
+
+# Распределитель адресов в подсети: битовая карта для подсетей до 2^24 адресов,
+# разреженное множество для больших (например, IPv6 /64). В разреженном режиме
+# занятые подсети хранятся отсортированным списком непересекающихся диапазонов
+# с поиском через bisect; отдельные адреса внутри диапазона в множество не входят.
+class IPAllocator:
+    BITMAP_LIMIT = 2 ** 24
+    RANDOM_PROBES = 64
+
+    def __init__(self, network, strategy=None):
+        self.network = ipaddress.ip_network(network, strict=False)
+        self.strategy = strategy or IP_STRATEGY
+        if self.strategy not in ('lowest', 'random'):
+            raise ValueError(f"Неизвестная стратегия выдачи адресов: {self.strategy}")
+        self._base = int(self.network.network_address)
+        size = self.network.num_addresses
+        # Адрес сети и широковещательный адрес IPv4 не выдаём
+        if self.network.version == 4 and size > 2:
+            self._first, self._last = 1, size - 2
+        elif self.network.version == 6 and size > 1:
+            self._first, self._last = 1, size - 1
+        else:
+            self._first, self._last = 0, size - 1
+        self._bitmap = bytearray((size + 7) // 8) if size <= self.BITMAP_LIMIT else None
+        self._used = set()
+        self._ranges = []
+        self._range_starts = []
+        self._used_count = 0
+        # Все адреса ниже курсора заняты
+        self._cursor = self._first
+        self.collisions = []
+
+    @property
+    def capacity(self):
+        return self._last - self._first + 1
+
+    @property
+    def used_count(self):
+        return self._used_count
+
+    @property
+    def free_count(self):
+        return self.capacity - self._used_count
+
+    def _offset(self, ip):
+        address = ipaddress.ip_address(ip)
+        if address not in self.network:
+            return None
+        return int(address) - self._base
+
+    def _address(self, offset):
+        return str(ipaddress.ip_address(self._base + offset))
+
+    def _is_used(self, offset):
+        if self._bitmap is not None:
+            return (self._bitmap[offset >> 3] >> (offset & 7)) & 1 == 1
+        return offset in self._used or self._range_index(offset) >= 0
+
+    # Номер диапазона, содержащего адрес, или -1
+    def _range_index(self, offset):
+        index = bisect.bisect_right(self._range_starts, offset) - 1
+        if index >= 0 and self._ranges[index][1] >= offset:
+            return index
+        return -1
+
+    # Число адресов пула в диапазоне [start, end]
+    def _pool_count(self, start, end):
+        return max(0, min(end, self._last) - max(start, self._first) + 1)
+
+    # Добавление диапазона со слиянием соседних и пересекающихся; возвращает
+    # число адресов пула, которые были свободны
+    def _add_range(self, start, end):
+        low = bisect.bisect_left(self._range_starts, start)
+        if low > 0 and self._ranges[low - 1][1] >= start - 1:
+            low -= 1
+        high = bisect.bisect_right(self._range_starts, end + 1)
+        merged = self._ranges[low:high]
+        for range_start, range_end in merged:
+            if max(range_start, start) <= min(range_end, end):
+                self.collisions.append(self._address(max(range_start, start)))
+        inside = [offset for offset in self._used if start <= offset <= end]
+        for offset in inside:
+            self._used.discard(offset)
+            self.collisions.append(self._address(offset))
+        if merged:
+            start, end = min(start, merged[0][0]), max(end, merged[-1][1])
+        self._ranges[low:high] = [(start, end)]
+        self._range_starts[low:high] = [start]
+        added = self._pool_count(start, end) - sum(self._pool_count(*item) for item in merged)
+        added -= sum(1 for offset in inside if self._first <= offset <= self._last)
+        self._used_count += added
+        return added
+
+    def _mark(self, offset):
+        if self._bitmap is not None:
+            self._bitmap[offset >> 3] |= 1 << (offset & 7)
+        else:
+            self._used.add(offset)
+        if self._first <= offset <= self._last:
+            self._used_count += 1
+
+    def _mark_checked(self, offset):
+        if self._is_used(offset):
+            return False
+        self._mark(offset)
+        return True
+
+    def is_free(self, ip):
+        offset = self._offset(ip)
+        return offset is not None and self._first <= offset <= self._last and not self._is_used(offset)
+
+    # Резервирование конкретного адреса; False, если он уже занят
+    def reserve(self, ip):
+        offset = self._offset(ip)
+        if offset is None:
+            raise ValueError(f"Адрес {ip} не входит в подсеть {self.network}")
+        return self._mark_checked(offset)
+
+    # Резервирование всех адресов подсети, пересекающихся с пулом (например, AllowedIPs = 10.8.0.16/28)
+    def reserve_network(self, network):
+        network = ipaddress.ip_network(network, strict=False)
+        if network.version != self.network.version or not network.overlaps(self.network):
+            return 0
+        start = max(int(network.network_address), self._base) - self._base
+        end = min(int(network.broadcast_address), self._base + self.network.num_addresses - 1) - self._base
+        if self._bitmap is None and end - start >= self.RANDOM_PROBES:
+            return self._add_range(start, end)
+        reserved = 0
+        for offset in range(start, end + 1):
+            if self._is_used(offset):
+                self.collisions.append(self._address(offset))
+            else:
+                self._mark(offset)
+                reserved += 1
+        return reserved
+
+    def release(self, ip):
+        offset = self._offset(ip)
+        if offset is None or not self._is_used(offset):
+            return False
+        if self._bitmap is not None:
+            self._bitmap[offset >> 3] &= ~(1 << (offset & 7)) & 0xFF
+        elif offset in self._used:
+            self._used.discard(offset)
+        else:
+            # Адрес внутри занятой подсети: диапазон делится на две части
+            index = self._range_index(offset)
+            start, end = self._ranges[index]
+            parts = [part for part in ((start, offset - 1), (offset + 1, end)) if part[0] <= part[1]]
+            self._ranges[index:index + 1] = parts
+            self._range_starts[index:index + 1] = [part[0] for part in parts]
+        if self._first <= offset <= self._last:
+            self._used_count -= 1
+        if offset < self._cursor:
+            self._cursor = max(offset, self._first)
+        return True
+
+    def _next_lowest(self):
+        offset = self._cursor
+        bitmap = self._bitmap
+        while offset <= self._last:
+            if bitmap is not None and (offset & 7) == 0 and bitmap[offset >> 3] == 0xFF:
+                offset += 8
+                continue
+            if bitmap is None:
+                # Занятую подсеть пропускаем целиком
+                index = self._range_index(offset)
+                if index >= 0:
+                    offset = self._ranges[index][1] + 1
+                    continue
+            if not self._is_used(offset):
+                break
+            offset += 1
+        self._cursor = offset
+        return offset if offset <= self._last else None
+
+    def _next_random(self):
+        for _ in range(self.RANDOM_PROBES):
+            offset = random.randint(self._first, self._last)
+            if not self._is_used(offset):
+                return offset
+        return self._next_lowest()
+
+    # Выдача следующего свободного адреса; None, если пул исчерпан
+    def allocate(self):
+        if self.free_count <= 0:
+            return None
+        offset = self._next_random() if self.strategy == 'random' else self._next_lowest()
+        if offset is None:
+            return None
+        self._mark(offset)
+        return self._address(offset)
+
+    def allocate_many(self, count):
+        if count > self.free_count:
+            raise ValueError(f"Недостаточно свободных IP: нужно {count}, доступно {self.free_count}")
+        return [self.allocate() for _ in range(count)]
+
+    # Построение по разобранному серверному конфигу
+    @classmethod
+    def from_config(cls, config, network=None, strategy=None):
+        allocator = cls(network or get_subnet(), strategy)
+        server_reserved = False
+        for entry in config.addresses:
+            try:
+                address = ipaddress.ip_interface(entry).ip
+            except ValueError:
+                continue
+            if address in allocator.network:
+                allocator.reserve(address)
+                server_reserved = True
+        if not server_reserved:
+            # По умолчанию первый адрес подсети принадлежит серверу
+            allocator.reserve(allocator._address(allocator._first))
+        family = socket.AF_INET if allocator.network.version == 4 else socket.AF_INET6
+        host_prefix = '/32' if family == socket.AF_INET else '/128'
+        base, last = allocator._base, allocator._base + allocator.network.num_addresses - 1
+        for peer in config.peers:
+            for entry in peer.allowed_ips:
+                try:
+                    # Быстрый путь для маршрутов хоста без создания объектов ipaddress
+                    if entry.endswith(host_prefix):
+                        value = int.from_bytes(socket.inet_pton(family, entry[:-len(host_prefix)]), 'big')
+                        if base <= value <= last and not allocator._mark_checked(value - base):
+                            allocator.collisions.append(allocator._address(value - base))
+                    else:
+                        allocator.reserve_network(entry)
+                except (OSError, ValueError):
+                    continue
+        return allocator
+
+# Поиск свободного IP
+def find_free_ip(config=None):
+    allocator = IPAllocator.from_config(config or load_config())
+    ip = allocator.allocate()
+    if ip:
+        return ip
+    
+    print(f"{Colors.FAIL}Свободных IP не найдено{Colors.ENDC}")
+    return None
+
+# Получение имени клиента из конфига по его IP
+def get_client_name_by_ip(ip, config=None):
+    peer = (config or load_config()).by_ip.get(ip)
+    return peer.name if peer else None
+
+# Получение списка всех клиентов
+def get_all_clients(config=None):
+    if config is None:
+        if not os.path.exists(CONF):
+            return []
+        config = load_config()
+    return [(peer.name, peer.ip) for peer in config.peers if peer.name and peer.ip]
+
+# Имя интерфейса из пути к конфигу
+def get_interface_name(conf=None):
+    return os.path.basename(conf or CONF).replace('.conf', '')
+
+# Атомарная запись файла: временный файл + fsync + rename. Возвращает os.fstat
+# записанного файла (размер, mtime и inode совпадают с файлом после rename)
+def write_file_atomic(path, content, mode=None):
+    directory = os.path.dirname(os.path.abspath(path))
+    if mode is None:
+        mode = os.stat(path).st_mode & 0o777 if os.path.exists(path) else 0o600
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(content, bytes) else 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+            st = os.fstat(f.fileno())
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    # fsync каталога, чтобы переименование пережило сбой питания
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    return st
+
+# Профили клиентов (PROFILES). Скорости - в записи tc: 5mbit, 512kbit, 1gbit, 100kbps;
+# внутри они хранятся в битах в секунду.
+RATE_UNITS = {'bit': 1, 'kbit': 10 ** 3, 'mbit': 10 ** 6, 'gbit': 10 ** 9, 'tbit': 10 ** 12,
+              'bps': 8, 'kbps': 8 * 10 ** 3, 'mbps': 8 * 10 ** 6, 'gbps': 8 * 10 ** 9, 'tbps': 8 * 10 ** 12}
+PROFILE_KEYS = ('rate', 'upload', 'mtu', 'keepalive', 'dns')
+
+def parse_rate(value):
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([a-z]*)\s*', str(value).lower())
+    if not match or (match.group(2) and match.group(2) not in RATE_UNITS):
+        raise ValueError(f"Некорректная скорость: {value!r} (пример: 5mbit, 512kbit)")
+    bits = int(float(match.group(1)) * RATE_UNITS[match.group(2) or 'bit'])
+    if bits <= 0:
+        raise ValueError(f"Некорректная скорость: {value!r}")
+    return bits
+
+# Описание профилей из JSON: {"slow": {"rate": "5mbit", "mtu": 1380}, ...}
+def load_profiles(path):
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"В {path} ожидается объект вида {{\"профиль\": {{...}}}}")
+    return data.get('profiles', data)
+
+# Проверенный профиль по имени: скорости в бит/с, mtu и keepalive - числа
+_profile_cache = {}
+
+def get_profile(name):
+    if not name:
+        return None
+    if name not in PROFILES:
+        raise ValueError(f"Неизвестный профиль: {name}" + (f" (доступны: {', '.join(sorted(PROFILES))})" if PROFILES else ""))
+    settings = PROFILES[name]
+    key = (name, json.dumps(settings, sort_keys=True))
+    if key not in _profile_cache:
+        unknown = set(settings) - set(PROFILE_KEYS)
+        if unknown:
+            raise ValueError(f"Профиль {name}: неизвестные параметры {', '.join(sorted(unknown))}")
+        profile = {'name': name, 'rate': None, 'upload': None, 'mtu': None, 'keepalive': None, 'dns': settings.get('dns')}
+        for field in ('rate', 'upload'):
+            if settings.get(field):
+                profile[field] = parse_rate(settings[field])
+        for field, low, high in (('mtu', 576, 65535), ('keepalive', 0, 65535)):
+            if settings.get(field) is not None:
+                value = int(settings[field])
+                if not low <= value <= high:
+                    raise ValueError(f"Профиль {name}: {field} должен быть от {low} до {high}")
+                profile[field] = value
+        _profile_cache[key] = profile
+    return _profile_cache[key]
+
+# Текст клиентского конфига
+def render_client_config(client_priv, client_ip, server_pub, psk, profile=None):
+    subnet = get_subnet()
+    # Профиль, удалённый из PROFILES, не мешает выдать конфиг (о нём сообщает validate)
+    settings = get_profile(profile) if profile in PROFILES else {}
+    extra_interface = f"MTU = {settings['mtu']}\n" if settings.get('mtu') else ""
+    extra_peer = f"PersistentKeepalive = {settings['keepalive']}\n" if settings.get('keepalive') else ""
+    psk_line = f"PresharedKey = {psk}\n" if psk else ""
+    return f"""\
+[Interface]
+PrivateKey = {client_priv}
+Address = {client_ip}/{subnet.prefixlen}
+DNS = {settings.get('dns') or '1.1.1.1'}
+{extra_interface}
+[Peer]
+PublicKey = {server_pub}
+{psk_line}AllowedIPs = {subnet}
+Endpoint = {ENDPOINT}
+{extra_peer}"""
+
+# Блок [Peer] для серверного конфига; профиль записывается комментарием после имени
+# routes - дополнительные сети за клиентом (например, при импорте site-to-site пиров)
+def render_peer_block(client_name, client_pub, psk, client_ip, profile=None, routes=None):
+    profile_line = f"# Profile: {profile}\n" if profile else ""
+    psk_line = f"PresharedKey = {psk}\n" if psk else ""
+    allowed_ips = ", ".join([host_cidr(client_ip)] + list(routes or ()))
+    return f"""
+# Client: {client_name}
+{profile_line}[Peer]
+PublicKey = {client_pub}
+{psk_line}AllowedIPs = {allowed_ips}
+"""
+
+# Ключи секции [Interface], которые понимает только wg-quick (аналог wg-quick strip)
+WG_QUICK_ONLY_KEYS = {'address', 'dns', 'mtu', 'table', 'preup', 'postup', 'predown', 'postdown', 'saveconfig'}
+
+def strip_wg_quick_config(content):
+    lines = []
+    section = None
+    for line in content.splitlines():
+        stripped = line.strip()
+        if stripped.startswith('['):
+            section = stripped.lower()
+        elif section == '[interface]' and '=' in stripped and not stripped.startswith('#'):
+            if stripped.split('=', 1)[0].strip().lower() in WG_QUICK_ONLY_KEYS:
+                continue
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+# Пир из вывода wg show <if> dump
+class DumpPeer:
+    __slots__ = ('public_key', 'preshared_key', 'endpoint', 'allowed_ips', 'latest_handshake', 'rx', 'tx', 'persistent_keepalive')
+
+    def __init__(self, fields):
+        self.public_key = fields[0]
+        self.preshared_key = None if fields[1] == '(none)' else fields[1]
+        self.endpoint = None if fields[2] == '(none)' else fields[2]
+        self.allowed_ips = [] if fields[3] == '(none)' else fields[3].split(',')
+        self.latest_handshake = int(fields[4])
+        self.rx = int(fields[5])
+        self.tx = int(fields[6])
+        self.persistent_keepalive = None if fields[7] == 'off' else fields[7]
+
+# Разбор wg show <if> dump: первая строка - интерфейс, далее по строке на пира
+def parse_wg_dump(text):
+    interface = {}
+    peers = {}
+    for line in text.splitlines():
+        fields = line.split('\t')
+        if len(fields) == 4 and not interface:
+            interface = {'private_key': fields[0], 'public_key': fields[1], 'listen_port': fields[2], 'fwmark': fields[3]}
+        elif len(fields) >= 8:
+            # В выводе wg show all dump первым полем идёт имя интерфейса
+            peer = DumpPeer(fields[-8:])
+            peers[peer.public_key] = peer
+    return interface, peers
+
+def _normalize_allowed_ips(entries):
+    normalized = set()
+    for entry in entries:
+        try:
+            normalized.add(str(ipaddress.ip_network(entry.strip(), strict=False)))
+        except ValueError:
+            normalized.add(entry.strip())
+    return normalized
+
+# Разница между пирами конфига и пирами интерфейса
+def diff_peers(config, live):
+    added, updated, unchanged = [], [], 0
+    desired = set()
+    for peer in config.peers:
+        if not peer.public_key:
+            continue
+        desired.add(peer.public_key)
+        current = live.get(peer.public_key)
+        if current is None:
+            added.append(peer.public_key)
+        elif (peer.preshared_key != current.preshared_key
+              or _normalize_allowed_ips(peer.allowed_ips) != _normalize_allowed_ips(current.allowed_ips)
+              or (peer.persistent_keepalive if peer.persistent_keepalive not in (None, '0', 'off') else None) != current.persistent_keepalive
+              or (peer.endpoint and peer.endpoint != current.endpoint)):
+            updated.append(peer.public_key)
+        else:
+            unchanged += 1
+    removed = [pubkey for pubkey in live if pubkey not in desired]
+    return {'added': added, 'updated': updated, 'removed': removed, 'unchanged': unchanged}
+
+# Управление пирами ядра. Изменения копятся в очереди и применяются одним
+# привилегированным вызовом при flush(); sync() применяет конфиг целиком.
+class PeerBackend(abc.ABC):
+    def __init__(self, interface):
+        self.interface = interface
+        self._pending_add = {}
+        self._pending_remove = {}
+
+    # Постановка в очередь пиров (объектов с полями Peer) на добавление или обновление
+    def add_peers(self, peers):
+        for peer in peers:
+            self._pending_remove.pop(peer.public_key, None)
+            self._pending_add[peer.public_key] = peer
+
+    def remove_peers(self, pubkeys):
+        for pubkey in pubkeys:
+            self._pending_add.pop(pubkey, None)
+            self._pending_remove[pubkey] = True
+
+    @property
+    def pending(self):
+        return len(self._pending_add) + len(self._pending_remove)
+
+    # Применение очереди; возвращает (успех, сообщение)
+    def flush(self):
+        if not self.pending:
+            return True, ''
+        adds = list(self._pending_add.values())
+        removes = list(self._pending_remove)
+        self._pending_add = {}
+        self._pending_remove = {}
+        with timed('stage', 'backend_flush', added=len(adds), removed=len(removes)):
+            return self._apply(adds, removes)
+
+    def dump(self):
+        return parse_wg_dump(self.dump_text())
+
+    @abc.abstractmethod
+    def _apply(self, adds, removes):
+        pass
+
+    @abc.abstractmethod
+    def dump_text(self):
+        pass
+
+    # Применение правил tc из текста для tc -batch; возвращает (успех, сообщение)
+    @abc.abstractmethod
+    def shape(self, batch):
+        pass
+
+    @abc.abstractmethod
+    def sync(self, content):
+        pass
+
+# Бэкенд на утилите wg (через sudo в Linux и PowerShell RunAs в Windows)
+class WgCliBackend(PeerBackend):
+    # Предел длины аргументов одного вызова wg set
+    ARG_BUDGET = 1 << 20
+
+    # Запуск с правами администратора. В Windows Start-Process -Verb RunAs не
+    # возвращает вывод, поэтому команды, вывод которых нужен (with_output),
+    # запускаются напрямую: для них консоль должна быть открыта от администратора
+    def _run_privileged(self, args, with_output=False):
+        try:
+            if os.name == 'nt' and with_output:
+                result = run_external(args, capture_output=True, text=True)
+            elif os.name == 'nt':
+                command = " ".join(args)
+                result = run_external(["powershell", "Start-Process", "cmd", "-ArgumentList", f"/c {command}", "-Verb", "RunAs", "-Wait"],
+                                      capture_output=True, text=True)
+            elif os.geteuid() == 0:
+                result = run_external(args, capture_output=True, text=True)
+            else:
+                result = run_external(["sudo"] + args, capture_output=True, text=True)
+        except OSError as e:
+            return False, str(e), ''
+        return result.returncode == 0, (result.stderr or '').strip(), result.stdout
+
+    def _apply(self, adds, removes):
+        errors = []
+        psk_dir = tempfile.mkdtemp(prefix="wg-psk.")
+        try:
+            batches = [[]]
+            size = 0
+            for i, peer in enumerate(adds):
+                args = ["peer", peer.public_key]
+                if peer.preshared_key:
+                    psk_path = os.path.join(psk_dir, str(i))
+                    with open(psk_path, 'w') as f:
+                        f.write(peer.preshared_key)
+                    args += ["preshared-key", psk_path]
+                args += ["allowed-ips", ",".join(peer.allowed_ips)]
+                if peer.persistent_keepalive:
+                    args += ["persistent-keepalive", peer.persistent_keepalive]
+                if peer.endpoint:
+                    args += ["endpoint", peer.endpoint]
+                batches, size = self._append_batch(batches, size, args)
+            for pubkey in removes:
+                batches, size = self._append_batch(batches, size, ["peer", pubkey, "remove"])
+            for args in batches:
+                if not args:
+                    continue
+                ok, message, _ = self._run_privileged(["wg", "set", self.interface] + args)
+                if not ok:
+                    errors.append(message or 'Неизвестная ошибка')
+        finally:
+            shutil.rmtree(psk_dir, ignore_errors=True)
+        return not errors, "; ".join(errors)
+
+    def _append_batch(self, batches, size, args):
+        length = sum(len(arg) + 1 for arg in args)
+        if size + length > self.ARG_BUDGET and batches[-1]:
+            batches.append([])
+            size = 0
+        batches[-1].extend(args)
+        return batches, size + length
+
+    def dump_text(self):
+        ok, message, output = self._run_privileged(["wg", "show", self.interface, "dump"], with_output=True)
+        if not ok:
+            if os.name == 'nt':
+                message = "; ".join(part for part in (message, "запустите консоль от имени администратора") if part)
+            raise RuntimeError(message or f"wg show {self.interface} dump завершился с ошибкой")
+        return output
+
+    # Применение всего конфига одним вызовом wg syncconf
+    def sync(self, content):
+        fd, stripped_path = tempfile.mkstemp(prefix=f"{self.interface}.", suffix=".conf")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(strip_wg_quick_config(content))
+            ok, message, output = self._run_privileged(["wg", "syncconf", self.interface, stripped_path])
+            return ok, message or output.strip()
+        finally:
+            os.remove(stripped_path)
+
+    # Все правила одним вызовом tc -batch
+    def shape(self, batch):
+        if os.name == 'nt':
+            return False, "Ограничение скорости через tc доступно только в Linux"
+        fd, batch_path = tempfile.mkstemp(prefix=f"{self.interface}.", suffix=".tc")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(batch)
+            ok, message, output = self._run_privileged(["tc", "-batch", batch_path])
+            return ok, message or output.strip()
+        finally:
+            os.remove(batch_path)
+
+# Бэкенд в памяти для тестов и замеров на машине без интерфейса WireGuard.
+# Если задан state_path, состояние сохраняется в JSON между запусками.
+class FakeBackend(PeerBackend):
+    def __init__(self, interface, state_path=None):
+        super().__init__(interface)
+        self.state_path = state_path
+        self.calls = 0
+        self.peers = {}
+        self.shaping = None
+        if state_path and os.path.exists(state_path):
+            with open(state_path, 'r') as f:
+                for fields in json.load(f):
+                    peer = DumpPeer(fields)
+                    self.peers[peer.public_key] = peer
+
+    def _save(self):
+        if self.state_path:
+            rows = [self._fields(peer) for peer in self.peers.values()]
+            write_file_atomic(self.state_path, json.dumps(rows), mode=0o600)
+
+    @staticmethod
+    def _fields(peer):
+        return [peer.public_key, peer.preshared_key or '(none)', peer.endpoint or '(none)',
+                ",".join(peer.allowed_ips) or '(none)', str(peer.latest_handshake), str(peer.rx), str(peer.tx),
+                peer.persistent_keepalive or 'off']
+
+    def _set_peer(self, peer):
+        current = self.peers.get(peer.public_key)
+        keepalive = peer.persistent_keepalive if peer.persistent_keepalive not in (None, '0', 'off') else None
+        fields = [peer.public_key, peer.preshared_key or '(none)',
+                  peer.endpoint or (current.endpoint if current else None) or '(none)',
+                  ",".join(peer.allowed_ips) or '(none)',
+                  str(current.latest_handshake if current else 0), str(current.rx if current else 0),
+                  str(current.tx if current else 0), keepalive or 'off']
+        self.peers[peer.public_key] = DumpPeer(fields)
+
+    def _apply(self, adds, removes):
+        self.calls += 1
+        for peer in adds:
+            self._set_peer(peer)
+        for pubkey in removes:
+            self.peers.pop(pubkey, None)
+        self._save()
+        return True, ''
+
+    def dump_text(self):
+        self.calls += 1
+        lines = [f"(hidden)\t(hidden)\t51820\toff"]
+        lines.extend("\t".join(self._fields(peer)) for peer in self.peers.values())
+        return "\n".join(lines) + "\n"
+
+    def sync(self, content):
+        self.calls += 1
+        config = WgConfig.parse(strip_wg_quick_config(content))
+        desired = {peer.public_key for peer in config.peers if peer.public_key}
+        for pubkey in [pubkey for pubkey in self.peers if pubkey not in desired]:
+            del self.peers[pubkey]
+        for peer in config.peers:
+            if peer.public_key:
+                self._set_peer(peer)
+        self._save()
+        return True, ''
+
+    # Правила tc не применяются, а сохраняются рядом с состоянием (<путь>.tc)
+    def shape(self, batch):
+        self.calls += 1
+        self.shaping = batch
+        if self.state_path:
+            write_file_atomic(f"{self.state_path}.tc", batch, mode=0o600)
+        return True, ''
+
+# Выбор бэкенда: настройка BACKEND или переменная окружения WG_MANAGER_BACKEND
+_backends = {}
+
+def get_backend(interface=None):
+    interface = interface or get_interface_name()
+    if interface not in _backends:
+        kind = os.environ.get('WG_MANAGER_BACKEND', BACKEND)
+        if kind == 'fake':
+            # Для нескольких интерфейсов путь может содержать {interface}
+            state_path = os.environ.get('WG_MANAGER_FAKE_STATE')
+            _backends[interface] = FakeBackend(interface, state_path and state_path.replace('{interface}', interface))
+        elif kind == 'wg':
+            _backends[interface] = WgCliBackend(interface)
+        else:
+            raise ValueError(f"Неизвестный бэкенд: {kind}")
+    return _backends[interface]
+
+# Ограничение скорости клиентов с профилями: классы HTB на выходе интерфейса
+# (трафик к клиенту) и policing на входе (трафик от клиента). Фильтры u32 лежат
+# в хэш-таблице на 256 корзин по последнему байту адреса, поэтому пакет
+# сверяется только с клиентами своей корзины, а не со всеми. Весь набор правил -
+# один текст для tc -batch: корневая дисциплина пересоздаётся (вместе с ней
+# пропадают прежние классы и фильтры), фильтры на входе удаляются целиком.
+# Без SHAPING_LINK_RATE у HTB нет класса по умолчанию, и трафик клиентов без
+# профиля идёт мимо классов без ограничения. Файл <конфиг>.shaped отмечает, что
+# правила установлены: когда профили убраны, их снимает следующий reload.
+SHAPING_FIRST_CLASS = 0x10
+# Семейство адресов: (protocol, ключ match, prio, смещение dst и src последних 4 байт, хэш-таблица)
+SHAPING_FAMILIES = {4: ('ip', 'ip', 1, 16, 12, 0x2), 6: ('ipv6', 'ip6', 2, 36, 20, 0x3)}
+
+def shaping_burst(rate):
+    # Запас на 100 мс трафика, но не меньше 16 КиБ
+    return max(rate // 8 // 10, 16 * 1024)
+
+def get_shaping_marker(path=None):
+    return f"{path or CONF}.shaped"
+
+def build_shaping_batch(interface, config):
+    link = parse_rate(SHAPING_LINK_RATE) if SHAPING_LINK_RATE else None
+    parent = "1:1" if link else "1:"
+    egress, ingress = [], []
+    egress_families, ingress_families = set(), set()
+    minor = SHAPING_FIRST_CLASS
+    # Клиенты с неизвестным профилем пропускаются, о них сообщает validate
+    profiles = {name: get_profile(name) for name in PROFILES}
+    for peer in config.peers:
+        settings = profiles.get(peer.profile)
+        if not settings or not (settings['rate'] or settings['upload']) or not peer.ip:
+            continue
+        # inet_pton вместо ipaddress: на десятках тысяч клиентов разбор адресов заметен
+        version = 6 if ':' in peer.ip else 4
+        try:
+            packed = socket.inet_pton(socket.AF_INET6 if version == 6 else socket.AF_INET, peer.ip)
+        except OSError:
+            continue
+        protocol, match, prio, _, _, table = SHAPING_FAMILIES[version]
+        bucket = f"{table:x}:{packed[-1]:x}:"
+        host = f"{peer.ip}/{len(packed) * 8}"
+        if settings['rate']:
+            if minor > 0xffff:
+                raise ValueError(f"Слишком много клиентов с ограничением скорости на {interface}")
+            egress_families.add(version)
+            egress.append(f"class add dev {interface} parent {parent} classid 1:{minor:x} htb "
+                          f"rate {settings['rate']}bit ceil {settings['rate']}bit")
+            egress.append(f"filter add dev {interface} parent 1: prio {prio} protocol {protocol} u32 ht {bucket} "
+                          f"match {match} dst {host} flowid 1:{minor:x}")
+            minor += 1
+        if settings['upload']:
+            ingress_families.add(version)
+            ingress.append(f"filter add dev {interface} parent ffff: prio {prio} protocol {protocol} u32 ht {bucket} "
+                           f"match {match} src {host} "
+                           f"police rate {settings['upload']}bit burst {shaping_burst(settings['upload'])} drop flowid :1")
+    
+    def tables(parent, families, direction):
+        lines = []
+        for version in sorted(families):
+            protocol, _, prio, dst_at, src_at, table = SHAPING_FAMILIES[version]
+            lines.append(f"filter add dev {interface} parent {parent} prio {prio} handle {table:x}: protocol {protocol} u32 divisor 256")
+            lines.append(f"filter add dev {interface} parent {parent} prio {prio} protocol {protocol} u32 "
+                         f"match u32 0 0 hashkey mask 0x000000ff at {dst_at if direction == 'dst' else src_at} link {table:x}:")
+        return lines
+    
+    lines = [f"qdisc replace dev {interface} root handle 2: pfifo"]
+    if link:
+        lines += [
+            f"qdisc replace dev {interface} root handle 1: htb default 2",
+            f"class add dev {interface} parent 1: classid 1:1 htb rate {link}bit",
+            f"class add dev {interface} parent 1:1 classid 1:2 htb rate {link}bit",
+        ]
+    else:
+        lines.append(f"qdisc replace dev {interface} root handle 1: htb")
+    lines += tables('1:', egress_families, 'dst') + egress
+    lines += [f"qdisc replace dev {interface} handle ffff: ingress", f"filter del dev {interface} parent ffff:"]
+    lines += tables('ffff:', ingress_families, 'src') + ingress
+    return "\n".join(lines) + "\n"
+
+# Снятие всех правил; replace перед del - чтобы del не падал, если дисциплины нет
+def build_shaping_clear(interface):
+    return "\n".join([
+        f"qdisc replace dev {interface} root handle 2: pfifo",
+        f"qdisc del dev {interface} root",
+        f"qdisc replace dev {interface} handle ffff: ingress",
+        f"qdisc del dev {interface} ingress",
+    ]) + "\n"
+
+# Правила для текущего интерфейса: по профилям или снятие, если профилей нет
+def shaping_batch_for(interface, config):
+    return build_shaping_batch(interface, config) if PROFILES else build_shaping_clear(interface)
+
+def apply_shaping(interface, batch):
+    with timed('stage', 'shaping'):
+        ok, message = get_backend(interface).shape(batch)
+    if ok:
+        marker = get_shaping_marker()
+        try:
+            if PROFILES and not os.path.exists(marker):
+                write_file_atomic(marker, "")
+            elif not PROFILES and os.path.exists(marker):
+                os.remove(marker)
+        except OSError:
+            # Без отметки правила снимутся командой shape, а не при reload
+            pass
+    return ok, '' if ok else f"tc: {message or 'Неизвестная ошибка'}"
+
+# Применение правил tc к текущему интерфейсу. С changed правила обновляются, только
+# если среди изменённых пиров есть клиенты с профилем. Без профилей полная
+# синхронизация снимает правила, оставшиеся от прежних запусков.
+def sync_shaping(config, changed=None, interface=None):
+    if not PROFILES:
+        if changed is not None or not os.path.exists(get_shaping_marker()):
+            return True, ''
+    elif changed is not None and not any(peer.profile for peer in changed):
+        return True, ''
+    interface = interface or get_interface_name()
+    return apply_shaping(interface, shaping_batch_for(interface, config))
+
+# Секция пира с другим профилем: комментарий # Profile: перед [Peer] заменяется
+def _peer_text_with_profile(text, profile):
+    lines = [line for line in text.splitlines(True) if not line.strip().startswith('# Profile:')]
+    if profile:
+        index = next((i for i, line in enumerate(lines) if line.strip().lower() == '[peer]'), 0)
+        lines.insert(index, f"# Profile: {profile}\n")
+    return "".join(lines)
+
+# Смена профиля клиентов: секции пиров переписываются одной транзакцией,
+# конфиги клиентов строятся заново по шаблону, правила tc применяются один раз
+def set_client_profile(selectors, profile):
+    get_profile(profile)
+    with get_journal().transaction() as txn:
+        peers = select_peers(txn.config, selectors)
+        if not peers:
+            return [], True, ''
+        txn.remove_peers(peers)
+        updated = txn.add_peer_block("".join(_peer_text_with_profile(peer.text(), profile) for peer in peers))
+        config = txn.config
+    store = get_client_store()
+    records = []
+    for peer in updated:
+        record = store.get(peer.name) if peer.name else None
+        if record is not None:
+            record.profile, record.config = profile, None
+            records.append(record)
+    store.update_many(records)
+    applied, message = sync_shaping(config, peers + updated)
+    return updated, applied, message
+
+# Выбор пиров по именам, IP, публичным ключам или шаблонам имён/IP (например, "test-*")
+def select_peers(config, selectors):
+    selected = {}
+    for selector in selectors:
+        selector = selector.strip()
+        if not selector:
+            continue
+        peer = config.find(selector)
+        if peer is not None:
+            selected[id(peer)] = peer
+            continue
+        if any(ch in selector for ch in '*?['):
+            for peer in config.peers:
+                if (peer.name and fnmatch.fnmatchcase(peer.name, selector)) or (peer.ip and fnmatch.fnmatchcase(peer.ip, selector)):
+                    selected[id(peer)] = peer
+    # Сохраняем порядок секций в конфиге
+    return [peer for peer in config.peers if id(peer) in selected] if selected else []
+
+# Пакетное удаление клиентов: ключи собираются до изменений, одна запись
+# в журнал и одно обновление ядра
+def revoke_clients(selectors, config=None):
+    return revoke_peers(lambda current: select_peers(current, selectors), config)
+
+# То же для произвольного выбора: select получает конфиг, прочитанный под блокировкой
+def revoke_peers(select, config=None, remove_files=True):
+    with get_journal().transaction(config) as txn:
+        peers = select(txn.config)
+        if not peers:
+            return [], True, ''
+        pubkeys = [peer.public_key for peer in peers if peer.public_key]
+        txn.remove_peers(peers)
+        config = txn.config
+    if remove_files:
+        remove_client_files(peers)
+    
+    backend = get_backend()
+    backend.remove_peers(pubkeys)
+    applied, message = backend.flush()
+    # Адреса удалённых клиентов с профилем не должны унаследовать их ограничения
+    shaped, error = sync_shaping(config, peers)
+    return peers, applied and shaped, "; ".join(part for part in (message, error) if part)
+
+# Удаление клиентов из хранилища вместе с QR-кодами их конфигов в кэше
+def remove_client_files(peers):
+    names = [peer.name for peer in peers if peer.name]
+    if names:
+        get_client_store().delete_many(names)
+
+# Разбор выбора вида "1,3,5-7" в индексы списка
+def parse_selection(choice, count):
+    indexes = []
+    for part in choice.replace(' ', ',').split(','):
+        if not part:
+            continue
+        start, _, end = part.partition('-')
+        first, last = int(start), int(end or start)
+        if first < 1 or last > count or first > last:
+            raise ValueError(f"Некорректный номер клиента: {part}")
+        indexes.extend(range(first - 1, last))
+    return sorted(set(indexes))
+
+# Чтение списка имён клиентов из CSV или JSON
+def load_client_names(path):
+    with open(path, 'r', newline='') as f:
+        if path.lower().endswith('.json'):
+            data = json.load(f)
+            if isinstance(data, dict):
+                data = data.get('clients', [])
+            return [str(item['name'] if isinstance(item, dict) else item).strip() for item in data]
+        rows = [row for row in csv.reader(f) if row and row[0].strip()]
+    if rows and rows[0][0].strip().lower() in ('name', 'имя'):
+        rows = rows[1:]
+    return [row[0].strip() for row in rows]
+
+# Пакетное создание клиентов: одно чтение конфига, одна запись в журнал, одно обновление ядра
+def provision_clients(names, labels=None, profile=None):
+    with get_journal().transaction() as txn:
+        clients, peers = add_clients_to_config(txn, names, profile=profile)
+        txn.store_clients(clients, labels, profile)
+        config = txn.config
+    
+    applied, message = get_backend().sync(config.text())
+    shaped, error = sync_shaping(config, peers)
+    return clients, applied and shaped, "; ".join(part for part in (message, error) if part)
+
+# Допустимое имя клиента - те же символы, что оставляет импорт; имя попадает
+# в комментарий конфига и в имя файла хранилища
+CLIENT_NAME_RE = re.compile(r'[\w.@+-]+')
+
+# Добавление клиентов в конфиг внутри транзакции журнала.
+# Возвращает кортежи (имя, IP, приватный ключ, публичный ключ, PSK) и новые секции.
+def add_clients_to_config(txn, names, allocator=None, profile=None):
+    config = txn.config
+    if not config.interface_value('PrivateKey'):
+        raise ValueError(f"Не удалось найти приватный ключ в {CONF}")
+    get_profile(profile)
+    
+    store = get_client_store()
+    seen = set()
+    for name in names:
+        # Запись в хранилище без секции в конфиге тоже занимает имя
+        if not CLIENT_NAME_RE.fullmatch(name):
+            raise ValueError(f"Некорректное имя клиента: {name!r} (допустимы буквы, цифры и символы . @ + - _)")
+        if name in config.by_name or name in seen or name in store:
+            raise ValueError(f"Повторяющееся имя клиента: {name!r}")
+        seen.add(name)
+    
+    allocator = allocator or IPAllocator.from_config(config)
+    ips = allocator.allocate_many(len(names))
+    
+    keys = generate_keypairs(len(names))
+    clients = [(name, ip, priv, pub, psk) for name, ip, (priv, pub, psk) in zip(names, ips, keys)]
+    
+    peers = txn.add_peer_block("".join(render_peer_block(name, pub, psk, ip, profile) for name, ip, _, pub, psk in clients))
+    return clients, peers
+
+# Хранилище клиентов. Основное - SQLite-база KEYS_DIR/clients.db: ключи, адрес,
+# интерфейс, время создания и метки клиента; поиск по имени идёт по первичному
+# ключу, а конфиг строится при выдаче. Прежняя раскладка (файл <имя>.conf на
+# клиента) остаётся для совместимости и переносится в базу командой migrate-store.
+CLIENT_DB = "clients.db"
+CLIENT_STORE_BATCH = 1000
+
+class ClientRecord:
+    __slots__ = ('name', 'private_key', 'public_key', 'preshared_key', 'ip', 'interface', 'created', 'labels', 'config', 'profile')
+
+    def __init__(self, name, private_key, public_key=None, preshared_key=None, ip=None,
+                 interface=None, created=None, labels=None, config=None, profile=None):
+        self.name = name
+        self.private_key = private_key
+        self.public_key = public_key
+        self.preshared_key = preshared_key
+        self.ip = ip
+        self.interface = interface
+        self.created = created
+        self.labels = labels or {}
+        # Исходный текст конфига, если он отличается от построенного по шаблону
+        self.config = config
+        self.profile = profile
+
+# Публичный ключ сервера по секции [Interface] конфига; кэш по времени изменения файла
+_server_key_cache = {}
+
+def server_public_key_for(conf=None):
+    conf = conf or CONF
+    key = (conf, os.stat(conf).st_mtime_ns)
+    if key not in _server_key_cache:
+        private_key = None
+        with open(conf, 'r') as f:
+            for line in f:
+                stripped = line.strip()
+                if stripped.lower() == '[peer]':
+                    break
+                name, _, value = stripped.partition('=')
+                if name.strip().lower() == 'privatekey':
+                    private_key = value.split('#', 1)[0].strip()
+        if not private_key:
+            raise ValueError(f"Не удалось найти приватный ключ в {conf}")
+        _server_key_cache[key] = get_server_public_key(private_key)
+    return _server_key_cache[key]
+
+# Текст конфига клиента по записи: с параметрами его шарда (адрес сервера, порт)
+def render_client(record):
+    if record.config:
+        return record.config
+    shard = None
+    if record.interface:
+        shard = next((item for item in get_shards() if item.interface == record.interface), None)
+    with use_shard(shard or Shard(CONF, SUBNET, ENDPOINT)):
+        return render_client_config(record.private_key, record.ip, server_public_key_for(), record.preshared_key, record.profile)
+
+def _parse_client_file(name, text, created=None):
+    values = {}
+    for key in ('PrivateKey', 'PresharedKey', 'Address'):
+        match = re.search(rf'{key}\s*=\s*(\S+)', text)
+        values[key] = match.group(1) if match else None
+    ip = values['Address'].split('/')[0] if values['Address'] else None
+    return ClientRecord(name, values['PrivateKey'], None, values['PresharedKey'], ip, created=created, config=text)
+
+# Удаление QR-кодов конфигов из кэша
+def _drop_qr_cache(contents):
+    cache_dir = get_qr_cache_dir()
+    if not os.path.isdir(cache_dir):
+        return
+    for content in contents:
+        digest = hashlib.sha256(content.encode() if isinstance(content, str) else content).hexdigest()
+        for extension in ('png', 'txt'):
+            cached = os.path.join(cache_dir, f"{digest}.{extension}")
+            if os.path.exists(cached):
+                os.remove(cached)
+
+# Прежняя раскладка: файл KEYS_DIR/<имя>.conf на клиента
+class FileClientStore:
+    kind = 'files'
+
+    def __init__(self, keys_dir):
+        self.keys_dir = keys_dir
+
+    def location(self, name=None):
+        return os.path.join(self.keys_dir, f"{name}.conf") if name else self.keys_dir
+
+    def __contains__(self, name):
+        return os.path.exists(self.location(name))
+
+    def names(self):
+        if not os.path.isdir(self.keys_dir):
+            return []
+        with os.scandir(self.keys_dir) as entries:
+            return sorted(entry.name[:-5] for entry in entries
+                          if entry.name.endswith('.conf') and not entry.name.startswith('.') and entry.is_file())
+
+    def config_text(self, name):
+        try:
+            with open(self.location(name), 'r') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def get(self, name):
+        text = self.config_text(name)
+        if text is None:
+            return None
+        record = _parse_client_file(name, text, os.path.getmtime(self.location(name)))
+        if record.private_key:
+            try:
+                record.public_key = public_key_from_private(record.private_key)
+            except ValueError:
+                pass
+        return record
+
+    def created(self, name):
+        try:
+            return os.stat(self.location(name)).st_mtime
+        except OSError:
+            return None
+
+    def put_many(self, records):
+        ensure_keys_dir(self.keys_dir)
+        for record in records:
+            if record.name in self:
+                raise ValueError(f"Клиент {record.name} уже есть в {self.keys_dir}")
+            write_file_atomic(self.location(record.name), render_client(record), mode=0o600)
+
+    # Замена существующих клиентов (перенос между шардами, смена профиля): файл
+    # переписывается атомарно, QR-коды прежнего конфига удаляются из кэша
+    def update_many(self, records):
+        for record in records:
+            previous = self.config_text(record.name)
+            write_file_atomic(self.location(record.name), render_client(record), mode=0o600)
+            if previous is not None:
+                _drop_qr_cache([previous])
+
+    def delete_many(self, names):
+        contents = []
+        for name in names:
+            text = self.config_text(name)
+            if text is not None:
+                contents.append(text)
+                os.remove(self.location(name))
+        _drop_qr_cache(contents)
+
+    def close(self):
+        pass
+
+class SqliteClientStore:
+    kind = 'sqlite'
+    COLUMNS = ('name', 'private_key', 'public_key', 'preshared_key', 'ip', 'interface', 'created', 'labels', 'config', 'profile')
+
+    def __init__(self, keys_dir):
+        self.keys_dir = keys_dir
+        self.path = os.path.join(keys_dir, CLIENT_DB)
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            ensure_keys_dir(self.keys_dir)
+            if not os.path.exists(self.path):
+                # В базе приватные ключи - создаём её доступной только владельцу
+                os.close(os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o600))
+            import sqlite3
+            # Запись идёт и из потока демона, доступ к соединению последовательный
+            self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS clients (
+                name TEXT PRIMARY KEY, private_key TEXT NOT NULL, public_key TEXT, preshared_key TEXT,
+                ip TEXT, interface TEXT, created REAL, labels TEXT, config TEXT, profile TEXT)""")
+            # Базы прежних версий - без столбца профиля
+            if 'profile' not in {row[1] for row in self._db.execute("PRAGMA table_info(clients)")}:
+                self._db.execute("ALTER TABLE clients ADD COLUMN profile TEXT")
+            self._db.execute("CREATE INDEX IF NOT EXISTS clients_public_key ON clients (public_key)")
+        return self._db
+
+    def location(self, name=None):
+        return f"{self.path}:{name}" if name else self.path
+
+    def __contains__(self, name):
+        return self.db.execute("SELECT 1 FROM clients WHERE name = ?", (name,)).fetchone() is not None
+
+    def names(self):
+        return [row[0] for row in self.db.execute("SELECT name FROM clients ORDER BY name")]
+
+    def _record(self, row):
+        values = dict(zip(self.COLUMNS, row))
+        values['labels'] = json.loads(values['labels']) if values['labels'] else {}
+        return ClientRecord(**values)
+
+    def get(self, name):
+        row = self.db.execute(f"SELECT {', '.join(self.COLUMNS)} FROM clients WHERE name = ?", (name,)).fetchone()
+        return self._record(row) if row else None
+
+    def config_text(self, name):
+        record = self.get(name)
+        return render_client(record) if record else None
+
+    def created(self, name):
+        row = self.db.execute("SELECT created FROM clients WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def put_many(self, records):
+        import sqlite3
+        rows = ((record.name, record.private_key, record.public_key, record.preshared_key, record.ip,
+                 record.interface, record.created, json.dumps(record.labels, ensure_ascii=False) if record.labels else None,
+                 record.config, record.profile) for record in records)
+        try:
+            with self.db:
+                self.db.executemany(f"INSERT INTO clients ({', '.join(self.COLUMNS)}) "
+                                    f"VALUES ({', '.join('?' * len(self.COLUMNS))})", rows)
+        except sqlite3.IntegrityError as e:
+            # Повтор имени не должен затирать ключи существующего клиента
+            raise ValueError(f"Клиент уже есть в {self.path}: {e}")
+
+    # Замена существующих клиентов одной транзакцией; QR-коды прежних конфигов удаляются из кэша
+    def update_many(self, records):
+        records = list(records)
+        if os.path.isdir(get_qr_cache_dir()):
+            _drop_qr_cache(text for text in map(self.config_text, (record.name for record in records)) if text)
+        columns = self.COLUMNS[1:]
+        rows = ((record.private_key, record.public_key, record.preshared_key, record.ip, record.interface, record.created,
+                 json.dumps(record.labels, ensure_ascii=False) if record.labels else None, record.config, record.profile,
+                 record.name) for record in records)
+        with self.db:
+            self.db.executemany(f"UPDATE clients SET {', '.join(f'{column} = ?' for column in columns)} WHERE name = ?", rows)
+
+    def delete_many(self, names):
+        names = list(names)
+        if os.path.isdir(get_qr_cache_dir()):
+            _drop_qr_cache(text for text in map(self.config_text, names) if text)
+        with self.db:
+            self.db.executemany("DELETE FROM clients WHERE name = ?", ((name,) for name in names))
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+_client_stores = {}
+
+def _has_client_files(keys_dir):
+    if not os.path.isdir(keys_dir):
+        return False
+    with os.scandir(keys_dir) as entries:
+        return any(entry.name.endswith('.conf') and not entry.name.startswith('.') for entry in entries)
+
+# Модуль sqlite3 есть не в каждой сборке Python
+def _sqlite_available():
+    try:
+        import sqlite3
+    except ImportError:
+        return False
+    return True
+
+# Хранилище для текущего KEYS_DIR. В режиме auto база используется, если она
+# уже есть или в каталоге ещё нет конфигов в прежней раскладке
+def get_client_store(kind=None):
+    kind = kind or os.environ.get('WG_MANAGER_CLIENT_STORE', CLIENT_STORE)
+    if kind == 'auto':
+        use_db = _sqlite_available() and (os.path.exists(os.path.join(KEYS_DIR, CLIENT_DB)) or not _has_client_files(KEYS_DIR))
+        kind = 'sqlite' if use_db else 'files'
+    if kind not in ('sqlite', 'files'):
+        raise ValueError(f"Неизвестное хранилище клиентов: {kind}")
+    if kind == 'sqlite' and not _sqlite_available():
+        raise RuntimeError("Модуль sqlite3 недоступен, используйте CLIENT_STORE = \"files\"")
+    key = (kind, KEYS_DIR)
+    if key not in _client_stores:
+        _client_stores[key] = SqliteClientStore(KEYS_DIR) if kind == 'sqlite' else FileClientStore(KEYS_DIR)
+    return _client_stores[key]
+
+# Перенос конфигов <имя>.conf в базу. Публичный ключ и интерфейс берутся из
+# серверных конфигов по имени клиента; текст, совпадающий с шаблоном, не
+# хранится - он будет построен заново. Возвращает (перенесено, с исходным
+# текстом, уже было в базе).
+def migrate_client_store(remove=False):
+    source = get_client_store('files')
+    target = get_client_store('sqlite')
+    owners = {}
+    for shard, peer in list_sharded():
+        if peer.name:
+            owners[peer.name] = (shard.interface, peer.public_key)
+    imported, custom, skipped = 0, 0, 0
+    batch = []
+    moved = []
+    
+    def flush():
+        target.put_many(batch)
+        moved.extend(record.name for record in batch)
+        batch.clear()
+    
+    for name in source.names():
+        if name in target:
+            skipped += 1
+            continue
+        text = source.config_text(name)
+        record = _parse_client_file(name, text, source.created(name))
+        if not record.private_key:
+            raise ValueError(f"В {source.location(name)} нет приватного ключа")
+        record.interface, record.public_key = owners.get(name, (get_interface_name(), None))
+        if not record.public_key:
+            record.public_key = public_key_from_private(record.private_key)
+        record.config = None
+        try:
+            rendered = render_client(record)
+        except (OSError, ValueError):
+            rendered = None
+        if rendered != text:
+            record.config = text
+            custom += 1
+        batch.append(record)
+        imported += 1
+        if len(batch) >= CLIENT_STORE_BATCH:
+            flush()
+    if batch:
+        flush()
+    if remove:
+        # Файлы удаляются только после записи в базу; QR-кэш остаётся действительным
+        for name in moved:
+            os.remove(source.location(name))
+    return imported, custom, skipped
+
+# Сохранение клиентов в хранилище
+def write_client_configs(config, clients, labels=None, profile=None):
+    now = time.time()
+    interface = get_interface_name()
+    get_client_store().put_many(ClientRecord(name, priv, pub, psk, ip, interface, now, labels, profile=profile)
+                                for name, ip, priv, pub, psk in clients)
+
+# Импорт пиров, созданных вручную или другими менеджерами: серверный конфиг без
+# пометок "# Client:", вывод wg show dump, каталог конфигов клиентов и JSON
+# (wg-easy, массив объектов или JSON Lines). Источники читаются потоково, но
+# готовые секции, строки отчёта и записи хранилища держатся в памяти до записи,
+# как и сам конфиг, поэтому размер импорта ограничен памятью. Дубликаты
+# отбрасываются по публичному ключу. Имена, адреса и пересечения с пулом
+# проверяются по мере чтения по снимку конфига без блокировки. Затем под
+# блокировкой проверяется, что конфиг за это время не занял те же ключи, имена
+# и адреса, и все пиры записываются одной транзакцией: при конфликтах (без
+# --skip-conflicts) не записывается ничего.
+# С name_existing безымянные пиры, уже записанные в конфиг, получают имя на месте
+# в той же транзакции.
+IMPORT_TYPES = ('auto', 'conf', 'dump', 'clients', 'json')
+IMPORT_NAME_TEMPLATE = "peer-{n}"  # Имя пира без имени: {n} - номер, {ip} - адрес, {key} - начало ключа
+_IMPORT_NAME_COMMENT = re.compile(r'#+\s*(?:client|name|friendly[_ ]?name|peer|begin)(?:\s*[:=]\s*|\s+)(\S.*?)\s*#*\s*',
+                                  re.IGNORECASE)
+_IMPORT_FIELDS = {
+    'name': ('name', 'friendly_name', 'friendlyName', 'client', 'label'),
+    'public_key': ('public_key', 'publicKey', 'PublicKey', 'pubkey'),
+    'private_key': ('private_key', 'privateKey', 'PrivateKey'),
+    'preshared_key': ('preshared_key', 'presharedKey', 'preSharedKey', 'PresharedKey', 'psk'),
+    'addresses': ('ip', 'address', 'Address', 'addresses', 'ipv4Address', 'allowed_ips', 'allowedIps', 'allowedIPs', 'AllowedIPs'),
+}
+
+class ImportedPeer:
+    __slots__ = ('source', 'name', 'public_key', 'private_key', 'preshared_key', 'addresses', 'config')
+
+    def __init__(self, source, name=None, public_key=None, private_key=None, preshared_key=None,
+                 addresses=None, config=None):
+        self.source = source
+        self.name = name
+        self.public_key = public_key
+        self.private_key = private_key
+        self.preshared_key = preshared_key
+        self.addresses = addresses or []
+        # Исходный конфиг клиента (только для импорта каталога клиентов)
+        self.config = config
+
+def _import_name(comments):
+    for comment in reversed(comments):
+        match = _IMPORT_NAME_COMMENT.fullmatch(comment)
+        if match:
+            return match.group(1)
+    return None
+
+def _split_values(value):
+    return [entry.strip() for entry in value.split(',') if entry.strip()]
+
+# Серверный конфиг: имя берётся из комментария перед [Peer] или в начале секции
+# ("# Client: x", "### Client x", "### begin x ###", "# Name = x")
+def _iter_import_conf(path):
+    with open(path, 'r') as f:
+        comments, peer = [], None
+        for line in f:
+            stripped = line.strip()
+            if not stripped:
+                continue
+            if stripped.startswith('#'):
+                comments.append(stripped)
+                continue
+            if stripped.startswith('['):
+                if peer is not None:
+                    yield peer
+                peer = ImportedPeer(path, _import_name(comments)) if stripped.lower() == '[peer]' else None
+                comments = []
+                continue
+            if peer is None or '=' not in stripped:
+                continue
+            if comments:
+                peer.name = peer.name or _import_name(comments)
+                comments = []
+            key, value = stripped.split('=', 1)
+            key, value = key.strip().lower(), value.split('#', 1)[0].strip()
+            if key == 'publickey':
+                peer.public_key = value
+            elif key == 'presharedkey':
+                peer.preshared_key = value
+            elif key == 'allowedips':
+                peer.addresses.extend(_split_values(value))
+        if peer is not None:
+            yield peer
+
+def _iter_import_dump(path):
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) == 9:
+                # В выводе wg show all dump первым полем идёт имя интерфейса
+                fields = fields[1:]
+            if len(fields) != 8:
+                continue
+            yield ImportedPeer(path, public_key=fields[0], preshared_key=None if fields[1] == '(none)' else fields[1],
+                               addresses=[] if fields[3] == '(none)' else fields[3].split(','))
+
+# Конфиги клиентов: имя - имя файла, публичный ключ выводится из приватного
+def _iter_import_clients(path):
+    if os.path.isdir(path):
+        with os.scandir(path) as entries:
+            files = sorted(entry.path for entry in entries if entry.name.endswith('.conf') and entry.is_file())
+    else:
+        files = [path]
+    for file_path in files:
+        with open(file_path, 'r') as f:
+            text = f.read()
+        record = _parse_client_file(None, text)
+        yield ImportedPeer(file_path, os.path.basename(file_path)[:-5] if file_path.endswith('.conf') else None,
+                           None, record.private_key, record.preshared_key, [record.ip] if record.ip else [], text)
+
+# Объекты JSON по одному: массив разбирается по элементам, JSON Lines - по строкам,
+# а объект целиком (wg-easy: {"clients": {"id": {...}}}) загружается как есть
+def _iter_json_items(path):
+    decoder = json.JSONDecoder()
+    with open(path, 'r') as f:
+        buffer = f.read(1 << 16).lstrip()
+        if buffer.startswith('{'):
+            try:
+                _, end = decoder.raw_decode(buffer)
+                lines = buffer[end:].lstrip().startswith('{')
+            except ValueError:
+                lines = False
+            f.seek(0)
+            if lines:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+                return
+            data = json.load(f)
+            items = data.get('clients') or data.get('peers') or []
+            yield from (items.values() if isinstance(items, dict) else items)
+            return
+        if not buffer.startswith('['):
+            raise ValueError(f"{path}: ожидается массив или объект JSON")
+        position = 1
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                chunk = f.read(1 << 16)
+                if not chunk:
+                    raise ValueError(f"{path}: некорректный или обрезанный JSON")
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield item
+
+def _iter_import_json(path):
+    for item in _iter_json_items(path):
+        if not isinstance(item, dict):
+            continue
+        values = {}
+        for field, aliases in _IMPORT_FIELDS.items():
+            values[field] = next((item[alias] for alias in aliases if item.get(alias) not in (None, '')), None)
+        addresses = values.pop('addresses')
+        if isinstance(addresses, str):
+            addresses = _split_values(addresses)
+        name = values.pop('name')
+        yield ImportedPeer(path, str(name) if name is not None else None, addresses=list(addresses or []), **values)
+
+def detect_import_type(path):
+    if os.path.isdir(path):
+        return 'clients'
+    if path.lower().endswith(('.json', '.jsonl')):
+        return 'json'
+    with open(path, 'r') as f:
+        head = f.read(1 << 14)
+    stripped = head.lstrip()
+    if stripped.startswith('{') or re.match(r'\[\s*[{\]]', stripped):
+        return 'json'
+    first = next((line for line in head.splitlines() if line.strip()), '')
+    if first.count('\t') >= 3:
+        return 'dump'
+    # Конфиг клиента - [Interface] с адресом и без ListenPort
+    if re.search(r'^\s*Address\s*=', head, re.M | re.I) and not re.search(r'^\s*ListenPort\s*=', head, re.M | re.I):
+        return 'clients'
+    return 'conf'
+
+def _derive_public_keys(peers):
+    try:
+        keys = public_keys_from_private([peer.private_key for peer in peers])
+    except ValueError:
+        keys = []
+        for peer in peers:
+            try:
+                keys.append(public_key_from_private(peer.private_key))
+            except ValueError:
+                keys.append(None)
+    for peer, key in zip(peers, keys):
+        peer.public_key = key
+    return peers
+
+# Пиры из источника; ключи клиентов выводятся пачками по CLIENT_STORE_BATCH
+def iter_import_peers(path, kind='auto'):
+    kind = detect_import_type(path) if kind == 'auto' else kind
+    readers = {'conf': _iter_import_conf, 'dump': _iter_import_dump, 'clients': _iter_import_clients, 'json': _iter_import_json}
+    pending = []
+    for peer in readers[kind](path):
+        if peer.public_key or not peer.private_key:
+            yield peer
+            continue
+        pending.append(peer)
+        if len(pending) >= CLIENT_STORE_BATCH:
+            yield from _derive_public_keys(pending)
+            pending = []
+    yield from _derive_public_keys(pending)
+
+# Пиры из всех источников без повторов публичного ключа; повторы попадают в отчёт rows
+def _unique_import_peers(sources, kind, rows):
+    seen = set()
+    for source in sources:
+        for peer in iter_import_peers(source, kind):
+            if peer.public_key in seen:
+                rows.append(_import_row(peer, 'duplicate', "ключ уже встречался в импорте"))
+                continue
+            if peer.public_key:
+                seen.add(peer.public_key)
+            yield peer
+
+def _import_row(peer, status, detail=None, name=None, ip=None):
+    return {'name': name or peer.name, 'ip': ip, 'public_key': peer.public_key, 'source': peer.source,
+            'status': status, 'detail': detail}
+
+# Адрес пира в пуле и остальные сети из AllowedIPs; записи, которые не являются
+# адресом или сетью (10.8.0.5/x, abc), дают ValueError - такой пир не импортируется
+def _split_import_addresses(addresses, network):
+    ip, routes, fallback = None, [], None
+    for entry in addresses:
+        try:
+            parsed = ipaddress.ip_network(entry, strict=False)
+        except ValueError:
+            raise ValueError(f"некорректная запись AllowedIPs {entry!r}")
+        address = entry.partition('/')[0]
+        host = parsed.prefixlen == parsed.max_prefixlen
+        if host and ip is None and parsed.network_address in network:
+            ip = address
+        elif host and fallback is None and ip is None:
+            fallback = entry
+            routes.append(entry)
+        else:
+            routes.append(entry)
+    if ip is None and fallback is not None:
+        routes.remove(fallback)
+        ip = fallback.partition('/')[0]
+    return ip, routes
+
+# Импорт в текущий интерфейс. Возвращает (строки отчёта, число проблем, применено, сообщение);
+# при проблемах без skip_conflicts и при dry_run конфиг не меняется, а пиры остаются в статусе ready
+def import_peers(sources, kind='auto', reassign=False, skip_conflicts=False, dry_run=False,
+                 template=None, labels=None, profile=None, name_existing=False):
+    get_profile(profile)
+    template = template or IMPORT_NAME_TEMPLATE
+    try:
+        template.format(n=1, ip='', key='')
+    except (KeyError, IndexError, ValueError):
+        raise ValueError(f"Некорректный шаблон имени {template!r}: допустимы {{n}}, {{ip}} и {{key}}")
+    rows = []
+    
+    # Имена клиентов глобальны для всех шардов и хранилища, ключи - для всех шардов
+    store = get_client_store()
+    taken_names, taken_keys = set(store.names()), set()
+    if is_sharded():
+        for shard, peer in list_sharded():
+            if shard.conf != CONF:
+                taken_keys.add(peer.public_key)
+                taken_names.add(peer.name)
+    interface = get_interface_name()
+    now = time.time()
+    problems = 0
+    records, named, blocks = [], [], []
+    
+    def unique_name(peer, ip):
+        name = re.sub(r'[^\w.@+-]+', '-', peer.name).strip('-') if peer.name else ''
+        if not name:
+            key = re.sub(r'[^A-Za-z0-9]', '', peer.public_key)[:8]
+            while True:
+                name = re.sub(r'[^\w.@+-]+', '-', template.format(n=next(counter), ip=ip, key=key)).strip('-')
+                if '{n}' not in template or (name not in taken_names and name not in config.by_name):
+                    break
+        base, suffix = name, 1
+        while name in taken_names or name in config.by_name:
+            suffix += 1
+            name = f"{base}-{suffix}"
+        taken_names.add(name)
+        return name
+    
+    def make_record(peer, name, ip):
+        record = ClientRecord(name, peer.private_key, peer.public_key, peer.preshared_key, ip,
+                              interface, now, labels, profile=profile)
+        # Исходный конфиг клиента сохраняется, если он для этого сервера, адрес прежний
+        # и текст отличается от шаблона; иначе конфиг строится заново
+        if peer.config and ip in peer.addresses and server_public_key_for() in peer.config:
+            if render_client_config(peer.private_key, ip, server_public_key_for(), peer.preshared_key, profile) != peer.config:
+                record.config = peer.config
+        return record
+    
+    # Источники разбираются и проверяются по снимку конфига без эксклюзивной
+    # блокировки; под ней только повторная проверка и запись
+    config = load_config()
+    allocator = IPAllocator.from_config(config)
+    counter = itertools.count(1)
+    for peer in _unique_import_peers(sources, kind, rows):
+        if not peer.public_key or not _KEY_RE.fullmatch(peer.public_key):
+            problems += 1
+            rows.append(_import_row(peer, 'invalid', "нет корректного публичного или приватного ключа"))
+            continue
+        if peer.public_key in config.by_pubkey or peer.public_key in taken_keys:
+            existing = config.by_pubkey.get(peer.public_key)
+            if name_existing and existing is not None and not existing.name:
+                name = unique_name(peer, existing.ip)
+                if peer.private_key and existing.ip:
+                    records.append(make_record(peer, name, existing.ip))
+                rows.append(_import_row(peer, 'ready', "имя для пира из конфига", name, existing.ip))
+                named.append((existing, name, rows[-1]))
+                peer.config = None
+                continue
+            rows.append(_import_row(peer, 'exists', "ключ уже есть в конфиге",
+                                    existing.name if existing else None, existing.ip if existing else None))
+            continue
+        try:
+            ip, routes = _split_import_addresses(peer.addresses, allocator.network)
+        except ValueError as e:
+            problems += 1
+            rows.append(_import_row(peer, 'invalid', str(e)))
+            continue
+        detail = None
+        if any(ipaddress.ip_network(route, strict=False).overlaps(allocator.network) for route in routes):
+            problems += 1
+            rows.append(_import_row(peer, 'conflict', "маршрут в AllowedIPs пересекается с пулом", ip=ip))
+            continue
+        if ip is not None and allocator.is_free(ip):
+            allocator.reserve(ip)
+        elif reassign and allocator.free_count > 0:
+            old, ip = ip, allocator.allocate()
+            detail = f"адрес {old} заменён" if old else "адрес выдан"
+        else:
+            problems += 1
+            if ip is None:
+                reason = "нет адреса"
+            elif ipaddress.ip_address(ip) not in allocator.network:
+                reason = f"адрес вне подсети {allocator.network}"
+            else:
+                reason = "адрес занят" if not reassign else "свободных адресов нет"
+            rows.append(_import_row(peer, 'conflict', reason, ip=ip))
+            continue
+        
+        name = unique_name(peer, ip)
+        if peer.name and name != peer.name:
+            detail = "; ".join(part for part in (detail, f"переименован из {peer.name}") if part)
+        
+        blocks.append(render_peer_block(name, peer.public_key, peer.preshared_key, ip, profile, routes))
+        if peer.private_key:
+            records.append(make_record(peer, name, ip))
+        rows.append(_import_row(peer, 'ready', detail, name, ip))
+        peer.config = None
+    
+    planned = [row for row in rows if row['status'] == 'ready']
+    if dry_run or not planned or (problems and not skip_conflicts):
+        return rows, problems, True, ''
+    
+    with get_journal().transaction() as txn:
+        current = txn.config
+        # Пока шёл разбор, конфиг могли изменить: ключи, имена и адреса должны быть ещё свободны
+        current_allocator = IPAllocator.from_config(current)
+        named_keys = {existing.public_key for existing, _, _ in named}
+        conflicts = []
+        for row in planned:
+            peer = current.by_pubkey.get(row['public_key'])
+            if row['public_key'] in named_keys:
+                free = peer is not None and not peer.name
+            else:
+                free = peer is None and current_allocator.is_free(row['ip'])
+            if not free or row['name'] in current.by_name:
+                conflicts.append(row['name'])
+        if conflicts:
+            raise ValueError(f"Конфиг изменился во время импорта, конфликтуют: {', '.join(conflicts[:10])}"
+                             f"{' ...' if len(conflicts) > 10 else ''}. Повторите импорт")
+        for existing, name, _ in named:
+            txn.name_peer(current.by_pubkey[existing.public_key], name)
+        text = "".join(blocks)
+        # Большой пакет сразу переписывает конфиг, минуя журнал
+        txn.rewrite = txn.rewrite or len(text) > JOURNAL_COMPACT_BYTES
+        with timed('stage', 'import_write', peers=len(blocks)):
+            added = txn.add_peer_block(text) if text else []
+        text = blocks = None
+        # Ключи сохраняются до записи журнала
+        txn.store_records(records)
+        config = txn.config
+    for _, _, row in named:
+        row['status'] = 'named'
+    for row in rows:
+        if row['status'] == 'ready':
+            row['status'] = 'imported'
+    
+    applied, message = get_backend().sync(config.text())
+    shaped, error = sync_shaping(config, added)
+    return rows, problems, applied and shaped, "; ".join(part for part in (message, error) if part)
+
+@menu_decorator
+def add_client():
+    print(f"{Colors.BOLD}Добавление нового клиента{Colors.ENDC}\n")
+    
+    client_name = input("Введите имя клиента (или нажмите Enter для автогенерации): ")
+    if not client_name:
+        timestamp = datetime.datetime.now().strftime("%s")
+        client_name = f"client-{timestamp}"
+    if not CLIENT_NAME_RE.fullmatch(client_name):
+        print(f"{Colors.FAIL}Некорректное имя клиента: допустимы буквы, цифры и символы . @ + - _{Colors.ENDC}")
+        input("\nНажмите Enter для возврата в меню...")
+        return
+    
+    profile = None
+    if PROFILES:
+        profile = input(f"Профиль ({', '.join(sorted(PROFILES))}; Enter - без профиля): ").strip() or None
+    
+    try:
+        get_profile(profile)
+        config = load_config()
+        
+        if client_name in config.by_name or client_name in get_client_store():
+            print(f"{Colors.FAIL}Клиент {client_name} уже существует{Colors.ENDC}")
+            input("\nНажмите Enter для возврата в меню...")
+            return
+        
+        server_priv = config.interface_value('PrivateKey')
+        if not server_priv:
+            print(f"{Colors.FAIL}Не удалось найти приватный ключ в {CONF}{Colors.ENDC}")
+            input("\nНажмите Enter для возврата в меню...")
+            return
+        
+        # Получение публичного ключа сервера
+        try:
+            server_pub = get_server_public_key(server_priv)
+        except ValueError as e:
+            print(f"{Colors.FAIL}Не удалось получить публичный ключ сервера: {str(e)}{Colors.ENDC}")
+            input("\nНажмите Enter для возврата в меню...")
+            return
+        
+        # Генерация ключей клиента
+        client_priv, client_pub, psk = generate_keypairs(1)[0]
+        
+        # Добавление клиента в серверный конфиг под блокировкой: адрес выбирается
+        # по актуальному конфигу, запись уходит в журнал
+        with get_journal().transaction(config) as txn:
+            client_ip = find_free_ip(txn.config)
+            if client_ip:
+                peer = txn.add_peer_block(render_peer_block(client_name, client_pub, psk, client_ip, profile))[0]
+                txn.store_clients([(client_name, client_ip, client_priv, client_pub, psk)], profile=profile)
+                config = txn.config
+        if not client_ip:
+            input("\nНажмите Enter для возврата в меню...")
+            return
+        
+        # Динамическое применение изменений через бэкенд (wg set)
+        try:
+            print(f"\n{Colors.CYAN}Пробуем применить изменения динамически...{Colors.ENDC}")
+            
+            backend = get_backend()
+            backend.add_peers([peer])
+            applied, message = backend.flush()
+            shaped, error = sync_shaping(config, [peer])
+            applied, message = applied and shaped, "; ".join(part for part in (message, error) if part)
+            
+            # Проверяем результат
+            if applied:
+                print(f"{Colors.GREEN}Изменения успешно применены динамически!{Colors.ENDC}")
+            else:
+                print(f"{Colors.WARNING}Не удалось применить изменения динамически: {message or 'Неизвестная ошибка'}{Colors.ENDC}")
+                print(f"{Colors.WARNING}Изменения будут применены при следующем перезапуске WireGuard.{Colors.ENDC}")
+                
+        except Exception as e:
+            print(f"{Colors.WARNING}Не удалось применить изменения динамически: {str(e)}{Colors.ENDC}")
+            print(f"{Colors.WARNING}Изменения будут применены при следующем перезапуске WireGuard.{Colors.ENDC}")
+        
+        # Создание клиентского конфига
+        client_conf = render_client_config(client_priv, client_ip, server_pub, psk, profile)
+        
+        store = get_client_store()
+        
+        print(f"\n{Colors.GREEN}Клиент {Colors.BOLD}{client_name}{Colors.ENDC}{Colors.GREEN} добавлен с IP {Colors.BOLD}{client_ip}{Colors.ENDC}")
+        print(f"{Colors.GREEN}Конфиг клиента сохранён в {Colors.BOLD}{store.location(client_name)}{Colors.ENDC}")
+        
+        show_keys = input("\nХотите просмотреть ключи? (д/н): ").lower()
+        if show_keys == 'д' or show_keys == 'y' or show_keys == 'да' or show_keys == 'yes':
+            clear_screen()
+            print_header()
+            print(f"{Colors.BOLD}Ключи клиента {client_name}:{Colors.ENDC}\n")
+            print(f"{Colors.CYAN}Приватный ключ: {Colors.BOLD}{client_priv}{Colors.ENDC}")
+            print(f"{Colors.CYAN}Публичный ключ: {Colors.BOLD}{client_pub}{Colors.ENDC}")
+            print(f"{Colors.CYAN}PSK: {Colors.BOLD}{psk}{Colors.ENDC}")
+            print(f"\n{Colors.BOLD}Конфигурация:{Colors.ENDC}\n")
+            print(f"{Colors.CYAN}{client_conf}{Colors.ENDC}")
+            
+    except Exception as e:
+        print(f"{Colors.FAIL}Произошла ошибка: {str(e)}{Colors.ENDC}")
+    
+    input("\nНажмите Enter для возврата в меню...")
+
+@menu_decorator
+def bulk_add_clients():
+    print(f"{Colors.BOLD}Массовое добавление клиентов{Colors.ENDC}\n")
+    
+    source = input("Введите количество клиентов или путь к CSV/JSON файлу с именами: ").strip()
+    if not source:
+        return
+    
+    try:
+        if source.isdigit():
+            timestamp = datetime.datetime.now().strftime("%s")
+            names = [f"client-{timestamp}-{i}" for i in range(1, int(source) + 1)]
+        else:
+            names = load_client_names(source)
+        
+        if not names:
+            print(f"{Colors.WARNING}Список клиентов пуст{Colors.ENDC}")
+            input("\nНажмите Enter для возврата в меню...")
+            return
+        
+        print(f"\n{Colors.CYAN}Создаём {len(names)} клиентов...{Colors.ENDC}")
+        started = time.time()
+        clients, applied, message = provision_clients(names)
+        
+        if applied:
+            print(f"{Colors.GREEN}Изменения успешно применены динамически!{Colors.ENDC}")
+        else:
+            print(f"{Colors.WARNING}Не удалось применить изменения динамически: {message or 'Неизвестная ошибка'}{Colors.ENDC}")
+            print(f"{Colors.WARNING}Изменения будут применены при следующем перезапуске WireGuard.{Colors.ENDC}")
+        
+        print(f"\n{Colors.GREEN}Добавлено клиентов: {Colors.BOLD}{len(clients)}{Colors.ENDC}{Colors.GREEN} за {time.time() - started:.2f} с{Colors.ENDC}")
+        print(f"{Colors.GREEN}Конфиги клиентов сохранены в {Colors.BOLD}{get_client_store().location()}{Colors.ENDC}")
+        
+    except Exception as e:
+        print(f"{Colors.FAIL}Произошла ошибка: {str(e)}{Colors.ENDC}")
+    
+    input("\nНажмите Enter для возврата в меню...")
+
+# Поиск клиентов для меню: индекс по именам, IP и публичным ключам - одна общая
+# строка, по которой ищут str.find и регулярные выражения (оба работают на C);
+# номер клиента по смещению находит bisect. Совпадения выдаются лениво: для
+# показа страницы не нужно искать дальше неё.
+class ClientIndex:
+    def __init__(self, peers):
+        self.peers = peers
+        self.offsets = []
+        parts = []
+        position = 0
+        for peer in peers:
+            text = f"{peer.name or ''}\t{peer.ip or ''}\t{peer.public_key or ''}".lower()
+            self.offsets.append(position)
+            parts.append(text)
+            position += len(text) + 1
+        self.text = "\n".join(parts)
+
+    # find(start) - позиция следующего совпадения или -1
+    def _scan(self, find):
+        offsets, count = self.offsets, len(self.offsets)
+        position = find(0)
+        while position != -1:
+            row = bisect.bisect_right(offsets, position) - 1
+            yield row
+            # Следующее совпадение ищем уже со следующего клиента
+            if row + 1 >= count:
+                break
+            position = find(offsets[row + 1])
+
+    # Номера подходящих клиентов в порядке конфига. Запрос: подстрока;
+    # ^начало - поиск по началу имени, IP или ключа; шаблон с * ? [ - как в delete
+    def search(self, query):
+        query = query.strip()
+        if not query:
+            return iter(range(len(self.peers)))
+        if any(ch in query for ch in '*?['):
+            match = re.compile(fnmatch.translate(query)).match
+            return (index for index, peer in enumerate(self.peers)
+                    if (peer.name and match(peer.name)) or (peer.ip and match(peer.ip)))
+        query = query.lower()
+        if query.startswith('^'):
+            # Начало поля: в начале строки (имя) или после табуляции (IP, ключ).
+            # Для каждого разделителя помним ближайшее совпадение, чтобы не
+            # просматривать текст заново на каждом шаге
+            text, prefix = self.text, query[1:]
+            needles = ['\n' + prefix, '\t' + prefix]
+            found = [-2, -2]
+            
+            def find(start):
+                if start == 0 and text.startswith(prefix):
+                    return 0
+                for i, needle in enumerate(needles):
+                    if found[i] != -1 and found[i] < start - 1:
+                        found[i] = text.find(needle, max(start - 1, 0))
+                positions = [position for position in found if position != -1]
+                return min(positions) + 1 if positions else -1
+            return self._scan(find)
+        return self._scan(lambda start: self.text.find(query, start))
+
+# Результаты поиска, вычисляемые по мере надобности
+class LazyResults:
+    def __init__(self, rows):
+        self._rows = rows
+        self.items = []
+        self.complete = False
+
+    def fetch(self, count=None):
+        while not self.complete and (count is None or len(self.items) < count):
+            chunk = list(itertools.islice(self._rows, 1024 if count is None else count - len(self.items)))
+            self.items.extend(chunk)
+            if not chunk:
+                self.complete = True
+        return self.items
+
+# Выбор клиентов в меню: поиск, постраничный вывод (печатается только текущая
+# страница) и выбор нескольких клиентов. mode: browse - только просмотр,
+# single - один клиент, multi - несколько. Возвращает выбранные секции.
+PICKER_HELP = ("текст - поиск (^ - по началу, * ? - шаблон), n/p - страницы, "
+               "номера 1,3,5-7 - выбор, + - все найденные, - - снять выбор, Enter - готово, 0 - отмена")
+PICKER_BROWSE_HELP = "текст - поиск (^ - по началу, * ? - шаблон), n/p - страницы, Enter - выход"
+
+def pick_clients(title, config=None, mode='multi'):
+    if config is None:
+        config = load_config() if os.path.exists(CONF) else WgConfig()
+    peers = config.peers
+    if not peers:
+        print(f"{Colors.WARNING}Клиенты не найдены{Colors.ENDC}")
+        input("\nНажмите Enter для возврата в меню...")
+        return []
+    index = ClientIndex(peers)
+    query = ''
+    results = LazyResults(index.search(query))
+    selected = set()
+    page = 0
+    while True:
+        page_size = max(5, shutil.get_terminal_size().lines - 14)
+        start = page * page_size
+        # Ищем на одного клиента дальше страницы, чтобы знать, есть ли следующая
+        items = results.fetch(start + page_size + 1)
+        if results.complete:
+            pages = max(1, -(-len(items) // page_size))
+            found = f"найдено {len(items)}"
+        else:
+            pages = '?'
+            found = f"найдено больше {len(items) - 1}"
+        
+        clear_screen()
+        print_header()
+        print(f"{Colors.BOLD}{title}{Colors.ENDC}\n")
+        if query:
+            print(f"{Colors.CYAN}Поиск: {Colors.BOLD}{query}{Colors.ENDC}\n")
+        print(f"{Colors.CYAN}  {'№':<7}{'Имя':<24}{'IP адрес':<18}{'Публичный ключ'}{Colors.ENDC}")
+        print("-" * 94)
+        for number in range(start, min(start + page_size, len(items))):
+            peer = peers[items[number]]
+            mark = '*' if items[number] in selected else ' '
+            print(f"{mark} {number + 1:<7}{(peer.name or '-')[:23]:<24}{(peer.ip or '-'):<18}{peer.public_key or '-'}")
+        if not items:
+            print(f"{Colors.WARNING}Ничего не найдено{Colors.ENDC}")
+        print("-" * 94)
+        status = f"Страница {page + 1}/{pages}, {found} из {len(peers)}"
+        if mode == 'multi':
+            status += f", выбрано {len(selected)}"
+        print(status)
+        print(f"{Colors.CYAN}{PICKER_HELP if mode != 'browse' else PICKER_BROWSE_HELP}{Colors.ENDC}")
+        
+        choice = input("\n> ").strip()
+        if choice == '0' and mode != 'browse':
+            return []
+        if not choice:
+            if mode == 'multi':
+                return [peer for position, peer in enumerate(peers) if position in selected]
+            return []
+        if choice in ('n', '>'):
+            if len(items) > start + page_size:
+                page += 1
+        elif choice in ('p', '<'):
+            page = max(page - 1, 0)
+        elif choice == '+' and mode == 'multi':
+            selected.update(results.fetch())
+        elif choice == '-' and mode == 'multi':
+            selected.clear()
+        elif mode != 'browse' and re.fullmatch(r'[\d\s,-]+', choice):
+            items = results.fetch(max(int(number) for number in re.findall(r'\d+', choice)))
+            try:
+                numbers = parse_selection(choice, len(items))
+            except ValueError as e:
+                print(f"{Colors.FAIL}{e}{Colors.ENDC}")
+                time.sleep(1)
+                continue
+            if mode == 'single':
+                return [peers[items[numbers[0]]]] if numbers else []
+            # Повторный выбор снимает отметку
+            selected.symmetric_difference_update(items[number] for number in numbers)
+        else:
+            query = choice[1:] if choice.startswith('/') else choice
+            results = LazyResults(index.search(query))
+            page = 0
+
+@menu_decorator
+def list_clients():
+    config = load_config() if os.path.exists(CONF) else WgConfig()
+    if not config.peers:
+        print(f"{Colors.WARNING}Клиенты не найдены{Colors.ENDC}")
+        input("\nНажмите Enter для возврата в меню...")
+        return
+    pick_clients("Список клиентов", config, 'browse')
+
+@menu_decorator
+def delete_client():
+    config = load_config() if os.path.exists(CONF) else WgConfig()
+    
+    try:
+        peers = pick_clients("Удаление клиентов: отметьте номера и нажмите Enter", config, 'multi')
+        if not peers:
+            return
+        selectors = [peer.public_key or peer.name for peer in peers]
+        
+        if len(peers) == 1:
+            question = f"Вы действительно хотите удалить клиента {peers[0].name} ({peers[0].ip})? (д/н): "
+        else:
+            question = f"Вы действительно хотите удалить клиентов: {len(peers)}? (д/н): "
+        confirm = input(question).lower()
+        if confirm != 'д' and confirm != 'y' and confirm != 'да' and confirm != 'yes':
+            print(f"{Colors.WARNING}Отменено пользователем{Colors.ENDC}")
+            input("\nНажмите Enter для возврата в меню...")
+            return
+        
+        print(f"\n{Colors.CYAN}Пробуем динамически удалить пиров...{Colors.ENDC}")
+        removed, applied, message = revoke_clients(selectors, config)
+        
+        if applied:
+            print(f"{Colors.GREEN}Пиры динамически удалены!{Colors.ENDC}")
+        else:
+            print(f"{Colors.WARNING}Не удалось динамически удалить пиров: {message}{Colors.ENDC}")
+            print(f"{Colors.WARNING}Изменения будут применены при следующем перезапуске WireGuard.{Colors.ENDC}")
+        
+        if len(removed) == 1:
+            print(f"\n{Colors.GREEN}Клиент {Colors.BOLD}{removed[0].name}{Colors.ENDC}{Colors.GREEN} успешно удален{Colors.ENDC}")
+        else:
+            print(f"\n{Colors.GREEN}Удалено клиентов: {Colors.BOLD}{len(removed)}{Colors.ENDC}")
+        
+    except Exception as e:
+        print(f"{Colors.FAIL}Произошла ошибка: {str(e)}{Colors.ENDC}")
+    
+    input("\nНажмите Enter для возврата в меню...")
+
+# Ключи и конфиг клиента из хранилища
+def read_client_keys(client_name):
+    store = get_client_store()
+    record = store.get(client_name)
+    if record is None:
+        raise ValueError(f"Клиент {client_name} не найден в {store.location()}")
+    config = render_client(record)
+    
+    values = {}
+    for key in ('PublicKey', 'Address'):
+        match = re.search(rf'{key}\s*=\s*(\S+)', config)
+        values[key] = match.group(1) if match else None
+    
+    return {
+        'name': client_name,
+        'address': values['Address'],
+        'private_key': record.private_key,
+        'public_key': record.public_key,
+        'server_public_key': values['PublicKey'],
+        'preshared_key': record.preshared_key,
+        'interface': record.interface,
+        'created': record.created,
+        'labels': record.labels,
+        'profile': record.profile,
+        'config': config,
+    }
+
+@menu_decorator
+def show_client_keys():
+    try:
+        peers = pick_clients("Просмотр ключей клиента: введите номер", mode='single')
+        if not peers:
+            return
+        
+        client_name = peers[0].name
+        if not client_name:
+            print(f"{Colors.FAIL}У клиента нет имени (# Client:), его конфиг не хранится{Colors.ENDC}")
+            input("\nНажмите Enter для возврата в меню...")
+            return
+        
+        keys = read_client_keys(client_name)
+        private_key = keys['private_key'] or "Не найден"
+        psk = keys['preshared_key'] or "Не найден"
+        server_pub = keys['server_public_key'] or "Не найден"
+        client_pub = keys['public_key'] or "Не удалось получить"
+        config = keys['config']
+        
+        clear_screen()
+        print_header()
+        print(f"{Colors.BOLD}Ключи клиента {client_name}:{Colors.ENDC}\n")
+        print(f"{Colors.CYAN}Приватный ключ клиента: {Colors.BOLD}{private_key}{Colors.ENDC}")
+        print(f"{Colors.CYAN}Публичный ключ клиента: {Colors.BOLD}{client_pub}{Colors.ENDC}")
+        print(f"{Colors.CYAN}Публичный ключ сервера: {Colors.BOLD}{server_pub}{Colors.ENDC}")
+        print(f"{Colors.CYAN}PSK: {Colors.BOLD}{psk}{Colors.ENDC}")
+        
+        print(f"\n{Colors.BOLD}Полная конфигурация:{Colors.ENDC}\n")
+        print(f"{Colors.CYAN}{config}{Colors.ENDC}")
+        
+        show_qr = input("\nПоказать QR-код для мобильного приложения? (д/н): ").lower()
+        if show_qr == 'д' or show_qr == 'y' or show_qr == 'да' or show_qr == 'yes':
+            print()
+            print(render_qr(config, 'text', get_qr_cache_dir()).decode())
+        
+    except Exception as e:
+        print(f"{Colors.FAIL}Произошла ошибка: {str(e)}{Colors.ENDC}")
+    
+    input("\nНажмите Enter для возврата в меню...")
+
+# QR-коды без внешних зависимостей: байтовый режим, версии 1-40, выбор маски по
+# штрафным правилам стандарта. Используется для выдачи конфигов на телефоны.
+_QR_ECC_CODEWORDS = {
+    'L': (7, 10, 15, 20, 26, 18, 20, 24, 30, 18, 20, 24, 26, 30, 22, 24, 28, 30, 28, 28,
+          28, 28, 30, 30, 26, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    'M': (10, 16, 26, 18, 24, 16, 18, 22, 22, 26, 30, 22, 22, 24, 24, 28, 28, 26, 26, 26,
+          26, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28),
+    'Q': (13, 22, 18, 26, 18, 24, 18, 22, 20, 24, 28, 26, 24, 20, 30, 24, 28, 28, 26, 30,
+          28, 30, 30, 30, 30, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    'H': (17, 28, 22, 16, 22, 28, 26, 26, 24, 28, 24, 28, 22, 24, 24, 30, 28, 28, 26, 28,
+          30, 24, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+}
+_QR_ECC_BLOCKS = {
+    'L': (1, 1, 1, 1, 1, 2, 2, 2, 2, 4, 4, 4, 4, 4, 6, 6, 6, 6, 7, 8,
+          8, 9, 9, 10, 12, 12, 12, 13, 14, 15, 16, 17, 18, 19, 19, 20, 21, 22, 24, 25),
+    'M': (1, 1, 1, 2, 2, 4, 4, 4, 5, 5, 5, 8, 9, 9, 10, 10, 11, 13, 14, 16,
+          17, 17, 18, 20, 21, 23, 25, 26, 28, 29, 31, 33, 35, 37, 38, 40, 43, 45, 47, 49),
+    'Q': (1, 1, 2, 2, 4, 4, 6, 6, 8, 8, 8, 10, 12, 16, 12, 17, 16, 18, 21, 20,
+          23, 23, 25, 27, 29, 34, 34, 35, 38, 40, 43, 45, 48, 51, 53, 56, 59, 62, 65, 68),
+    'H': (1, 1, 2, 4, 4, 4, 5, 6, 8, 8, 11, 11, 16, 16, 18, 16, 19, 21, 25, 25,
+          25, 34, 30, 32, 35, 37, 40, 42, 45, 48, 51, 54, 57, 60, 63, 66, 70, 74, 77, 81),
+}
+_QR_FORMAT_BITS = {'L': 1, 'M': 0, 'Q': 3, 'H': 2}
+_QR_MASKS = (
+    lambda x, y: (x + y) % 2 == 0,
+    lambda x, y: y % 2 == 0,
+    lambda x, y: x % 3 == 0,
+    lambda x, y: (x + y) % 3 == 0,
+    lambda x, y: (x // 3 + y // 2) % 2 == 0,
+    lambda x, y: x * y % 2 + x * y % 3 == 0,
+    lambda x, y: (x * y % 2 + x * y % 3) % 2 == 0,
+    lambda x, y: ((x + y) % 2 + x * y % 3) % 2 == 0,
+)
+_QR_FINDER_LIKE = re.compile(r'(?=10111010000|00001011101)')
+_QR_RUNS = re.compile(r'0{5,}|1{5,}')
+_qr_mask_cells = {}
+
+# Таблицы логарифмов поля GF(256) с порождающим многочленом 0x11D
+_GF_EXP = [0] * 512
+_GF_LOG = [0] * 256
+_value = 1
+for _i in range(255):
+    _GF_EXP[_i] = _value
+    _GF_LOG[_value] = _i
+    _value <<= 1
+    if _value & 0x100:
+        _value ^= 0x11D
+for _i in range(255, 512):
+    _GF_EXP[_i] = _GF_EXP[_i - 255]
+del _value, _i
+
+def _gf_mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return _GF_EXP[_GF_LOG[a] + _GF_LOG[b]]
+
+def _rs_divisor(degree):
+    result = [0] * (degree - 1) + [1]
+    root = 1
+    for _ in range(degree):
+        for j in range(degree):
+            result[j] = _gf_mul(result[j], root)
+            if j + 1 < degree:
+                result[j] ^= result[j + 1]
+        root = _gf_mul(root, 0x02)
+    return result
+
+def _rs_remainder(data, divisor):
+    result = [0] * len(divisor)
+    for byte in data:
+        factor = byte ^ result.pop(0)
+        result.append(0)
+        if factor:
+            log_factor = _GF_LOG[factor]
+            for i, coef in enumerate(divisor):
+                if coef:
+                    result[i] ^= _GF_EXP[_GF_LOG[coef] + log_factor]
+    return result
+
+def _qr_raw_modules(version):
+    result = (16 * version + 128) * version + 64
+    if version >= 2:
+        count = version // 7 + 2
+        result -= (25 * count - 10) * count - 55
+        if version >= 7:
+            result -= 36
+    return result
+
+def _qr_data_codewords(version, ecl):
+    return _qr_raw_modules(version) // 8 - _QR_ECC_CODEWORDS[ecl][version - 1] * _QR_ECC_BLOCKS[ecl][version - 1]
+
+def _qr_alignment_positions(version, size):
+    if version == 1:
+        return []
+    count = version // 7 + 2
+    step = (version * 8 + count * 3 + 5) // (count * 4 - 4) * 2
+    return [6] + [size - 7 - i * step for i in range(count - 2, -1, -1)]
+
+# Данные с кодами коррекции, разбитые на блоки и перемешанные
+def _qr_codewords(data, version, ecl):
+    capacity = _qr_data_codewords(version, ecl)
+    count_bits = 8 if version <= 9 else 16
+    bits = [0, 1, 0, 0] + [(len(data) >> i) & 1 for i in range(count_bits - 1, -1, -1)]
+    for byte in data:
+        bits.extend((byte >> i) & 1 for i in range(7, -1, -1))
+    bits.extend([0] * min(4, capacity * 8 - len(bits)))
+    bits.extend([0] * (-len(bits) % 8))
+    codewords = [int(''.join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8)]
+    for pad in (0xEC, 0x11) * capacity:
+        if len(codewords) >= capacity:
+            break
+        codewords.append(pad)
+    
+    blocks_count = _QR_ECC_BLOCKS[ecl][version - 1]
+    ecc_len = _QR_ECC_CODEWORDS[ecl][version - 1]
+    raw_codewords = _qr_raw_modules(version) // 8
+    short_blocks = blocks_count - raw_codewords % blocks_count
+    short_len = raw_codewords // blocks_count
+    divisor = _rs_divisor(ecc_len)
+    blocks = []
+    offset = 0
+    for i in range(blocks_count):
+        length = short_len - ecc_len + (0 if i < short_blocks else 1)
+        block = codewords[offset:offset + length]
+        offset += length
+        ecc = _rs_remainder(block, divisor)
+        if i < short_blocks:
+            block.append(None)
+        blocks.append(block + ecc)
+    return [block[i] for i in range(len(blocks[0])) for block in blocks if block[i] is not None]
+
+def _qr_penalty(modules):
+    size = len(modules)
+    rows = [''.join('1' if cell else '0' for cell in row) for row in modules]
+    columns = [''.join(column) for column in zip(*rows)]
+    score = 0
+    for line in rows + columns:
+        for run in _QR_RUNS.finditer(line):
+            score += len(run.group()) - 2
+        score += 40 * len(_QR_FINDER_LIKE.findall(line))
+    # Блоки 2x2 одного цвета: строки как целые числа, сравнение соседей сдвигом
+    values = [int(row, 2) for row in rows]
+    full = (1 << size) - 1
+    inner = (1 << (size - 1)) - 1
+    for upper, lower in zip(values, values[1:]):
+        vertical = ~(upper ^ lower) & full
+        score += 3 * bin(vertical & (vertical >> 1) & ~(upper ^ (upper >> 1)) & inner).count('1')
+    dark = sum(row.count('1') for row in rows)
+    total = size * size
+    score += ((abs(dark * 20 - total * 10) + total - 1) // total - 1) * 10
+    return score
+
+# Матрица QR-кода (список строк из True/False, True - тёмный модуль)
+def qr_encode(data, ecl='M', mask=None):
+    if isinstance(data, str):
+        data = data.encode()
+    for version in range(1, 41):
+        count_bits = 8 if version <= 9 else 16
+        if 4 + count_bits + len(data) * 8 <= _qr_data_codewords(version, ecl) * 8:
+            break
+    else:
+        raise ValueError("Данные слишком велики для QR-кода")
+    
+    size = version * 4 + 17
+    modules = [[False] * size for _ in range(size)]
+    function = [[False] * size for _ in range(size)]
+    
+    def set_function(x, y, dark):
+        modules[y][x] = dark
+        function[y][x] = True
+    
+    for i in range(size):
+        set_function(6, i, i % 2 == 0)
+        set_function(i, 6, i % 2 == 0)
+    for cx, cy in ((3, 3), (size - 4, 3), (3, size - 4)):
+        for dy in range(-4, 5):
+            for dx in range(-4, 5):
+                x, y = cx + dx, cy + dy
+                if 0 <= x < size and 0 <= y < size:
+                    set_function(x, y, max(abs(dx), abs(dy)) not in (2, 4))
+    positions = _qr_alignment_positions(version, size)
+    last = len(positions) - 1
+    for i, cx in enumerate(positions):
+        for j, cy in enumerate(positions):
+            if (i, j) in ((0, 0), (0, last), (last, 0)):
+                continue
+            for dy in range(-2, 3):
+                for dx in range(-2, 3):
+                    set_function(cx + dx, cy + dy, max(abs(dx), abs(dy)) != 1)
+    
+    def draw_format(mask_index):
+        value = _QR_FORMAT_BITS[ecl] << 3 | mask_index
+        remainder = value
+        for _ in range(10):
+            remainder = (remainder << 1) ^ ((remainder >> 9) * 0x537)
+        bits = (value << 10 | remainder) ^ 0x5412
+        bit = lambda i: (bits >> i) & 1 != 0
+        for i in range(6):
+            set_function(8, i, bit(i))
+        set_function(8, 7, bit(6))
+        set_function(8, 8, bit(7))
+        set_function(7, 8, bit(8))
+        for i in range(9, 15):
+            set_function(14 - i, 8, bit(i))
+        for i in range(8):
+            set_function(size - 1 - i, 8, bit(i))
+        for i in range(8, 15):
+            set_function(8, size - 15 + i, bit(i))
+        set_function(8, size - 8, True)
+    
+    # Резервируем области формата до размещения данных
+    draw_format(0)
+    if version >= 7:
+        remainder = version
+        for _ in range(12):
+            remainder = (remainder << 1) ^ ((remainder >> 11) * 0x1F25)
+        bits = version << 12 | remainder
+        for i in range(18):
+            dark = (bits >> i) & 1 != 0
+            a, b = size - 11 + i % 3, i // 3
+            set_function(a, b, dark)
+            set_function(b, a, dark)
+    
+    codewords = _qr_codewords(data, version, ecl)
+    total_bits = len(codewords) * 8
+    index = 0
+    right = size - 1
+    while right >= 1:
+        if right == 6:
+            right = 5
+        upward = (right + 1) & 2 == 0
+        for vert in range(size):
+            y = size - 1 - vert if upward else vert
+            for x in (right, right - 1):
+                if not function[y][x] and index < total_bits:
+                    modules[y][x] = (codewords[index >> 3] >> (7 - (index & 7))) & 1 != 0
+                    index += 1
+        right -= 2
+    
+    # Модули под каждой маской зависят только от версии - кэшируем их
+    if version not in _qr_mask_cells:
+        cells = [(x, y) for y in range(size) for x in range(size) if not function[y][x]]
+        _qr_mask_cells[version] = [[(x, y) for x, y in cells if test(x, y)] for test in _QR_MASKS]
+    def apply_mask(mask_index):
+        for x, y in _qr_mask_cells[version][mask_index]:
+            modules[y][x] = not modules[y][x]
+    
+    if mask is None:
+        best_score = None
+        for mask_index in range(8):
+            apply_mask(mask_index)
+            draw_format(mask_index)
+            score = _qr_penalty(modules)
+            if best_score is None or score < best_score:
+                mask, best_score = mask_index, score
+            apply_mask(mask_index)
+    apply_mask(mask)
+    draw_format(mask)
+    return modules
+
+# PNG в оттенках серого с глубиной 1 бит: белое поле вокруг кода и масштаб модуля
+def qr_to_png(modules, scale=8, border=4):
+    size = (len(modules) + border * 2) * scale
+    rows = []
+    for row in [[False] * len(modules)] * border + modules + [[False] * len(modules)] * border:
+        pixels = ''.join(('0' if dark else '1') * scale for dark in [False] * border + row + [False] * border)
+        pixels += '1' * (-len(pixels) % 8)
+        line = b'\x00' + int(pixels, 2).to_bytes(len(pixels) // 8, 'big')
+        rows.extend([line] * scale)
+    
+    def chunk(kind, payload):
+        return struct.pack('>I', len(payload)) + kind + payload + struct.pack('>I', zlib.crc32(kind + payload) & 0xffffffff)
+    
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 1, 0, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(b''.join(rows), 9))
+            + chunk(b'IEND', b''))
+
+# Текстовый QR-код для терминала: две строки модулей на символ, светлые модули -
+# закрашенные, чтобы код читался на тёмном фоне
+def qr_to_text(modules, border=2):
+    width = len(modules) + border * 2
+    padded = [[False] * width] * border + [[False] * border + row + [False] * border for row in modules] + [[False] * width] * (border + 1)
+    lines = []
+    for y in range(0, len(padded) - 1, 2):
+        top, bottom = padded[y], padded[y + 1]
+        lines.append(''.join(
+            ' ' if upper and lower else '▄' if upper else '▀' if lower else '█'
+            for upper, lower in zip(top, bottom)))
+    return '\n'.join(lines) + '\n'
+
+# Экспорт конфигов клиентов в tar.gz или zip. Архив пишется потоково, конфиги
+# читаются и QR-коды строятся порциями в пуле процессов - в памяти держится лишь
+# окно из нескольких порций. Готовые QR-коды кэшируются по хэшу конфига.
+EXPORT_BATCH = 16
+QR_CACHE_DIR = ".qr-cache"
+
+def get_qr_cache_dir(keys_dir=None):
+    return os.path.join(keys_dir or KEYS_DIR, QR_CACHE_DIR)
+
+# QR-код конфига в формате png или text с использованием кэша
+def render_qr(content, qr_format='png', cache_dir=None):
+    if isinstance(content, str):
+        content = content.encode()
+    extension = 'png' if qr_format == 'png' else 'txt'
+    cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, f"{hashlib.sha256(content).hexdigest()}.{extension}")
+        try:
+            with open(cache_path, 'rb') as f:
+                return f.read()
+        except OSError:
+            pass
+    modules = qr_encode(content)
+    data = qr_to_png(modules) if qr_format == 'png' else qr_to_text(modules).encode()
+    if cache_path:
+        try:
+            os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+            write_file_atomic(cache_path, data, mode=0o600)
+        except OSError:
+            pass
+    return data
+
+# Порция экспорта: файлы архива для каждого клиента. Выполняется в пуле процессов,
+# поэтому конфиги и путь к кэшу передаются явно.
+def _export_batch(batch):
+    results = []
+    for name, content, qr_format, cache_dir in batch:
+        if content is None:
+            results.append((name, None))
+            continue
+        members = [(f"{name}.conf", content)]
+        if qr_format:
+            extension = 'png' if qr_format == 'png' else 'txt'
+            members.append((f"{name}.{extension}", render_qr(content, qr_format, cache_dir)))
+        results.append((name, members))
+    return results
+
+# Выполнение порций с ограниченным числом задач в очереди, результаты - по порядку
+def _map_batches(func, batches, workers):
+    if workers <= 1:
+        for batch in batches:
+            yield func(batch)
+        return
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for batch in batches:
+            pending.append(executor.submit(func, batch))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+@contextlib.contextmanager
+def open_archive(output, archive_format):
+    if output == '-':
+        stream = sys.stdout.buffer
+    else:
+        # В архиве приватные ключи - создаём его доступным только владельцу
+        stream = os.fdopen(os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb')
+    now = time.time()
+    try:
+        if archive_format == 'zip':
+            import zipfile
+            with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+                def add(name, data):
+                    info = zipfile.ZipInfo(name, time.localtime(now)[:6])
+                    info.external_attr = 0o600 << 16
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    archive.writestr(info, data)
+                yield add
+        else:
+            import tarfile
+            with tarfile.open(fileobj=stream, mode='w|gz') as archive:
+                def add(name, data):
+                    info = tarfile.TarInfo(name)
+                    info.size = len(data)
+                    info.mode = 0o600
+                    info.mtime = now
+                    archive.addfile(info, io.BytesIO(data))
+                yield add
+    finally:
+        if stream is not sys.stdout.buffer:
+            stream.close()
+
+# Экспорт выбранных (или всех) клиентов. Возвращает число клиентов в архиве
+# и имена клиентов, которых нет в хранилище.
+def export_clients(output, selectors=None, qr_format=None, workers=None, archive_format=None):
+    # Клиенты всех шардов лежат в одном хранилище, архив тоже один
+    peers = []
+    for shard in get_shards():
+        with use_shard(shard):
+            config = load_config()
+        peers.extend(select_peers(config, selectors) if selectors else config.peers)
+    archive_format = archive_format or ('zip' if output.lower().endswith('.zip') else 'tar')
+    cache_dir = get_qr_cache_dir() if qr_format else None
+    if workers is None:
+        # Без QR-кодов экспорт упирается в чтение конфигов, пул процессов не нужен
+        workers = (os.cpu_count() or 1) if qr_format else 1
+    workers = min(workers, max(1, len(peers) // EXPORT_BATCH))
+    
+    store = get_client_store()
+    
+    def batches():
+        batch = []
+        for peer in peers:
+            if peer.name:
+                content = store.config_text(peer.name)
+                batch.append((peer.name, content.encode() if content is not None else None, qr_format, cache_dir))
+                if len(batch) >= EXPORT_BATCH:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+    
+    exported = 0
+    missing = []
+    with open_archive(output, archive_format) as add:
+        for results in _map_batches(_export_batch, batches(), workers):
+            for name, members in results:
+                if members is None:
+                    missing.append(name)
+                    continue
+                for member_name, data in members:
+                    add(member_name, data)
+                exported += 1
+    return exported, missing
+
+@menu_decorator
+def export_configs():
+    print(f"{Colors.BOLD}Экспорт конфигов клиентов{Colors.ENDC}\n")
+    
+    output = input("Введите путь к архиву (.tar.gz или .zip): ").strip()
+    if not output:
+        return
+    
+    try:
+        selectors = input("Клиенты для экспорта: имена, IP или шаблоны (Enter - все): ").replace(',', ' ').split()
+        qr_choice = input("Добавить QR-коды? (1 - PNG, 2 - текст, Enter - без QR): ").strip()
+        qr_format = {'1': 'png', '2': 'text'}.get(qr_choice)
+        
+        print(f"\n{Colors.CYAN}Экспортируем конфиги...{Colors.ENDC}")
+        started = time.time()
+        exported, missing = export_clients(output, selectors, qr_format)
+        
+        print(f"{Colors.GREEN}Экспортировано клиентов: {Colors.BOLD}{exported}{Colors.ENDC}{Colors.GREEN} за {time.time() - started:.2f} с в {Colors.BOLD}{output}{Colors.ENDC}")
+        if missing:
+            print(f"{Colors.WARNING}Не найдены конфиги в {get_client_store().location()}: {', '.join(missing[:10])}{' ...' if len(missing) > 10 else ''}{Colors.ENDC}")
+        
+    except Exception as e:
+        print(f"{Colors.FAIL}Произошла ошибка: {str(e)}{Colors.ENDC}")
+    
+    input("\nНажмите Enter для возврата в меню...")
+
+# Проверки серверного конфига: список (уровень, сообщение), уровень - ok, warning или error
+def check_config():
+    checks = []
+    
+    # Проверка существования файла конфигурации
+    if not os.path.exists(CONF):
+        return [('error', f"Ошибка: Конфигурационный файл {CONF} не найден!")]
+    
+    # Проверка формата файла конфигурации
+    try:
+        config = load_config()
+        
+        # Проверка ключевых секций
+        if not config.has_interface:
+            checks.append(('error', "Ошибка: В конфигурации отсутствует секция [Interface]"))
+        else:
+            checks.append(('ok', "✓ Секция [Interface] найдена"))
+        
+        # Проверка наличия приватного ключа
+        if not config.interface_value('PrivateKey'):
+            checks.append(('error', "Ошибка: Не найден приватный ключ в секции Interface"))
+        else:
+            checks.append(('ok', "✓ Приватный ключ сервера найден"))
+        
+        # Проверка Listen порта
+        port = config.interface_value('ListenPort')
+        if not port:
+            checks.append(('warning', "Предупреждение: Не найден порт прослушивания (ListenPort)"))
+        else:
+            checks.append(('ok', f"✓ Сервер слушает порт {port}"))
+            
+            # Проверка соответствия порта в Endpoint
+            endpoint_port = ENDPOINT.split(':')[-1]
+            if endpoint_port != port:
+                checks.append(('warning', f"Предупреждение: Порт в Endpoint ({endpoint_port}) не соответствует ListenPort ({port})"))
+        
+        # Проверка клиентских подключений
+        peers = config.peers
+        if not peers:
+            checks.append(('warning', "Предупреждение: В конфигурации нет секций [Peer] (клиентов)"))
+        else:
+            checks.append(('ok', f"✓ Найдено {len(peers)} клиентов в конфигурации"))
+            checks.extend(format_validation(validate_config(config)))
+    
+    except Exception as e:
+        checks.append(('error', f"Ошибка при анализе конфигурации: {str(e)}"))
+    
+    return checks
+
+# Проверка доступности порта эндпоинта
+def check_endpoint():
+    endpoint_parts = ENDPOINT.split(':')
+    if len(endpoint_parts) != 2:
+        return []
+    host, port = endpoint_parts
+    
+    # В Windows нельзя просто использовать nc, поэтому используем Python
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(3)
+        sock.connect((host, int(port)))
+        sock.close()
+        return [('ok', f"✓ Порт {port} доступен")]
+    except Exception:
+        return [('error', f"✗ Порт {port} недоступен или заблокирован"),
+                ('warning', "Возможно, блокировка брандмауэром или неверный IP/порт")]
+
+# Проверка серверного конфига за один проход: ключи, пересечения AllowedIPs,
+# адреса вне подсети и соответствие клиентов хранилищу в KEYS_DIR. Результат -
+# сводка по типам проблем с несколькими примерами, а не строка на каждую.
+# Проверки отдельных пиров для больших конфигов идут в пуле процессов.
+VALIDATE_PARALLEL_PEERS = 20000
+VALIDATE_CHUNK = 5000
+VALIDATE_EXAMPLES = 5
+
+# Код проблемы: (уровень, описание)
+VALIDATION_ISSUES = {
+    'missing_public_key': ('error', "нет публичного ключа"),
+    'invalid_public_key': ('error', "некорректный публичный ключ"),
+    'invalid_preshared_key': ('error', "некорректный PresharedKey"),
+    'duplicate_public_key': ('error', "повторяющийся публичный ключ"),
+    'missing_allowed_ips': ('error', "нет разрешенных IP (AllowedIPs)"),
+    'invalid_allowed_ip': ('error', "некорректная запись AllowedIPs"),
+    'duplicate_allowed_ip': ('error', "повторяющаяся запись AllowedIPs"),
+    'overlapping_allowed_ips': ('error', "пересекающиеся AllowedIPs"),
+    'outside_subnet': ('warning', "адрес вне подсети сервера"),
+    'duplicate_name': ('warning', "повторяющееся имя клиента"),
+    'unknown_profile': ('warning', "профиль клиента не описан в PROFILES"),
+    'missing_client_file': ('warning', "нет конфига клиента в хранилище KEYS_DIR"),
+    'orphan_client_file': ('warning', "конфиг в хранилище без клиента в wg0.conf"),
+}
+
+# Каноническая запись 32-байтного ключа в base64, как её выдаёт wg:
+# у последнего значащего символа два младших бита нулевые
+_KEY_RE = re.compile(r'[A-Za-z0-9+/]{42}[AEIMQUYcgkosw048]=')
+
+def _validate_peers(batch):
+    networks, rows = batch
+    networks = [ipaddress.ip_network(network) for network in networks]
+    bounds = [(network.version, int(network.network_address), int(network.broadcast_address)) for network in networks]
+    issues = []
+    intervals = []
+    valid_key = _KEY_RE.fullmatch
+    for index, label, public_key, preshared_key, allowed_ips in rows:
+        if not public_key:
+            issues.append(('missing_public_key', label, None))
+        elif not valid_key(public_key):
+            issues.append(('invalid_public_key', label, public_key))
+        if preshared_key and not valid_key(preshared_key):
+            issues.append(('invalid_preshared_key', label, None))
+        if not allowed_ips:
+            issues.append(('missing_allowed_ips', label, None))
+        for entry in allowed_ips:
+            try:
+                # Быстрый путь для маршрутов хоста, как в IPAllocator.from_config
+                if entry.endswith('/32'):
+                    version, start = 4, int.from_bytes(socket.inet_pton(socket.AF_INET, entry[:-3]), 'big')
+                    end = start
+                else:
+                    network = ipaddress.ip_network(entry, strict=False)
+                    version, start, end = network.version, int(network.network_address), int(network.broadcast_address)
+            except (OSError, ValueError):
+                issues.append(('invalid_allowed_ip', label, entry))
+                continue
+            intervals.append((version, start, end, index))
+            if not any(family == version and low <= start and end <= high for family, low, high in bounds):
+                issues.append(('outside_subnet', label, entry))
+    return issues, intervals
+
+def _peer_label(peer, index):
+    return peer.name or f"#{index + 1}"
+
+def validate_config(config=None, workers=None):
+    started = time.perf_counter()
+    config = config or load_config()
+    peers = config.peers
+    networks = {get_subnet()}
+    for entry in config.addresses:
+        try:
+            networks.add(ipaddress.ip_interface(entry).network)
+        except ValueError:
+            continue
+    networks = [str(network) for network in networks]
+    
+    if workers is None:
+        workers = (os.cpu_count() or 1) if len(peers) >= VALIDATE_PARALLEL_PEERS else 1
+    workers = max(1, min(workers, len(peers) // VALIDATE_CHUNK))
+    
+    found = collections.defaultdict(list)
+    def add(code, label, value=None):
+        found[code].append({'peer': label, 'value': value} if value is not None else {'peer': label})
+    
+    def batches():
+        for offset in range(0, len(peers), VALIDATE_CHUNK):
+            chunk = peers[offset:offset + VALIDATE_CHUNK]
+            yield networks, [(offset + i, _peer_label(peer, offset + i), peer.public_key, peer.preshared_key, peer.allowed_ips)
+                             for i, peer in enumerate(chunk)]
+    
+    intervals = []
+    for issues, chunk_intervals in _map_batches(_validate_peers, batches(), workers):
+        for code, label, value in issues:
+            add(code, label, value)
+        intervals.extend(chunk_intervals)
+    
+    # Повторы ключей и имён - через множества
+    seen_keys = set()
+    seen_names = set()
+    for index, peer in enumerate(peers):
+        if peer.public_key:
+            if peer.public_key in seen_keys:
+                add('duplicate_public_key', _peer_label(peer, index), peer.public_key)
+            seen_keys.add(peer.public_key)
+        if peer.name:
+            if peer.name in seen_names:
+                add('duplicate_name', peer.name)
+            seen_names.add(peer.name)
+        if peer.profile and peer.profile not in PROFILES:
+            add('unknown_profile', _peer_label(peer, index), peer.profile)
+    
+    # Пересечения AllowedIPs: сортировка по началу диапазона и один проход
+    # с запоминанием диапазона, дальше всех уходящего вправо
+    intervals.sort(key=lambda item: (item[0], item[1], -item[2]))
+    cover_version, cover_end, cover_index = None, -1, None
+    previous = None
+    for version, start, end, index in intervals:
+        if previous and previous[:3] == (version, start, end):
+            code, other = 'duplicate_allowed_ip', previous[3]
+        elif version == cover_version and start <= cover_end:
+            code, other = 'overlapping_allowed_ips', cover_index
+        else:
+            code = None
+        if code:
+            add(code, _peer_label(peers[index], index), f"{ipaddress.ip_address(start)} ~ {_peer_label(peers[other], other)}")
+        if version != cover_version or end > cover_end:
+            cover_version, cover_end, cover_index = version, end, index
+        previous = (version, start, end, index)
+    
+    # Сверка клиентов с хранилищем в обе стороны
+    store = get_client_store()
+    files = set(store.names())
+    for name in sorted(seen_names - files):
+        add('missing_client_file', name)
+    # Клиенты других шардов лежат в том же хранилище
+    clients = set(seen_names)
+    if is_sharded():
+        clients.update(peer.name for _, peer in list_sharded() if peer.name)
+    for name in sorted(files - clients):
+        add('orphan_client_file', name, store.location(name))
+    
+    issues = {}
+    for code, (level, description) in VALIDATION_ISSUES.items():
+        if found.get(code):
+            issues[code] = {'level': level, 'description': description, 'count': len(found[code]),
+                            'examples': found[code][:VALIDATE_EXAMPLES]}
+    return {
+        'peers': len(peers),
+        'unnamed_peers': sum(1 for peer in peers if not peer.name),
+        'client_files': len(files),
+        'errors': sum(issue['count'] for issue in issues.values() if issue['level'] == 'error'),
+        'warnings': sum(issue['count'] for issue in issues.values() if issue['level'] == 'warning'),
+        'issues': issues,
+        'workers': workers,
+        'elapsed': round(time.perf_counter() - started, 3),
+    }
+
+# Строки сводки для вывода пользователю: одна на тип проблемы
+def format_validation(report):
+    lines = []
+    for code, issue in report['issues'].items():
+        examples = ", ".join(example['peer'] if 'value' not in example else f"{example['peer']} ({example['value']})"
+                             for example in issue['examples'])
+        more = f" и ещё {issue['count'] - len(issue['examples'])}" if issue['count'] > len(issue['examples']) else ""
+        prefix = "Ошибка" if issue['level'] == 'error' else "Предупреждение"
+        lines.append((issue['level'], f"{prefix}: {issue['description']} - {issue['count']}: {examples}{more}"))
+    if not lines:
+        lines.append(('ok', f"✓ Проверено {report['peers']} клиентов: проблем не найдено"))
+    return lines
+
+CHECK_COLORS = {'ok': Colors.GREEN, 'warning': Colors.WARNING, 'error': Colors.FAIL}
+
+@menu_decorator
+def diagnose_connection():
+    print(f"{Colors.BOLD}Диагностика проблем с подключением{Colors.ENDC}\n")
+    
+    checks = check_config()
+    for level, message in checks:
+        print(f"{CHECK_COLORS[level]}{message}{Colors.ENDC}")
+    if not os.path.exists(CONF):
+        input("\nНажмите Enter для возврата в меню...")
+        return
+    
+    print(f"\n{Colors.BOLD}Проверка сетевых настроек:{Colors.ENDC}")
+    
+    # Проверка доступности порта
+    endpoint_parts = ENDPOINT.split(':')
+    if len(endpoint_parts) == 2:
+        host, port = endpoint_parts
+        print(f"\n{Colors.CYAN}Проверка доступности порта {port} на {host}...{Colors.ENDC}")
+        for level, message in check_endpoint():
+            print(f"{CHECK_COLORS[level]}{message}{Colors.ENDC}")
+    
+    print(f"\n{Colors.BOLD}Советы по устранению ошибок:{Colors.ENDC}")
+    print(f"1. {Colors.CYAN}Проверьте, что публичный ключ сервера правильно указан в конфиге клиента{Colors.ENDC}")
+    print(f"2. {Colors.CYAN}Убедитесь, что порт UDP открыт на сервере (проверьте брандмауэр){Colors.ENDC}")
+    print(f"3. {Colors.CYAN}Проверьте, что IP-адреса в AllowedIPs не конфликтуют{Colors.ENDC}")
+    print(f"4. {Colors.CYAN}Проверьте работу DNS и маршрутизацию{Colors.ENDC}")
+    print(f"5. {Colors.CYAN}Перезапустите службу WireGuard на сервере:{Colors.ENDC}")
+    print(f"   {Colors.GREEN}sudo systemctl restart wg-quick@wg0{Colors.ENDC}")
+    print(f"6. {Colors.CYAN}Проверьте статус соединения на сервере:{Colors.ENDC}")
+    print(f"   {Colors.GREEN}sudo wg{Colors.ENDC}")
+    
+    input("\nНажмите Enter для возврата в меню...")
+
+# Пир считается подключённым, если рукопожатие было не позже этого числа секунд назад
+ONLINE_HANDSHAKE_AGE = 180
+
+# Состояние пиров: данные wg show dump, соединённые с конфигом по публичному ключу.
+# previous - результат прошлого вызова, по нему считаются скорости rx/tx.
+def get_peer_status(config, live, previous=None, now=None):
+    now = now or time.time()
+    previous_rows = {row['public_key']: row for row in previous['peers']} if previous else {}
+    interval = now - previous['time'] if previous else 0
+    by_pubkey = config.by_pubkey
+    rows = []
+    for pubkey, current in live.items():
+        peer = by_pubkey.get(pubkey)
+        handshake = current.latest_handshake
+        row = {
+            'name': peer.name if peer else None,
+            'ip': peer.ip if peer else (current.allowed_ips[0].split('/')[0] if current.allowed_ips else None),
+            'public_key': pubkey,
+            'endpoint': current.endpoint,
+            'latest_handshake': handshake,
+            'online': handshake > 0 and now - handshake <= ONLINE_HANDSHAKE_AGE,
+            'rx': current.rx,
+            'tx': current.tx,
+            'rx_rate': 0.0,
+            'tx_rate': 0.0,
+        }
+        before = previous_rows.get(pubkey)
+        if before and interval > 0:
+            # Уменьшение счётчика означает сброс (перезапуск интерфейса)
+            row['rx_rate'] = max(current.rx - before['rx'], 0) / interval
+            row['tx_rate'] = max(current.tx - before['tx'], 0) / interval
+        rows.append(row)
+    # Сначала подключённые, затем по давности рукопожатия
+    rows.sort(key=lambda row: (not row['online'], -row['latest_handshake'], row['name'] or ''))
+    return {'time': now, 'interface': get_interface_name(), 'peers': rows,
+            'online': sum(1 for row in rows if row['online']), 'total': len(rows)}
+
+def read_peer_status(previous=None, config=None):
+    config = config or load_config()
+    _, live = get_backend().dump()
+    return get_peer_status(config, live, previous)
+
+# Очистка неактивных клиентов по времени последнего рукопожатия из одного
+# wg show dump. Пиры, которых нет в выводе wg, не трогаются: их состояние
+# неизвестно. После перезапуска интерфейса рукопожатия обнуляются, поэтому
+# без --force отказываемся удалять больше REAP_MAX_SHARE клиентов за раз.
+REAP_MAX_SHARE = 0.5
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+# Длительность вида 90, 45m, 12h, 30d, 2w в секундах
+def parse_duration(value):
+    value = str(value).strip().lower()
+    unit = DURATION_UNITS.get(value[-1:]) if value else None
+    number = value[:-1] if unit else value
+    try:
+        seconds = float(number) * (unit or 1)
+    except ValueError:
+        raise ValueError(f"Некорректная длительность: {value!r}")
+    if seconds <= 0:
+        raise ValueError(f"Длительность должна быть положительной: {value!r}")
+    return seconds
+
+# Выбор неактивных пиров: (пир, время рукопожатия, причина). Никогда не
+# подключавшиеся выбираются, только если клиент создан раньше порога
+def find_stale_peers(config, live, idle, include_never=False, now=None):
+    now = now or time.time()
+    store = get_client_store()
+    stale = []
+    for peer in config.peers:
+        current = live.get(peer.public_key)
+        if current is None:
+            continue
+        handshake = current.latest_handshake
+        if handshake:
+            if now - handshake > idle:
+                stale.append((peer, handshake, 'idle'))
+        elif include_never:
+            # Без записи в хранилище (безымянные, импортированные без ключей) время
+            # создания неизвестно - такие пиры не удаляются
+            created = store.created(peer.name) if peer.name else None
+            if created is not None and now - created > idle:
+                stale.append((peer, 0, 'never'))
+    return stale
+
+def reap_stale_peers(idle, include_never=False, dry_run=False, limit=None, force=False):
+    now = time.time()
+    _, live = get_backend().dump()
+    plan = {}
+    
+    def select(config):
+        stale = find_stale_peers(config, live, idle, include_never, now)
+        # Защита проверяется до --limit: ограничение числа не должно её обходить
+        if stale and not force and len(stale) > len(config.peers) * REAP_MAX_SHARE:
+            raise ValueError(f"Под удаление попадают {len(stale)} из {len(config.peers)} клиентов; "
+                             f"если интерфейс недавно перезапускался, рукопожатия ещё не обновились. "
+                             f"Используйте --force, чтобы продолжить")
+        if limit is not None:
+            # Сначала самые давние
+            stale.sort(key=lambda item: item[1])
+            stale = stale[:limit]
+        plan.update((id(peer), (handshake, reason)) for peer, handshake, reason in stale)
+        return [peer for peer, _, _ in stale]
+    
+    if dry_run:
+        removed, applied, message = select(load_config()), True, ''
+    else:
+        removed, applied, message = revoke_peers(select)
+    rows = []
+    for peer in removed:
+        handshake, reason = plan[id(peer)]
+        rows.append({'name': peer.name, 'ip': peer.ip, 'public_key': peer.public_key, 'reason': reason,
+                     'latest_handshake': handshake, 'idle': int(now - handshake) if handshake else None})
+    return rows, applied, message
+
+# Несколько интерфейсов (шардов): у каждого свой конфиг, срез подсети и порт.
+# Функции выше работают с текущими CONF, SUBNET и ENDPOINT, поэтому операция
+# над шардом выполняется внутри use_shard(), который временно их подменяет.
+# Имена клиентов уникальны по всем шардам, конфиги клиентов лежат в общем KEYS_DIR.
+class Shard:
+    __slots__ = ('conf', 'subnet', 'endpoint')
+
+    def __init__(self, conf, subnet, endpoint):
+        self.conf = conf
+        self.subnet = subnet
+        self.endpoint = endpoint
+
+    @property
+    def interface(self):
+        return get_interface_name(self.conf)
+
+# Описание шардов из JSON: [{"conf": "./wg1.conf", "subnet": "10.8.1.0/24", "endpoint": "1.2.3.4:51821"}, ...]
+def load_shards(path):
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('shards', [])
+    return [(item['conf'], item['subnet'], item['endpoint']) for item in data]
+
+def get_shards():
+    if not SHARDS:
+        return [Shard(CONF, SUBNET, ENDPOINT)]
+    return [Shard(conf, subnet, endpoint) for conf, subnet, endpoint in SHARDS]
+
+def is_sharded():
+    return len(get_shards()) > 1
+
+@contextlib.contextmanager
+def use_shard(shard):
+    global CONF, SUBNET, ENDPOINT
+    saved = CONF, SUBNET, ENDPOINT
+    CONF, SUBNET, ENDPOINT = shard.conf, shard.subnet, shard.endpoint
+    try:
+        yield shard
+    finally:
+        CONF, SUBNET, ENDPOINT = saved
+
+def find_shard(interface):
+    for shard in get_shards():
+        if shard.interface == interface:
+            return shard
+    raise ValueError(f"Интерфейс {interface} не входит в список шардов")
+
+# Нагрузка шардов: число пиров или трафик подключённых сейчас пиров
+def shard_loads(shards, placement=None):
+    placement = placement or SHARD_PLACEMENT
+    if placement not in ('peers', 'traffic'):
+        raise ValueError(f"Неизвестный способ размещения: {placement}")
+    loads = []
+    now = time.time()
+    for shard in shards:
+        with use_shard(shard):
+            config = load_config()
+            free = IPAllocator.from_config(config).free_count
+            peers = len(config.peers)
+            if placement == 'traffic':
+                _, live = get_backend().dump()
+                active = [peer for peer in live.values()
+                          if peer.latest_handshake and now - peer.latest_handshake <= ONLINE_HANDSHAKE_AGE]
+                traffic = sum(peer.rx + peer.tx for peer in active)
+                # Новый клиент добавляет к шарду средний трафик его активного пира
+                loads.append({'shard': shard, 'config': config, 'free': free, 'load': traffic,
+                              'step': max(traffic / len(active), 1) if active else 1})
+            else:
+                loads.append({'shard': shard, 'config': config, 'free': free, 'load': peers, 'step': 1})
+    return loads
+
+# Распределение новых клиентов: каждый уходит в наименее загруженный шард со свободными адресами
+def place_clients(names, placement=None, shards=None):
+    loads = shard_loads(shards or get_shards(), placement)
+    taken = set()
+    for item in loads:
+        taken.update(item['config'].by_name)
+    if shards:
+        # Имена уникальны во всех шардах, даже если клиенты создаются в одном
+        pinned = {shard.conf for shard in shards}
+        taken.update(peer.name for shard, peer in list_sharded() if shard.conf not in pinned and peer.name)
+    heap = [(item['load'], index) for index, item in enumerate(loads) if item['free'] > 0]
+    heapq.heapify(heap)
+    groups = collections.defaultdict(list)
+    for name in names:
+        if not CLIENT_NAME_RE.fullmatch(name):
+            raise ValueError(f"Некорректное имя клиента: {name!r} (допустимы буквы, цифры и символы . @ + - _)")
+        if name in taken:
+            raise ValueError(f"Повторяющееся имя клиента: {name!r}")
+        taken.add(name)
+        if not heap:
+            raise ValueError("Во всех шардах закончились свободные адреса")
+        load, index = heapq.heappop(heap)
+        item = loads[index]
+        groups[index].append(name)
+        item['free'] -= 1
+        if item['free'] > 0:
+            heapq.heappush(heap, (load + item['step'], index))
+    return [(loads[index]['shard'], group) for index, group in sorted(groups.items())]
+
+# Создание клиентов с размещением по шардам: по одной транзакции и одному
+# обновлению ядра на каждый затронутый шард
+def provision_sharded(names, placement=None, interface=None, labels=None, profile=None):
+    get_profile(profile)
+    shards = [find_shard(interface)] if interface else None
+    results, applied, messages = [], True, []
+    for shard, group in place_clients(names, placement, shards):
+        with use_shard(shard):
+            clients, shard_applied, message = provision_clients(group, labels, profile)
+        results.extend((shard, client) for client in clients)
+        if not shard_applied:
+            applied = False
+            messages.append(f"{shard.interface}: {message}")
+    return results, applied, "; ".join(messages)
+
+# Очистка неактивных клиентов во всех шардах. Защита от массового удаления
+# сначала проверяется в каждом шарде, чтобы отказ в одном не оставил другие
+# уже очищенными; --limit ограничивает общее число удалённых
+def reap_sharded(idle, include_never=False, dry_run=False, limit=None, force=False):
+    shards = get_shards()
+    if not dry_run and not force:
+        for shard in shards:
+            with use_shard(shard):
+                reap_stale_peers(idle, include_never, True, limit)
+    results, applied, messages = [], True, []
+    for shard in shards:
+        remaining = None if limit is None else limit - len(results)
+        if remaining is not None and remaining <= 0:
+            break
+        with use_shard(shard):
+            rows, shard_applied, message = reap_stale_peers(idle, include_never, dry_run, remaining, force)
+        results.extend(dict(row, interface=shard.interface) for row in rows)
+        if not shard_applied:
+            applied = False
+            messages.append(f"{shard.interface}: {message}")
+    return results, applied, "; ".join(messages)
+
+def revoke_sharded(selectors):
+    results, applied, messages = [], True, []
+    for shard in get_shards():
+        with use_shard(shard):
+            peers, shard_applied, message = revoke_clients(selectors)
+        results.extend((shard, peer) for peer in peers)
+        if not shard_applied:
+            applied = False
+            messages.append(f"{shard.interface}: {message}")
+    return results, applied, "; ".join(messages)
+
+def list_sharded():
+    for shard in get_shards():
+        with use_shard(shard):
+            config = load_config()
+        for peer in config.peers:
+            yield shard, peer
+
+def reload_sharded():
+    diffs = []
+    for shard in get_shards():
+        with use_shard(shard):
+            diffs.append((shard, hot_reload()))
+    return diffs
+
+# Перенос неактивных пиров из перегруженных шардов в недогруженные, чтобы
+# выровнять число пиров. Клиент получает новый адрес и порт, поэтому
+# переносятся только те, кто не подключался дольше idle секунд (или никогда)
+# и кто есть в хранилище клиентов: его конфиг строится заново с новыми параметрами.
+def plan_rebalance(idle, limit=None):
+    loads = shard_loads(get_shards(), 'peers')
+    total = sum(item['load'] for item in loads)
+    target = -(-total // len(loads))
+    now = time.time()
+    moves = []
+    receivers = [item for item in loads if item['load'] < target]
+    store = get_client_store()
+    for item in loads:
+        excess = item['load'] - target
+        if excess <= 0:
+            continue
+        with use_shard(item['shard']):
+            _, live = get_backend().dump()
+        candidates = []
+        for peer in item['config'].peers:
+            current = live.get(peer.public_key)
+            if current is None or not peer.name or not peer.public_key or not peer.preshared_key:
+                continue
+            if current.latest_handshake and now - current.latest_handshake <= idle:
+                continue
+            if peer.name not in store:
+                continue
+            candidates.append((current.latest_handshake, peer))
+        # Сначала самые давние
+        candidates.sort(key=lambda candidate: candidate[0])
+        for _, peer in candidates[:excess]:
+            receivers = [receiver for receiver in receivers if receiver['load'] < target and receiver['free'] > 0]
+            if not receivers or (limit is not None and len(moves) >= limit):
+                break
+            receiver = min(receivers, key=lambda receiver: receiver['load'])
+            receiver['load'] += 1
+            receiver['free'] -= 1
+            item['load'] -= 1
+            moves.append((item['shard'], receiver['shard'], peer))
+    return moves
+
+def apply_rebalance(moves):
+    by_target = collections.defaultdict(list)
+    by_source = collections.defaultdict(list)
+    shards = {}
+    for source, target, peer in moves:
+        shards[source.conf], shards[target.conf] = source, target
+        by_target[target.conf].append(peer)
+        by_source[source.conf].append(peer)
+    
+    # Сначала добавляем в новые шарды: при сбое пир останется в обоих, а не потеряется
+    results, applied, messages = [], True, []
+    for conf, peers in by_target.items():
+        shard = shards[conf]
+        with use_shard(shard):
+            with get_journal().transaction() as txn:
+                taken = {peer.public_key for peer in peers} & set(txn.config.by_pubkey)
+                if taken:
+                    raise ValueError(f"Пиры уже есть в {shard.interface}: {', '.join(sorted(taken))}")
+                ips = IPAllocator.from_config(txn.config).allocate_many(len(peers))
+                added = txn.add_peer_block("".join(render_peer_block(peer.name, peer.public_key, peer.preshared_key, ip, peer.profile)
+                                                   for peer, ip in zip(peers, ips)))
+                config = txn.config
+            store = get_client_store()
+            records = []
+            for peer, ip in zip(peers, ips):
+                record = store.get(peer.name) if peer.name else None
+                if record is not None:
+                    # Прежний текст конфига устарел: адрес и эндпоинт другие
+                    record.ip, record.interface, record.config = ip, shard.interface, None
+                    record.public_key, record.preshared_key, record.profile = peer.public_key, peer.preshared_key, peer.profile
+                    records.append(record)
+                results.append({'name': peer.name, 'public_key': peer.public_key, 'ip': ip, 'interface': shard.interface})
+            store.update_many(records)
+            shard_applied, message = get_backend().sync(config.text())
+            shaped, error = sync_shaping(config, added)
+            shard_applied, message = shard_applied and shaped, "; ".join(part for part in (message, error) if part)
+        if not shard_applied:
+            applied = False
+            messages.append(f"{shard.interface}: {message}")
+    
+    for conf, peers in by_source.items():
+        with use_shard(shards[conf]):
+            pubkeys = {peer.public_key for peer in peers}
+            # Конфиги клиентов уже перезаписаны для нового шарда
+            _, shard_applied, message = revoke_peers(
+                lambda config: [peer for peer in config.peers if peer.public_key in pubkeys], remove_files=False)
+        if not shard_applied:
+            applied = False
+            messages.append(f"{shards[conf].interface}: {message}")
+    return results, applied, "; ".join(messages)
+
+def format_bytes(value):
+    for unit in ('Б', 'КиБ', 'МиБ', 'ГиБ'):
+        if value < 1024:
+            return f"{value:.0f} {unit}" if unit == 'Б' else f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} ТиБ"
+
+def format_handshake(timestamp, now):
+    if not timestamp:
+        return "никогда"
+    age = int(now - timestamp)
+    if age < 60:
+        return f"{age} с назад"
+    if age < 3600:
+        return f"{age // 60} мин назад"
+    if age < 86400:
+        return f"{age // 3600} ч назад"
+    return f"{age // 86400} д назад"
+
+def format_status_row(row, now):
+    mark = "●" if row['online'] else "○"
+    name = (row['name'] or row['public_key'][:16])[:20]
+    return (f"{mark} {name:<20} {row['ip'] or '-':<16} {(row['endpoint'] or '-')[:22]:<22} "
+            f"{format_handshake(row['latest_handshake'], now):<14} "
+            f"{format_bytes(row['rx']):>11} {format_bytes(row['tx']):>11} "
+            f"{format_bytes(row['rx_rate']) + '/с':>13} {format_bytes(row['tx_rate']) + '/с':>13}")
+
+STATUS_HEADER = (f"  {'Имя':<20} {'IP адрес':<16} {'Эндпоинт':<22} {'Рукопожатие':<14} "
+                 f"{'Принято':>11} {'Отправлено':>11} {'Скорость rx':>13} {'Скорость tx':>13}")
+
+# Полный перезапуск интерфейса (разрывает все соединения)
+def restart_interface(interface=None):
+    interface = interface or get_interface_name()
+    # wg-quick читает конфиг с диска, поэтому сначала переносим в него журнал
+    get_journal().compact()
+    
+    # В зависимости от ОС используем разные команды
+    if os.name == 'nt':
+        # Для Windows используем PowerShell с повышенными привилегиями
+        print(f"{Colors.CYAN}Останавливаем интерфейс...{Colors.ENDC}")
+        stop_cmd = f"wireguard /uninstalltunnelservice {interface}"
+        run_external(["powershell", "Start-Process", "cmd", "-ArgumentList", f"/c {stop_cmd}", "-Verb", "RunAs"], 
+                     capture_output=True, text=True)
+        
+        time.sleep(2)
+        
+        print(f"{Colors.CYAN}Запускаем интерфейс...{Colors.ENDC}")
+        start_cmd = f"wireguard /installtunnelservice {CONF}"
+        run_external(["powershell", "Start-Process", "cmd", "-ArgumentList", f"/c {start_cmd}", "-Verb", "RunAs"], 
+                     capture_output=True, text=True)
+    else:
+        # Для Linux используем systemctl или wg-quick
+        print(f"{Colors.CYAN}Перезагружаем интерфейс через systemd...{Colors.ENDC}")
+        reload_cmd = f"sudo systemctl restart wg-quick@{interface}"
+        reload_result = run_external(reload_cmd, shell=True, capture_output=True, text=True)
+        
+        if reload_result.returncode != 0:
+            print(f"{Colors.WARNING}Не удалось использовать systemd, пробуем wg-quick...{Colors.ENDC}")
+            down_cmd = f"sudo wg-quick down {interface}"
+            run_external(down_cmd, shell=True, capture_output=True, text=True)
+            
+            time.sleep(1)
+            
+            up_cmd = f"sudo wg-quick up {interface}"
+            run_external(up_cmd, shell=True, capture_output=True, text=True)
+        
+        # Правила tc пропадают вместе с интерфейсом
+        shaped, message = sync_shaping(load_config(), interface=interface)
+        if not shaped:
+            print(f"{Colors.WARNING}Не удалось применить ограничения скорости: {message}{Colors.ENDC}")
+
+# Применение только изменившихся пиров: сравнение конфига с wg show dump и wg syncconf
+def hot_reload(config=None, interface=None):
+    interface = interface or get_interface_name()
+    started = time.time()
+    config = config or load_config()
+    backend = get_backend(interface)
+    _, live = backend.dump()
+    diff = diff_peers(config, live)
+    changed = len(diff['added']) + len(diff['updated']) + len(diff['removed'])
+    if changed:
+        applied, message = backend.sync(config.text())
+        if not applied:
+            raise RuntimeError(message or "wg syncconf завершился с ошибкой")
+    shaped, message = sync_shaping(config, interface=interface)
+    if not shaped:
+        raise RuntimeError(message)
+    diff['elapsed'] = time.time() - started
+    return diff
+
+@menu_decorator
+def reload_wireguard():
+    print(f"{Colors.BOLD}Перезагрузка конфигурации WireGuard{Colors.ENDC}\n")
+    
+    print(f"1. {Colors.GREEN}Применить изменения без разрыва соединений{Colors.ENDC}")
+    print(f"2. {Colors.WARNING}Полный перезапуск интерфейса{Colors.ENDC}")
+    mode = input("\nВыберите режим (по умолчанию 1): ").strip() or '1'
+    
+    try:
+        # Определяем имя интерфейса из пути к конфигу
+        interface = get_interface_name()
+        
+        if mode == '1':
+            print(f"\n{Colors.CYAN}Сравниваем конфигурацию с состоянием интерфейса {interface}...{Colors.ENDC}")
+            try:
+                diff = hot_reload(interface=interface)
+            except Exception as e:
+                print(f"{Colors.FAIL}Не удалось применить изменения без перезапуска: {str(e)}{Colors.ENDC}")
+                print(f"{Colors.WARNING}Для полного перезапуска выберите режим 2.{Colors.ENDC}")
+            else:
+                print(f"{Colors.GREEN}Добавлено: {len(diff['added'])}, изменено: {len(diff['updated'])}, удалено: {len(diff['removed'])}, без изменений: {diff['unchanged']}{Colors.ENDC}")
+                print(f"{Colors.GREEN}Конфигурация WireGuard применена за {diff['elapsed']:.2f} с без разрыва соединений{Colors.ENDC}")
+        elif mode == '2':
+            print(f"Перезагружаем интерфейс {interface}...")
+            restart_interface(interface)
+            print(f"{Colors.GREEN}Конфигурация WireGuard успешно перезагружена!{Colors.ENDC}")
+        else:
+            print(f"{Colors.FAIL}Некорректный выбор{Colors.ENDC}")
+        
+    except Exception as e:
+        print(f"{Colors.FAIL}Произошла ошибка при перезагрузке: {str(e)}{Colors.ENDC}")
+    
+    input("\nНажмите Enter для возврата в меню...")
+
+# Экран состояния в стиле top: перерисовываются только изменившиеся строки
+@menu_decorator
+def show_status():
+    print(f"{Colors.BOLD}Состояние подключений{Colors.ENDC} (обновление каждые 2 с, Ctrl+C - выход)\n")
+    
+    # Строки экрана: заголовок меню занимает 4 строки, затем 2 строки подписи
+    first_row = 7
+    drawn = {}
+    status = None
+    try:
+        config = load_config()
+        while True:
+            status = read_peer_status(status, config)
+            size = shutil.get_terminal_size()
+            visible = max(size.lines - first_row - 2, 1)
+            lines = [
+                f"{Colors.CYAN}{STATUS_HEADER}{Colors.ENDC}",
+            ] + [format_status_row(row, status['time']) for row in status['peers'][:visible]]
+            lines.append(f"{Colors.BOLD}Подключено: {status['online']} из {status['total']}{Colors.ENDC}"
+                         + (f" (показано {visible})" if status['total'] > visible else ""))
+            output = []
+            for i, line in enumerate(lines):
+                if drawn.get(i) != line:
+                    output.append(f"\033[{first_row + i};1H{line}\033[K")
+                    drawn[i] = line
+            # Стираем строки, оставшиеся от более длинного списка
+            for i in [i for i in drawn if i >= len(lines)]:
+                output.append(f"\033[{first_row + i};1H\033[K")
+                del drawn[i]
+            sys.stdout.write("".join(output) + f"\033[{first_row + len(lines) + 1};1H")
+            sys.stdout.flush()
+            time.sleep(2)
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"\n{Colors.FAIL}Не удалось получить состояние интерфейса: {str(e)}{Colors.ENDC}")
+        input("\nНажмите Enter для возврата в меню...")
+
+@menu_decorator
+def main_menu():
+    while True:
+        print(f"{Colors.BOLD}Главное меню:{Colors.ENDC}\n")
+        print(f"1. {Colors.GREEN}Добавить нового клиента{Colors.ENDC}")
+        print(f"2. {Colors.BLUE}Просмотреть список клиентов{Colors.ENDC}")
+        print(f"3. {Colors.WARNING}Удалить клиента{Colors.ENDC}")
+        print(f"4. {Colors.CYAN}Просмотреть ключи клиента{Colors.ENDC}")
+        print(f"5. {Colors.BLUE}Диагностика подключения{Colors.ENDC}")
+        print(f"6. {Colors.GREEN}Перезагрузить WireGuard{Colors.ENDC}")
+        print(f"7. {Colors.GREEN}Массовое добавление клиентов{Colors.ENDC}")
+        print(f"8. {Colors.CYAN}Состояние подключений{Colors.ENDC}")
+        print(f"9. {Colors.BLUE}Экспорт конфигов в архив{Colors.ENDC}")
+        print(f"0. {Colors.FAIL}Выход{Colors.ENDC}")
+        
+        choice = input("\nВыберите действие: ")
+        
+        if choice == '1':
+            add_client()
+        elif choice == '2':
+            list_clients()
+        elif choice == '3':
+            delete_client()
+        elif choice == '4':
+            show_client_keys()
+        elif choice == '5':
+            diagnose_connection()
+        elif choice == '6':
+            reload_wireguard()
+        elif choice == '7':
+            bulk_add_clients()
+        elif choice == '8':
+            show_status()
+        elif choice == '9':
+            export_configs()
+        elif choice == '0':
+            clear_screen()
+            print_header()
+            print(f"{Colors.GREEN}Спасибо за использование WireGuard Manager!{Colors.ENDC}")
+            time.sleep(1)
+            clear_screen()
+            sys.exit(0)
+        else:
+            clear_screen()
+            print_header()
+            print(f"{Colors.FAIL}Некорректный выбор. Пожалуйста, повторите.{Colors.ENDC}")
+            time.sleep(1)
+            clear_screen()
+            print_header()
+        compact_journals()
+
+# Фоновый режим: конфиг загружается один раз и держится в памяти, запросы идут по
+# HTTP через TCP или Unix-сокет. Изменения выполняет единственная задача-писатель:
+# операции, пришедшие в пределах окна DAEMON_COALESCE_WINDOW, применяются одной
+# записью конфига и одним обновлением ядра.
+# По умолчанию сервер слушает Unix-сокет с правами 0600 (доступ только у
+# владельца). TCP требует токен: заголовок "Authorization: Bearer <токен>",
+# токен берётся из --token-file или переменной WG_MANAGER_TOKEN. Шаблоны имён
+# (test-*) при удалении принимаются только с явным флагом glob.
+DAEMON_SOCKET = "/run/wg-manager.sock"
+DAEMON_LISTEN = "127.0.0.1:8787"
+DAEMON_COALESCE_WINDOW = 0.02
+DAEMON_MAX_BATCH = 10000
+DAEMON_COMPACT_INTERVAL = 60
+HTTP_MAX_BODY = 4 * 1024 * 1024  # Предел тела запроса по Content-Length, байт
+
+HTTP_REASONS = {200: 'OK', 201: 'Created', 207: 'Multi-Status', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found',
+                405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+class DaemonError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class ManagerDaemon:
+    def __init__(self, loop, token=None):
+        import asyncio
+        import concurrent.futures
+        self.loop = loop
+        self.token = token
+        self.journal = get_journal()
+        self.journal_path = get_journal_path(self.journal.path)
+        self.journal.compact()
+        with self.journal.transaction() as txn:
+            self.config = txn.config
+        self.allocator = IPAllocator.from_config(self.config)
+        self.backend = get_backend()
+        self.queue = asyncio.Queue()
+        # Все изменения выполняются в одном потоке, чтобы не блокировать цикл событий
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.batches = 0
+
+    # Постановка изменения в очередь писателя и ожидание результата
+    def submit(self, op, payload):
+        future = self.loop.create_future()
+        self.queue.put_nowait((op, payload, future))
+        return future
+
+    async def writer(self):
+        import asyncio
+        while True:
+            batch = [await self.queue.get()]
+            deadline = self.loop.time() + DAEMON_COALESCE_WINDOW
+            while len(batch) < DAEMON_MAX_BATCH:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                results = await self.loop.run_in_executor(self.executor, self.apply_batch, batch)
+            except Exception as e:
+                results = [DaemonError(500, str(e))] * len(batch)
+            for (_, _, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    # Применение пачки операций: изменения в памяти по очереди, затем одна запись
+    # в журнал (один fsync) и один flush. Результат изменения - клиенты и признак
+    # применения к интерфейсу: при ошибке wg или tc конфиг уже записан, а
+    # applied = false и message сообщают, что интерфейс не обновлён
+    def apply_batch(self, batch):
+        self.batches += 1
+        results = []
+        added = []
+        removed = []
+        with self.journal.transaction(self.config) as txn:
+            if txn.config is not self.config:
+                # Конфиг изменили в обход демона - работаем с перечитанным
+                self.config = txn.config
+                self.allocator = IPAllocator.from_config(self.config)
+            for op, payload, _ in batch:
+                try:
+                    if op == 'add':
+                        names, profile = payload
+                        clients, peers = add_clients_to_config(txn, names, self.allocator, profile)
+                        added.append((clients, peers, profile))
+                        results.append([{'name': name, 'ip': ip, 'public_key': pub} for name, ip, _, pub, _ in clients])
+                    elif op == 'delete':
+                        peers = select_peers(self.config, payload)
+                        if not peers:
+                            raise DaemonError(404, "Подходящие клиенты не найдены")
+                        txn.remove_peers(peers)
+                        for peer in peers:
+                            if peer.ip:
+                                self.allocator.release(peer.ip)
+                        removed.extend(peers)
+                        results.append([{'name': peer.name, 'ip': peer.ip, 'public_key': peer.public_key} for peer in peers])
+                    else:
+                        txn.rewrite = True
+                        results.append(None)
+                except DaemonError as e:
+                    results.append(e)
+                except ValueError as e:
+                    results.append(DaemonError(409, str(e)))
+            for clients, _, profile in added:
+                txn.store_clients(clients, profile=profile)
+        if added or removed:
+            for _, peers, _ in added:
+                self.backend.add_peers(peers)
+            remove_client_files(removed)
+            self.backend.remove_peers([peer.public_key for peer in removed if peer.public_key])
+            applied, message = self.backend.flush()
+            if not applied:
+                print(f"Не удалось применить изменения динамически: {message}", file=sys.stderr)
+            shaped, error = sync_shaping(self.config, [peer for _, peers, _ in added for peer in peers] + removed)
+            if not shaped:
+                print(f"Не удалось применить ограничения скорости: {error}", file=sys.stderr)
+            message = "; ".join(part for part in (message if not applied else '', error) if part)
+            results = [result if result is None or isinstance(result, Exception)
+                       else {'clients': result, 'applied': applied and shaped, 'message': message}
+                       for result in results]
+        return results
+
+    # Периодический перенос журнала в конфиг через ту же очередь писателя
+    async def compactor(self):
+        import asyncio
+        while True:
+            await asyncio.sleep(DAEMON_COMPACT_INTERVAL)
+            if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path):
+                await self.submit('compact', None)
+
+    # Шаблон может задеть всех клиентов ("*"), поэтому нужен явный флаг
+    @staticmethod
+    def _check_selectors(selectors, glob):
+        if not glob and any(ch in selector for selector in selectors for ch in '*?['):
+            raise DaemonError(400, "Шаблоны в именах разрешены только с glob: true (или ?glob=1)")
+        return selectors
+
+    async def handle_request(self, method, path, body):
+        path, _, query = path.partition('?')
+        path = path.rstrip('/') or '/'
+        query = urllib.parse.parse_qs(query)
+        if path == '/health' and method == 'GET':
+            return 200, {'status': 'ok', 'peers': len(self.config.peers), 'batches': self.batches}
+        if path == '/clients' and method == 'GET':
+            return 200, [{'name': peer.name, 'ip': peer.ip, 'public_key': peer.public_key} for peer in list(self.config.peers)]
+        if path == '/clients' and method == 'POST':
+            data = json.loads(body or b'{}')
+            names = list(data.get('names') or [])
+            if data.get('name'):
+                names.append(data['name'])
+            # Предел проверяется до построения имён: count не должен раздувать память
+            limit = min(DAEMON_MAX_BATCH, self.allocator.free_count)
+            count = int(data.get('count') or 0)
+            if count < 0 or len(names) + count > limit:
+                raise DaemonError(400, f"За один запрос можно добавить не больше {limit} клиентов")
+            if count:
+                timestamp = datetime.datetime.now().strftime("%s")
+                names.extend(f"client-{timestamp}-{os.urandom(3).hex()}" for _ in range(count))
+            if not names:
+                raise DaemonError(400, "Не указаны имена клиентов")
+            get_profile(data.get('profile'))
+            result = await self.submit('add', (names, data.get('profile')))
+            return 201 if result['applied'] else 207, result
+        if path == '/clients/delete' and method == 'POST':
+            data = json.loads(body or b'{}')
+            selectors = list(data.get('selectors') or [])
+            if not selectors:
+                raise DaemonError(400, "Не указаны клиенты для удаления")
+            result = await self.submit('delete', self._check_selectors(selectors, data.get('glob') is True))
+            return 200 if result['applied'] else 207, result
+        if path.startswith('/clients/') and method == 'DELETE':
+            selector = urllib.parse.unquote(path[len('/clients/'):])
+            result = await self.submit('delete', self._check_selectors([selector], query.get('glob') == ['1']))
+            return 200 if result['applied'] else 207, result
+        if path == '/status' and method == 'GET':
+            status = await self.loop.run_in_executor(None, read_peer_status, None, self.config)
+            return 200, status
+        if path in ('/health', '/clients', '/clients/delete', '/status') or path.startswith('/clients/'):
+            raise DaemonError(405, "Метод не поддерживается")
+        raise DaemonError(404, "Не найдено")
+
+    def authorized(self, headers):
+        if not self.token:
+            return True
+        scheme, _, value = headers.get('authorization', '').partition(' ')
+        return scheme.lower() == 'bearer' and hmac.compare_digest(value.strip().encode(), self.token.encode())
+
+    # Ответ API в JSON с кодами ошибок
+    async def respond(self, method, path, headers, body):
+        try:
+            if not self.authorized(headers):
+                raise DaemonError(401, "Нужен заголовок Authorization: Bearer <токен>")
+            status, data = await self.handle_request(method, path, body)
+        except DaemonError as e:
+            status, data = e.status, {'error': str(e)}
+        except (ValueError, TypeError, AttributeError) as e:
+            status, data = 400, {'error': str(e)}
+        except Exception as e:
+            status, data = 500, {'error': str(e)}
+        return status, {'Content-Type': 'application/json; charset=utf-8'}, json.dumps(data, ensure_ascii=False).encode()
+
+# Минимальный HTTP/1.1 с поддержкой keep-alive. handler(method, path, headers, body)
+# возвращает код ответа, заголовки и тело.
+async def serve_http_connection(reader, writer, handler):
+    import asyncio
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            try:
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+            except ValueError:
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+            try:
+                length = int(headers.get('content-length') or 0)
+            except ValueError:
+                length = -1
+            method = method.upper()
+            keep_alive = headers.get('connection', '').lower() != 'close'
+            if length < 0 or length > HTTP_MAX_BODY:
+                # Тело не читаем: отвечаем ошибкой и закрываем соединение
+                status, keep_alive = 413 if length > 0 else 400, False
+                response_headers = {'Content-Type': 'application/json; charset=utf-8'}
+                payload = json.dumps({'error': f"Тело запроса больше {HTTP_MAX_BODY} байт" if length > 0
+                                      else "Некорректный Content-Length"}, ensure_ascii=False).encode()
+            else:
+                body = await reader.readexactly(length) if length else b''
+                route = (path.split('?', 1)[0].split('/') + [''])[1]
+                with timed('operation', f"http {method} /{route}"):
+                    status, response_headers, payload = await handler(method, path, headers, body)
+            head = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}"]
+            head.extend(f"{key}: {value}" for key, value in response_headers.items())
+            head.append(f"Content-Length: {len(payload)}")
+            head.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + (payload if method != 'HEAD' else b''))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+# Запуск HTTP-сервера на TCP-адресе или Unix-сокете до SIGTERM или Ctrl+C.
+# tasks - фоновые корутины, on_stop - действия после остановки сервера.
+def run_http_server(loop, handler, listen=None, socket_path=None, tasks=(), on_stop=None):
+    import asyncio
+    connection = lambda reader, writer: serve_http_connection(reader, writer, handler)
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        # Сокет создаётся сразу с правами 0600, без окна между bind и chmod
+        umask = os.umask(0o177)
+        try:
+            server = loop.run_until_complete(asyncio.start_unix_server(connection, path=socket_path))
+        finally:
+            os.umask(umask)
+        os.chmod(socket_path, 0o600)
+    else:
+        host, _, port = listen.rpartition(':')
+        server = loop.run_until_complete(asyncio.start_server(connection, host or '127.0.0.1', int(port)))
+    running = [loop.create_task(task) for task in tasks]
+    if hasattr(signal, 'SIGTERM') and os.name != 'nt':
+        loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for task in running:
+            task.cancel()
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        if on_stop:
+            on_stop()
+        loop.close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+# Токен для TCP: файл с токеном или переменная окружения WG_MANAGER_TOKEN
+def load_daemon_token(path=None):
+    if path:
+        with open(path, 'r') as f:
+            token = f.read().strip()
+    else:
+        token = os.environ.get('WG_MANAGER_TOKEN', '').strip()
+    return token or None
+
+def run_daemon(listen=None, socket_path=None, token=None):
+    import asyncio
+    if listen and socket_path:
+        raise ValueError("Укажите либо --listen, либо --socket")
+    if listen and not token:
+        raise ValueError("Для TCP нужен токен: --token-file или переменная WG_MANAGER_TOKEN")
+    if not listen:
+        socket_path = socket_path or DAEMON_SOCKET
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    daemon = ManagerDaemon(loop, token)
+    
+    def stop():
+        daemon.executor.shutdown()
+        daemon.journal.compact(daemon.config)
+    
+    print(f"WireGuard Manager слушает {socket_path or listen} ({len(daemon.config.peers)} клиентов)", file=sys.stderr)
+    run_http_server(loop, daemon.respond, listen, socket_path,
+                    [daemon.writer(), daemon.compactor()], stop)
+
+# Экспорт метрик для Prometheus: трафик и давность рукопожатия каждого клиента
+# из одного вызова wg show dump, число пиров и свободные адреса пула. Ответ
+# кэшируется на EXPORTER_CACHE_TTL секунд, параллельные запросы ждут одно
+# обновление. Для больших интерфейсов метрики по клиентам выдаются не более чем
+# для EXPORTER_MAX_PEERS клиентов. Набор устойчив между опросами: клиент остаётся
+# в нём, пока есть на интерфейсе, а освободившиеся места занимают самые активные
+# из остальных. Трафик остальных выдаётся суммой в метриках-gauge
+# wg_manager_exporter_other_*_bytes: их состав меняется, и счётчиком они не являются.
+EXPORTER_LISTEN = "127.0.0.1:9586"
+EXPORTER_CACHE_TTL = 5
+EXPORTER_MAX_PEERS = 1000
+EXPORTER_BUDGET = 2.0
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class MetricsCollector:
+    def __init__(self, dump_file=None, max_peers=None):
+        self.dump_file = dump_file
+        self.max_peers = EXPORTER_MAX_PEERS if max_peers is None else max_peers
+        self.interface = get_interface_name()
+        self._config_key = None
+        self._config = None
+        self._free = None
+        self._capacity = None
+        self._selected = set()
+
+    # Конфиг и пул адресов перечитываются только при изменении файлов
+    def _load_config(self):
+        st = os.stat(CONF)
+        journal_path = get_journal_path()
+        journal_size = os.path.getsize(journal_path) if os.path.exists(journal_path) else 0
+        key = (st.st_size, st.st_mtime_ns, st.st_ino, journal_size)
+        if key != self._config_key:
+            self._config = load_config()
+            allocator = IPAllocator.from_config(self._config)
+            self._free, self._capacity = allocator.free_count, allocator.capacity
+            self._config_key = key
+        return self._config
+
+    def _dump(self):
+        if self.dump_file:
+            with open(self.dump_file, 'r') as f:
+                return parse_wg_dump(f.read())
+        return get_backend(self.interface).dump()
+
+    def collect(self, now=None):
+        started = time.perf_counter()
+        config = self._load_config()
+        _, live = self._dump()
+        now = now or time.time()
+        interface = _label_value(self.interface)
+        
+        peers = list(live.values())
+        other = None
+        if len(peers) > self.max_peers:
+            # Ограничение числа рядов: сначала выбранные в прошлый раз, затем
+            # самые свежие рукопожатия и наибольший трафик
+            peers.sort(key=lambda peer: (peer.public_key not in self._selected,
+                                         -peer.latest_handshake, -(peer.rx + peer.tx)))
+            rest = peers[self.max_peers:]
+            peers = peers[:self.max_peers]
+            other = (len(rest), sum(peer.rx for peer in rest), sum(peer.tx for peer in rest))
+        self._selected = {peer.public_key for peer in peers}
+        
+        by_pubkey = config.by_pubkey
+        labels = []
+        for peer in peers:
+            known = by_pubkey.get(peer.public_key)
+            name = known.name if known and known.name else peer.public_key
+            ip = known.ip if known and known.ip else (peer.allowed_ips[0].split('/')[0] if peer.allowed_ips else '')
+            labels.append(f'interface="{interface}",client="{_label_value(name)}",ip="{ip}"')
+        
+        online = sum(1 for peer in live.values()
+                     if peer.latest_handshake and now - peer.latest_handshake <= ONLINE_HANDSHAKE_AGE)
+        lines = [
+            "# HELP wireguard_peer_receive_bytes_total Bytes received from the peer.",
+            "# TYPE wireguard_peer_receive_bytes_total counter",
+        ]
+        lines.extend(f"wireguard_peer_receive_bytes_total{{{label}}} {peer.rx}" for label, peer in zip(labels, peers))
+        lines += [
+            "# HELP wireguard_peer_transmit_bytes_total Bytes sent to the peer.",
+            "# TYPE wireguard_peer_transmit_bytes_total counter",
+        ]
+        lines.extend(f"wireguard_peer_transmit_bytes_total{{{label}}} {peer.tx}" for label, peer in zip(labels, peers))
+        lines += [
+            "# HELP wireguard_peer_last_handshake_age_seconds Seconds since the latest handshake (absent if never).",
+            "# TYPE wireguard_peer_last_handshake_age_seconds gauge",
+        ]
+        lines.extend(f"wireguard_peer_last_handshake_age_seconds{{{label}}} {max(now - peer.latest_handshake, 0):.0f}"
+                     for label, peer in zip(labels, peers) if peer.latest_handshake)
+        lines += [
+            "# HELP wireguard_peers Number of peers by state.",
+            "# TYPE wireguard_peers gauge",
+            f'wireguard_peers{{interface="{interface}",state="configured"}} {len(config.peers)}',
+            f'wireguard_peers{{interface="{interface}",state="live"}} {len(live)}',
+            f'wireguard_peers{{interface="{interface}",state="online"}} {online}',
+            f'wireguard_peers{{interface="{interface}",state="unknown"}} {sum(1 for key in live if key not in by_pubkey)}',
+            "# HELP wireguard_pool_free_addresses Free addresses left in the client subnet.",
+            "# TYPE wireguard_pool_free_addresses gauge",
+            f'wireguard_pool_free_addresses{{interface="{interface}"}} {self._free}',
+            "# HELP wireguard_pool_size_addresses Assignable addresses in the client subnet.",
+            "# TYPE wireguard_pool_size_addresses gauge",
+            f'wireguard_pool_size_addresses{{interface="{interface}"}} {self._capacity}',
+            "# HELP wg_manager_exporter_omitted_peers Peers without per-client series because of the series limit.",
+            "# TYPE wg_manager_exporter_omitted_peers gauge",
+            f'wg_manager_exporter_omitted_peers{{interface="{interface}"}} {other[0] if other else 0}',
+            "# HELP wg_manager_exporter_other_receive_bytes Bytes received from peers omitted by the series limit.",
+            "# TYPE wg_manager_exporter_other_receive_bytes gauge",
+            f'wg_manager_exporter_other_receive_bytes{{interface="{interface}"}} {other[1] if other else 0}',
+            "# HELP wg_manager_exporter_other_transmit_bytes Bytes sent to peers omitted by the series limit.",
+            "# TYPE wg_manager_exporter_other_transmit_bytes gauge",
+            f'wg_manager_exporter_other_transmit_bytes{{interface="{interface}"}} {other[2] if other else 0}',
+            "# HELP wg_manager_exporter_collect_seconds Time spent collecting metrics.",
+            "# TYPE wg_manager_exporter_collect_seconds gauge",
+            f'wg_manager_exporter_collect_seconds{{interface="{interface}"}} {time.perf_counter() - started:.6f}',
+        ]
+        return ("\n".join(lines) + "\n").encode()
+
+class MetricsExporter:
+    def __init__(self, loop, collector, ttl=None, budget=None):
+        self.loop = loop
+        self.collector = collector
+        self.ttl = EXPORTER_CACHE_TTL if ttl is None else ttl
+        self.budget = EXPORTER_BUDGET if budget is None else budget
+        self.cache = None
+        self.cache_time = 0
+        self.gzipped = None
+        self.refreshing = None
+        self.refreshes = 0
+
+    def _refresh_done(self, future):
+        self.refreshing = None
+        if not future.cancelled() and future.exception() is None:
+            self.cache, self.gzipped = future.result(), None
+            self.cache_time = self.loop.time()
+            self.refreshes += 1
+
+    # Одно обновление на всех ожидающих; по истечении бюджета отдаём
+    # прошлый результат, если он есть
+    async def metrics(self):
+        import asyncio
+        if self.cache is not None and self.loop.time() - self.cache_time < self.ttl:
+            return self.cache
+        if self.refreshing is None:
+            self.refreshing = self.loop.run_in_executor(None, self.collector.collect)
+            self.refreshing.add_done_callback(self._refresh_done)
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.refreshing), self.budget)
+        except asyncio.TimeoutError:
+            if self.cache is not None:
+                return self.cache
+            raise
+
+    async def respond(self, method, path, headers, body):
+        import asyncio
+        route = path.split('?', 1)[0]
+        if route != '/metrics':
+            return 404, {'Content-Type': 'text/plain; charset=utf-8'}, "Используйте /metrics\n".encode()
+        if method not in ('GET', 'HEAD'):
+            return 405, {'Content-Type': 'text/plain; charset=utf-8'}, b''
+        try:
+            payload = await self.metrics()
+        except asyncio.TimeoutError:
+            return 503, {'Content-Type': 'text/plain; charset=utf-8'}, "Сбор метрик не уложился в бюджет\n".encode()
+        except Exception as e:
+            return 500, {'Content-Type': 'text/plain; charset=utf-8'}, f"{e}\n".encode()
+        response_headers = {'Content-Type': METRICS_CONTENT_TYPE}
+        if 'gzip' in headers.get('accept-encoding', ''):
+            if self.gzipped is None or self.gzipped[0] is not payload:
+                import gzip
+                self.gzipped = (payload, gzip.compress(payload, 5))
+            response_headers['Content-Encoding'] = 'gzip'
+            payload = self.gzipped[1]
+        return 200, response_headers, payload
+
+def run_exporter(listen=None, socket_path=None, dump_file=None, ttl=None, max_peers=None):
+    import asyncio
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    exporter = MetricsExporter(loop, MetricsCollector(dump_file, max_peers), ttl)
+    print(f"Экспорт метрик на {socket_path or listen or EXPORTER_LISTEN}/metrics", file=sys.stderr)
+    run_http_server(loop, exporter.respond, listen or EXPORTER_LISTEN, socket_path)
+
+# Учёт трафика клиентов. Сэмплер раз в USAGE_INTERVAL секунд читает wg show dump
+# и раскладывает приросты счётчиков rx/tx по часовым и суточным корзинам. Если
+# счётчик меньше прошлого значения (перезапуск интерфейса, повторное добавление
+# пира), приростом считается само значение.
+# Состояние - файл <конфиг>.usage/state.bin, отображённый в память: заголовок и
+# по USAGE_FIELDS счётчиков uint64 на слот. Слоты назначаются публичным ключам
+# (файл peers) и освобождаются, когда пир не появлялся дольше срока хранения
+# суточных корзин. Закрытая корзина пишется отдельным файлом hour-<начало>.bin
+# или day-<начало>.bin только с ненулевыми слотами и удаляется по сроку, поэтому
+# отчёт за любое окно складывает несколько десятков корзин, а не все замеры.
+USAGE_INTERVAL = 60
+USAGE_HOURLY_KEEP = 7 * 24  # Срок хранения часовых корзин, часов
+USAGE_DAILY_KEEP = 400  # Срок хранения суточных корзин, дней
+USAGE_FIELDS = 7
+_USAGE_MAGIC = b'WGUSAGE1'
+_USAGE_HEADER = struct.Struct('=8sQQQQ')  # метка, начало часа, начало суток, время замера, число слотов
+_USAGE_SEGMENT_MAGIC = b'WGUSEG01'
+_USAGE_SEGMENT = struct.Struct('=8sQQ')  # метка, начало корзины, число записей
+
+def get_usage_dir(path=None):
+    return f"{path or CONF}.usage"
+
+class UsageStore:
+    # Счётчики слота: прошлые rx/tx из дампа, текущий час, текущие сутки, день последнего появления
+    PREV_RX, PREV_TX, HOUR_RX, HOUR_TX, DAY_RX, DAY_TX, LAST_SEEN = range(USAGE_FIELDS)
+
+    def __init__(self, path=None, writable=False):
+        self.directory = get_usage_dir(path)
+        self.writable = writable
+        self.keys = []  # слот -> публичный ключ ('' - свободный слот)
+        self.names = []  # слот -> имя клиента на момент появления
+        self.slots = {}
+        self._file = None
+        self._mm = None
+        self._view = self._values = None
+        state_path = os.path.join(self.directory, 'state.bin')
+        if writable:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            if not os.path.exists(state_path):
+                write_file_atomic(state_path, _USAGE_HEADER.pack(_USAGE_MAGIC, 0, 0, 0, 0), mode=0o600)
+        elif not os.path.exists(state_path):
+            return
+        self._file = open(state_path, 'r+b' if writable else 'rb')
+        if writable and fcntl is not None:
+            try:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._file.close()
+                raise RuntimeError(f"Учёт трафика для {self.directory} уже ведёт другой процесс")
+        self._map()
+        if _USAGE_HEADER.unpack_from(self._mm)[0] != _USAGE_MAGIC:
+            self.close()
+            raise ValueError(f"{state_path} - не файл состояния учёта трафика")
+        try:
+            with open(os.path.join(self.directory, 'peers'), 'r') as f:
+                for slot, line in enumerate(f):
+                    key, _, name = line.rstrip('\n').partition('\t')
+                    self.keys.append(key)
+                    self.names.append(name)
+                    if key:
+                        self.slots[key] = slot
+        except FileNotFoundError:
+            pass
+        if writable and len(self.keys) > self.capacity:
+            self._grow(len(self.keys))
+
+    def _map(self):
+        access = mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=access)
+        self._view = memoryview(self._mm)[_USAGE_HEADER.size:]
+        self._values = self._view.cast('Q')
+
+    # Перед закрытием или изменением размера mmap все представления должны быть освобождены
+    def _unmap(self):
+        if self._values is not None:
+            self._values.release()
+            self._view.release()
+            self._values = self._view = None
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def _grow(self, needed):
+        capacity = max(needed, self.capacity * 2, 1024)
+        header = self.header()
+        self._unmap()
+        self._file.truncate(_USAGE_HEADER.size + capacity * USAGE_FIELDS * 8)
+        self._map()
+        _USAGE_HEADER.pack_into(self._mm, 0, _USAGE_MAGIC, header[1], header[2], header[3], capacity)
+
+    @property
+    def capacity(self):
+        return self.header()[4] if self._mm is not None else 0
+
+    # (метка, начало часа, начало суток, время последнего замера, число слотов)
+    def header(self):
+        if self._mm is None:
+            return (_USAGE_MAGIC, 0, 0, 0, 0)
+        return _USAGE_HEADER.unpack_from(self._mm)
+
+    def _save_peers(self):
+        write_file_atomic(os.path.join(self.directory, 'peers'),
+                          "".join(f"{key}\t{name}\n" for key, name in zip(self.keys, self.names)), mode=0o600)
+
+    def _assign(self, keys, names):
+        free = [slot for slot, key in enumerate(self.keys) if not key]
+        free.reverse()
+        for key in keys:
+            if free:
+                slot = free.pop()
+                self.keys[slot], self.names[slot] = key, names.get(key) or ''
+            else:
+                slot = len(self.keys)
+                self.keys.append(key)
+                self.names.append(names.get(key) or '')
+            self.slots[key] = slot
+        if len(self.keys) > self.capacity:
+            self._grow(len(self.keys))
+        self._save_peers()
+
+    # Ненулевые значения пары счётчиков (rx, tx) по слотам
+    def _nonzero(self, field):
+        count = len(self.keys)
+        rx = self._values[field::USAGE_FIELDS].tolist()[:count]
+        tx = self._values[field + 1::USAGE_FIELDS].tolist()[:count]
+        return [(slot, rx[slot], tx[slot]) for slot in range(count) if rx[slot] or tx[slot]]
+
+    # Закрытие корзины: сначала файл, потом обнуление счётчиков
+    # Если файл корзины уже есть (прерванное закрытие), её счётчики в нём и только обнуляются
+    def _close_bucket(self, kind, start, field):
+        entries = self._nonzero(field)
+        slots = array.array('I', (slot for slot, _, _ in entries))
+        path = os.path.join(self.directory, f"{kind}-{start}.bin")
+        if not os.path.exists(path):
+            rx = array.array('Q', (value for _, value, _ in entries))
+            tx = array.array('Q', (value for _, _, value in entries))
+            data = _USAGE_SEGMENT.pack(_USAGE_SEGMENT_MAGIC, start, len(entries)) + slots.tobytes() + rx.tobytes() + tx.tobytes()
+            write_file_atomic(path, data, mode=0o600)
+        values = self._values
+        for slot in slots:
+            values[slot * USAGE_FIELDS + field] = values[slot * USAGE_FIELDS + field + 1] = 0
+
+    # Удаление корзин старше срока хранения и освобождение слотов пиров,
+    # которых нет ни в одной оставшейся корзине
+    def _expire(self, now):
+        hour_limit = int(now // 3600) * 3600 - USAGE_HOURLY_KEEP * 3600
+        day_limit = int(now // 86400) * 86400 - USAGE_DAILY_KEEP * 86400
+        for kind, start in self.buckets():
+            if start < (hour_limit if kind == 'hour' else day_limit):
+                os.remove(os.path.join(self.directory, f"{kind}-{start}.bin"))
+        # Слот можно отдать другому ключу, только когда удалены и суточная, и часовые корзины его последнего дня
+        reclaim_before = min(day_limit, hour_limit - 86400)
+        values = self._values
+        freed = 0
+        for slot, key in enumerate(self.keys):
+            if key and values[slot * USAGE_FIELDS + self.LAST_SEEN] < reclaim_before:
+                del self.slots[key]
+                self.keys[slot] = self.names[slot] = ''
+                for field in range(USAGE_FIELDS):
+                    values[slot * USAGE_FIELDS + field] = 0
+                freed += 1
+        if freed:
+            self._save_peers()
+
+    def buckets(self):
+        result = []
+        if not os.path.isdir(self.directory):
+            return result
+        for entry in os.listdir(self.directory):
+            kind, _, rest = entry.partition('-')
+            if kind in ('hour', 'day') and rest.endswith('.bin') and rest[:-4].isdigit():
+                result.append((kind, int(rest[:-4])))
+        return sorted(result)
+
+    # Учёт одного дампа: live - пиры из parse_wg_dump, names - имена новых ключей
+    def record(self, live, now=None, names=None):
+        now = now or time.time()
+        hour, day = int(now // 3600) * 3600, int(now // 86400) * 86400
+        _, hour_start, day_start, last_sample, _ = self.header()
+        # Начало новой корзины записывается сразу после закрытия прежней, чтобы
+        # прерванный замер не закрыл её повторно
+        if hour_start and hour != hour_start:
+            self._close_bucket('hour', hour_start, self.HOUR_RX)
+            hour_start = hour
+            _USAGE_HEADER.pack_into(self._mm, 0, _USAGE_MAGIC, hour_start, day_start, last_sample, self.capacity)
+        if day_start and day != day_start:
+            self._close_bucket('day', day_start, self.DAY_RX)
+            _USAGE_HEADER.pack_into(self._mm, 0, _USAGE_MAGIC, hour_start, day, last_sample, self.capacity)
+            self._expire(now)
+        new = [key for key in live if key not in self.slots]
+        if new:
+            self._assign(new, names or {})
+        values, slots = self._values, self.slots
+        for key, peer in live.items():
+            base = slots[key] * USAGE_FIELDS
+            if last_sample:
+                # Новый слот обнулён, поэтому для нового пира прирост равен счётчику
+                prev_rx, prev_tx = values[base], values[base + 1]
+                rx = peer.rx - prev_rx if peer.rx >= prev_rx else peer.rx
+                tx = peer.tx - prev_tx if peer.tx >= prev_tx else peer.tx
+            else:
+                # Первый замер только запоминает счётчики: трафик до начала учёта неизвестно когда был
+                rx = tx = 0
+            values[base] = peer.rx
+            values[base + 1] = peer.tx
+            if rx or tx:
+                values[base + self.HOUR_RX] += rx
+                values[base + self.HOUR_TX] += tx
+                values[base + self.DAY_RX] += rx
+                values[base + self.DAY_TX] += tx
+            values[base + self.LAST_SEEN] = day
+        _USAGE_HEADER.pack_into(self._mm, 0, _USAGE_MAGIC, hour, day, int(now), self.capacity)
+        self._mm.flush()
+
+    def _read_segment(self, kind, start):
+        try:
+            with open(os.path.join(self.directory, f"{kind}-{start}.bin"), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        magic, _, count = _USAGE_SEGMENT.unpack_from(data)
+        if magic != _USAGE_SEGMENT_MAGIC:
+            return None
+        offset = _USAGE_SEGMENT.size
+        slots, rx, tx = array.array('I'), array.array('Q'), array.array('Q')
+        slots.frombytes(data[offset:offset + count * slots.itemsize])
+        offset += count * slots.itemsize
+        rx.frombytes(data[offset:offset + count * 8])
+        tx.frombytes(data[offset + count * 8:offset + count * 16])
+        return zip(slots, rx, tx)
+
+    # Записи корзины: из файла или, для текущих часа и суток, из счётчиков состояния
+    def _bucket(self, kind, start):
+        entries = self._read_segment(kind, start)
+        if entries is not None:
+            return entries
+        _, hour_start, day_start, _, _ = self.header()
+        if kind == 'hour' and start == hour_start:
+            return self._nonzero(self.HOUR_RX)
+        if kind == 'day' and start == day_start:
+            return self._nonzero(self.DAY_RX)
+        return ()
+
+    # Трафик за окно [since, until) по публичным ключам: {ключ: (имя, rx, tx)}.
+    # Окно покрывается целыми сутками, а края - часами; для суток старше срока
+    # хранения часовых корзин края округляются до суток.
+    def totals(self, since, until=None, now=None):
+        if self._mm is None:
+            return {}
+        now = now or time.time()
+        until = until or now
+        hourly_from = int(now // 3600) * 3600 - USAGE_HOURLY_KEEP * 3600
+        count = len(self.keys)
+        rx_total, tx_total = [0] * count, [0] * count
+        buckets = 0
+        day = int(since // 86400) * 86400
+        while day < until:
+            day_end = day + 86400
+            if (since <= day and day_end <= until) or day < hourly_from:
+                parts = [('day', day)]
+            else:
+                first = max(day, int(since // 3600) * 3600)
+                parts = [('hour', hour) for hour in range(first, int(min(day_end, until)), 3600)]
+            for kind, start in parts:
+                buckets += 1
+                for slot, rx, tx in self._bucket(kind, start):
+                    if slot < count:
+                        rx_total[slot] += rx
+                        tx_total[slot] += tx
+            day = day_end
+        log_event('usage_totals', buckets=buckets, slots=count)
+        return {self.keys[slot]: (self.names[slot], rx_total[slot], tx_total[slot])
+                for slot in range(count) if self.keys[slot] and (rx_total[slot] or tx_total[slot])}
+
+    def close(self):
+        self._unmap()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+# Один замер текущего интерфейса; имена берутся из конфига, только если в дампе появились новые ключи
+def sample_usage(store, now=None):
+    _, live = get_backend().dump()
+    names = None
+    if any(key not in store.slots for key in live):
+        names = {peer.public_key: peer.name for peer in load_config().peers if peer.name}
+    store.record(live, now, names)
+    return len(live)
+
+def run_usage_sampler(interval=None, once=False):
+    interval = interval or USAGE_INTERVAL
+    shards = get_shards()
+    stores = {}
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        for shard in shards:
+            stores[shard.conf] = UsageStore(shard.conf, writable=True)
+        while True:
+            started = time.monotonic()
+            for shard in shards:
+                with use_shard(shard):
+                    try:
+                        with timed('operation', 'usage_sample'):
+                            sample_usage(stores[shard.conf])
+                    except Exception as e:
+                        if once:
+                            raise
+                        print(f"{shard.interface}: не удалось учесть трафик: {e}", file=sys.stderr)
+            if once:
+                return
+            time.sleep(max(interval - (time.monotonic() - started), 0))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for store in stores.values():
+            store.close()
+
+# Отчёт о трафике клиентов за окно по всем шардам, по убыванию суммы rx + tx
+def usage_report(since, until=None, selectors=None, top=None):
+    rows = []
+    for shard in get_shards():
+        with use_shard(shard):
+            store = UsageStore()
+            try:
+                totals = store.totals(since, until)
+            finally:
+                store.close()
+            if not totals:
+                continue
+            config = load_config()
+        wanted = {peer.public_key for peer in select_peers(config, selectors)} if selectors else None
+        for key, (recorded, rx, tx) in totals.items():
+            peer = config.by_pubkey.get(key)
+            name = peer.name if peer is not None and peer.name else recorded or None
+            # Удалённых клиентов можно выбрать по ключу или имени, под которым они учитывались
+            if wanted is not None and key not in wanted and not any(
+                    selector in (key, name) or (name and fnmatch.fnmatchcase(name, selector)) for selector in selectors):
+                continue
+            rows.append({'name': name, 'public_key': key, 'interface': shard.interface,
+                         'rx': rx, 'tx': tx, 'total': rx + tx})
+    if top:
+        return heapq.nlargest(top, rows, key=lambda row: row['total'])
+    rows.sort(key=lambda row: row['total'], reverse=True)
+    return rows
+
+# Момент времени: unix-время или локальная дата/время (2024-05-01, 2024-05-01 12:00)
+def parse_time(value):
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for pattern in ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return time.mktime(time.strptime(value, pattern))
+        except ValueError:
+            continue
+    raise ValueError(f"Некорректное время: {value!r} (пример: 2024-05-01 или 2024-05-01 12:00)")
+
+# События подключения клиентов. Наблюдатель сравнивает соседние снимки wg show
+# dump: разбираются только строки, изменившиеся с прошлого опроса, а отключения
+# по таймауту берутся из кучи сроков (рукопожатие + ONLINE_HANDSHAKE_AGE), так
+# что опрос 20 000 пиров не проходит по всем клиентам. События - connect,
+# disconnect (reason: timeout или removed) и roam (смена эндпоинта у подключённого
+# клиента) - выводятся JSON-строками и передаются командам из WATCH_HOOKS.
+WATCH_INTERVAL = 5
+WATCH_EVENTS = ('connect', 'disconnect', 'roam')
+WATCH_HOOKS = {}  # Событие (или *) -> список команд: {"connect": ["/usr/local/bin/notify"]}
+WATCH_WORKERS = 4  # Одновременно выполняемых команд
+WATCH_QUEUE = 1000  # Предел ожидающих команд; сверх него события не передаются командам
+WATCH_HOOK_TIMEOUT = 30
+
+class PeerWatcher:
+    def __init__(self, interface=None, offline=None):
+        self.interface = interface or get_interface_name()
+        self.offline = offline or ONLINE_HANDSHAKE_AGE
+        self.lines = None  # публичный ключ -> строка дампа; None до первого снимка
+        self.online = {}  # публичный ключ -> (рукопожатие, эндпоинт, подключён с)
+        self.deadlines = []  # куча (срок отключения, публичный ключ)
+
+    # Разбор снимка: возвращает список событий. Первый снимок только запоминается
+    def poll(self, text, now=None):
+        now = now or time.time()
+        lines = {}
+        for line in text.splitlines():
+            tabs = line.count('\t')
+            if tabs == 8:
+                # В выводе wg show all dump первым полем идёт имя интерфейса
+                line = line.partition('\t')[2]
+            elif tabs != 7:
+                continue
+            lines[line[:line.index('\t')]] = line
+        previous, self.lines = self.lines, lines
+        if previous is None:
+            for key, line in lines.items():
+                handshake, endpoint = self._handshake(line)
+                if handshake and now - handshake < self.offline:
+                    self._set_online(key, handshake, endpoint, handshake)
+            return []
+        events = []
+        for key, line in lines.items():
+            if previous.get(key) == line:
+                continue
+            handshake, endpoint = self._handshake(line)
+            state = self.online.get(key)
+            if handshake and now - handshake < self.offline:
+                if state is None:
+                    self._set_online(key, handshake, endpoint, handshake)
+                    events.append(self._event('connect', key, now))
+                    continue
+                if endpoint and state[1] and endpoint != state[1]:
+                    events.append(self._event('roam', key, now, previous_endpoint=state[1]))
+                if handshake != state[0] or endpoint != state[1]:
+                    self._set_online(key, handshake, endpoint or state[1], state[2])
+            elif state is not None:
+                events.append(self._disconnect(key, now, 'timeout'))
+        for key in previous.keys() - lines.keys():
+            if key in self.online:
+                events.append(self._disconnect(key, now, 'removed', previous[key]))
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, key = heapq.heappop(self.deadlines)
+            state = self.online.get(key)
+            # Запись устарела, если после неё было новое рукопожатие
+            if state is not None and state[0] + self.offline == deadline:
+                events.append(self._disconnect(key, now, 'timeout'))
+        return events
+
+    @staticmethod
+    def _handshake(line):
+        fields = line.split('\t')
+        return int(fields[4]), None if fields[2] == '(none)' else fields[2]
+
+    def _set_online(self, key, handshake, endpoint, since):
+        state = self.online.get(key)
+        self.online[key] = (handshake, endpoint, since)
+        if state is None or state[0] != handshake:
+            heapq.heappush(self.deadlines, (handshake + self.offline, key))
+
+    def _disconnect(self, key, now, reason, line=None):
+        handshake, endpoint, since = self.online.pop(key)
+        return self._event('disconnect', key, now, line, reason=reason, online_since=since,
+                           duration=max(handshake - since, 0), endpoint=endpoint)
+
+    def _event(self, kind, key, now, line=None, **extra):
+        peer = DumpPeer((line or self.lines[key]).split('\t'))
+        event = {'time': int(now), 'event': kind, 'interface': self.interface, 'public_key': key,
+                 'endpoint': peer.endpoint, 'latest_handshake': peer.latest_handshake, 'rx': peer.rx, 'tx': peer.tx}
+        event.update(extra)
+        return event
+
+# Выполнение команд-обработчиков в ограниченном пуле потоков. Данные события
+# передаются JSON в stdin и переменными окружения WG_EVENT, WG_PUBLIC_KEY и т.д.
+class HookRunner:
+    def __init__(self, hooks, workers=None, queue=None):
+        self.hooks = {event: [shlex.split(command) if isinstance(command, str) else list(command)
+                              for command in ([commands] if isinstance(commands, str) else commands)]
+                      for event, commands in hooks.items()}
+        import concurrent.futures
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers or WATCH_WORKERS)
+        self.slots = threading.BoundedSemaphore(queue or WATCH_QUEUE)
+        self.dropped = 0
+
+    def submit(self, event):
+        for command in self.hooks.get(event['event'], []) + self.hooks.get('*', []):
+            # Очередь не растёт без предела, если команды не успевают: опрос не ждёт их
+            if not self.slots.acquire(blocking=False):
+                self.dropped += 1
+                log_event('hook_dropped', command=command_name(command), watch_event=event['event'])
+                continue
+            self.pool.submit(self._run, command, event)
+
+    def _run(self, command, event):
+        try:
+            env = dict(os.environ)
+            env.update({f"WG_{key.upper()}": str(value) for key, value in event.items() if value is not None})
+            result = run_external(command, input=json.dumps(event, ensure_ascii=False), env=env,
+                                  capture_output=True, text=True, timeout=WATCH_HOOK_TIMEOUT)
+            if result.returncode != 0:
+                detail = f": {result.stderr.strip()}" if result.stderr.strip() else ""
+                print(f"{command_name(command)}: код завершения {result.returncode}{detail}", file=sys.stderr)
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"{command_name(command)}: {e}", file=sys.stderr)
+        finally:
+            self.slots.release()
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+# Имена и адреса клиентов для событий; конфиг читается, только когда события есть
+def _describe_events(events):
+    if not events:
+        return events
+    config = load_config()
+    for event in events:
+        peer = config.by_pubkey.get(event['public_key'])
+        event['name'] = peer.name if peer is not None else None
+        event['ip'] = peer.ip if peer is not None else None
+    return events
+
+# Наблюдение за всеми шардами (или проигрывание сохранённых снимков replay для
+# одного интерфейса: строка "# <unix-время>" в начале файла задаёт время снимка)
+def run_watcher(interval=None, hooks=None, output=None, replay=None, offline=None):
+    hooks = dict(WATCH_HOOKS, **(hooks or {}))
+    runner = HookRunner(hooks) if hooks else None
+    sink = open(output, 'a') if output else sys.stdout
+
+    def emit_events(events):
+        for event in _describe_events(events):
+            sink.write(json.dumps(event, ensure_ascii=False) + "\n")
+            if runner is not None:
+                runner.submit(event)
+        sink.flush()
+
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        if replay:
+            watcher = PeerWatcher(offline=offline)
+            for path in replay:
+                with open(path, 'r') as f:
+                    text = f.read()
+                header = text.split('\n', 1)[0]
+                now = float(header[1:]) if header.startswith('#') else None
+                emit_events(watcher.poll(text, now))
+            return
+        watchers = {shard.conf: PeerWatcher(shard.interface, offline) for shard in get_shards()}
+        while True:
+            started = time.monotonic()
+            for shard in get_shards():
+                with use_shard(shard):
+                    try:
+                        with timed('operation', 'watch_poll'):
+                            events = watchers[shard.conf].poll(get_backend().dump_text())
+                        emit_events(events)
+                    except RuntimeError as e:
+                        print(f"{shard.interface}: {e}", file=sys.stderr)
+            time.sleep(max((interval or WATCH_INTERVAL) - (time.monotonic() - started), 0))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if runner is not None:
+            runner.close()
+        if sink is not sys.stdout:
+            sink.close()
+
+# Неинтерактивный режим: подкоманды для автоматизации. Не вызывают clear и input(),
+# выводят JSON или TSV в stdout и возвращают код завершения.
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_NOT_APPLIED = 3  # Конфиг изменён, но применить изменения к интерфейсу не удалось
+
+def emit(data, fmt, columns=None):
+    if fmt == 'json':
+        print(json.dumps(data, ensure_ascii=False))
+        return
+    rows = data if isinstance(data, list) else [data]
+    for row in rows:
+        if columns:
+            print("\t".join("" if row.get(column) is None else str(row.get(column)) for column in columns))
+        else:
+            for key, value in row.items():
+                print(f"{key}\t{'' if value is None else value}")
+
+def _report_not_applied(applied, message):
+    if applied:
+        return EXIT_OK
+    print(f"Не удалось применить изменения динамически: {message or 'Неизвестная ошибка'}", file=sys.stderr)
+    return EXIT_NOT_APPLIED
+
+# Метки вида ключ=значение
+def parse_labels(items):
+    labels = {}
+    for item in items or []:
+        key, sep, value = item.partition('=')
+        if not sep or not key.strip():
+            raise ValueError(f"Метка должна иметь вид ключ=значение: {item!r}")
+        labels[key.strip()] = value.strip()
+    return labels
+
+def cmd_add(args):
+    names = list(args.names)
+    if args.file:
+        names.extend(load_client_names(args.file))
+    if args.count:
+        timestamp = datetime.datetime.now().strftime("%s")
+        names.extend(f"client-{timestamp}-{i}" for i in range(1, args.count + 1))
+    if not names:
+        names = [f"client-{datetime.datetime.now().strftime('%s')}"]
+    labels = parse_labels(args.label)
+    store = get_client_store()
+    if is_sharded() or args.interface:
+        clients, applied, message = provision_sharded(names, args.placement, args.interface, labels, args.client_profile)
+        rows = [{'name': name, 'ip': ip, 'public_key': pub, 'interface': shard.interface,
+                 'config': store.location(name)}
+                for shard, (name, ip, _, pub, _) in clients]
+        emit(rows, args.format, ['name', 'ip', 'public_key', 'interface', 'config'])
+        return _report_not_applied(applied, message)
+    clients, applied, message = provision_clients(names, labels, args.client_profile)
+    rows = [{'name': name, 'ip': ip, 'public_key': pub, 'config': store.location(name)}
+            for name, ip, _, pub, _ in clients]
+    emit(rows, args.format, ['name', 'ip', 'public_key', 'config'])
+    return _report_not_applied(applied, message)
+
+def cmd_list(args):
+    if is_sharded():
+        rows = [{'name': peer.name, 'ip': peer.ip, 'public_key': peer.public_key, 'interface': shard.interface}
+                for shard, peer in list_sharded()]
+        emit(rows, args.format, ['name', 'ip', 'public_key', 'interface'])
+        return EXIT_OK
+    config = load_config()
+    rows = [{'name': peer.name, 'ip': peer.ip, 'public_key': peer.public_key} for peer in config.peers]
+    emit(rows, args.format, ['name', 'ip', 'public_key'])
+    return EXIT_OK
+
+def cmd_delete(args):
+    selectors = list(args.selectors)
+    if args.file:
+        selectors.extend(load_client_names(args.file))
+    if is_sharded():
+        removed, applied, message = revoke_sharded(selectors)
+        if not removed:
+            print("Подходящие клиенты не найдены", file=sys.stderr)
+            return EXIT_ERROR
+        emit([{'name': peer.name, 'ip': peer.ip, 'public_key': peer.public_key, 'interface': shard.interface}
+              for shard, peer in removed], args.format, ['name', 'ip', 'public_key', 'interface'])
+        return _report_not_applied(applied, message)
+    removed, applied, message = revoke_clients(selectors)
+    if not removed:
+        print("Подходящие клиенты не найдены", file=sys.stderr)
+        return EXIT_ERROR
+    emit([{'name': peer.name, 'ip': peer.ip, 'public_key': peer.public_key} for peer in removed],
+         args.format, ['name', 'ip', 'public_key'])
+    return _report_not_applied(applied, message)
+
+def cmd_reap(args):
+    if is_sharded():
+        rows, applied, message = reap_sharded(parse_duration(args.idle), args.never, args.dry_run, args.limit, args.force)
+        emit(rows, args.format, ['name', 'ip', 'public_key', 'reason', 'idle', 'interface'])
+    else:
+        rows, applied, message = reap_stale_peers(parse_duration(args.idle), args.never, args.dry_run, args.limit, args.force)
+        emit(rows, args.format, ['name', 'ip', 'public_key', 'reason', 'idle'])
+    action = "К удалению" if args.dry_run else "Удалено"
+    print(f"{action}: {len(rows)} клиентов", file=sys.stderr)
+    return _report_not_applied(applied, message)
+
+def cmd_show(args):
+    keys = read_client_keys(args.name)
+    if args.qr:
+        sys.stdout.write(render_qr(keys['config'], 'text', get_qr_cache_dir()).decode())
+        return EXIT_OK
+    if args.format == 'tsv':
+        keys = {key: value for key, value in keys.items() if key != 'config'}
+    emit(keys, args.format)
+    return EXIT_OK
+
+def cmd_diagnose(args):
+    rows = []
+    for shard in get_shards():
+        with use_shard(shard):
+            checks = check_config()
+            if not args.skip_network:
+                checks.extend(check_endpoint())
+        rows.extend({'level': level, 'message': message, 'interface': shard.interface} for level, message in checks)
+    emit(rows, args.format, ['level', 'message', 'interface'] if is_sharded() else ['level', 'message'])
+    return EXIT_ERROR if any(row['level'] == 'error' for row in rows) else EXIT_OK
+
+def cmd_validate(args):
+    reports = []
+    for shard in get_shards():
+        with use_shard(shard):
+            reports.append(dict(validate_config(workers=args.workers), interface=shard.interface))
+    if args.format == 'json':
+        emit(reports if is_sharded() else reports[0], args.format)
+    else:
+        emit([{'code': code, 'level': issue['level'], 'count': issue['count'],
+               'examples': ",".join(example['peer'] for example in issue['examples']), 'interface': report['interface']}
+              for report in reports for code, issue in report['issues'].items()],
+             args.format, ['code', 'level', 'count', 'examples'] + (['interface'] if is_sharded() else []))
+    return EXIT_ERROR if any(report['errors'] for report in reports) else EXIT_OK
+
+def cmd_reload(args):
+    if args.restart:
+        # Сообщения о ходе перезапуска не должны смешиваться с машиночитаемым выводом
+        with contextlib.redirect_stdout(sys.stderr):
+            for shard in get_shards():
+                with use_shard(shard):
+                    restart_interface()
+        emit({'mode': 'restart'}, args.format)
+        return EXIT_OK
+    if is_sharded():
+        emit([{'interface': shard.interface, 'mode': 'diff', 'added': len(diff['added']), 'updated': len(diff['updated']),
+               'removed': len(diff['removed']), 'unchanged': diff['unchanged'], 'elapsed': round(diff['elapsed'], 3)}
+              for shard, diff in reload_sharded()],
+             args.format, ['interface', 'added', 'updated', 'removed', 'unchanged', 'elapsed'])
+        return EXIT_OK
+    diff = hot_reload()
+    emit({'mode': 'diff', 'added': len(diff['added']), 'updated': len(diff['updated']),
+          'removed': len(diff['removed']), 'unchanged': diff['unchanged'],
+          'elapsed': round(diff['elapsed'], 3)}, args.format)
+    return EXIT_OK
+
+def cmd_rebalance(args):
+    moves = plan_rebalance(parse_duration(args.idle), args.limit)
+    if args.dry_run:
+        rows = [{'name': peer.name, 'public_key': peer.public_key, 'from': source.interface, 'to': target.interface}
+                for source, target, peer in moves]
+        emit(rows, args.format, ['name', 'public_key', 'from', 'to'])
+        print(f"К переносу: {len(rows)} клиентов", file=sys.stderr)
+        return EXIT_OK
+    rows, applied, message = apply_rebalance(moves)
+    emit(rows, args.format, ['name', 'ip', 'public_key', 'interface'])
+    print(f"Перенесено: {len(rows)} клиентов, их конфиги обновлены", file=sys.stderr)
+    return _report_not_applied(applied, message)
+
+def cmd_set_profile(args):
+    profile = None if args.client_profile == 'none' else args.client_profile
+    selectors = list(args.selectors)
+    if args.file:
+        selectors.extend(load_client_names(args.file))
+    rows, applied, messages = [], True, []
+    for shard in get_shards():
+        with use_shard(shard):
+            peers, shard_applied, message = set_client_profile(selectors, profile)
+        rows.extend({'name': peer.name, 'ip': peer.ip, 'public_key': peer.public_key, 'profile': peer.profile,
+                     'interface': shard.interface} for peer in peers)
+        if not shard_applied:
+            applied = False
+            messages.append(f"{shard.interface}: {message}")
+    if not rows:
+        print("Подходящие клиенты не найдены", file=sys.stderr)
+        return EXIT_ERROR
+    emit(rows, args.format, ['name', 'ip', 'public_key', 'profile', 'interface'])
+    return _report_not_applied(applied, "; ".join(messages))
+
+def cmd_profiles(args):
+    counts = collections.Counter(peer.profile for _, peer in list_sharded() if peer.profile)
+    rows = []
+    for name in sorted(PROFILES):
+        get_profile(name)
+        rows.append(dict({key: PROFILES[name].get(key) for key in PROFILE_KEYS}, name=name, clients=counts.pop(name, 0)))
+    # Профили, которые указаны у клиентов, но не описаны
+    rows.extend({'name': name, 'clients': count} for name, count in sorted(counts.items()))
+    emit(rows, args.format, ['name'] + list(PROFILE_KEYS) + ['clients'])
+    return EXIT_OK
+
+def cmd_shape(args):
+    rows, applied, messages = [], True, []
+    for shard in get_shards():
+        with use_shard(shard):
+            interface = shard.interface
+            config = load_config()
+            batch = shaping_batch_for(interface, config)
+            if args.dry_run:
+                sys.stdout.write(batch)
+                continue
+            shard_applied, message = apply_shaping(interface, batch)
+        rows.append({'interface': interface, 'clients': sum(1 for peer in config.peers if peer.profile in PROFILES),
+                     'rules': batch.count('\n'), 'applied': shard_applied})
+        if not shard_applied:
+            applied = False
+            messages.append(f"{interface}: {message}")
+    if not args.dry_run:
+        emit(rows, args.format, ['interface', 'clients', 'rules', 'applied'])
+    return _report_not_applied(applied, "; ".join(messages))
+
+def cmd_migrate_store(args):
+    imported, custom, skipped = migrate_client_store(args.remove)
+    emit({'imported': imported, 'custom': custom, 'skipped': skipped,
+          'store': get_client_store('sqlite').location()}, args.format)
+    return EXIT_OK
+
+def cmd_status(args):
+    statuses = []
+    for shard in get_shards():
+        with use_shard(shard):
+            statuses.append(read_peer_status())
+    columns = ['name', 'ip', 'public_key', 'endpoint', 'latest_handshake', 'online', 'rx', 'tx']
+    if args.format == 'json':
+        emit(statuses if is_sharded() else statuses[0], args.format)
+    elif is_sharded():
+        emit([dict(row, interface=status['interface']) for status in statuses for row in status['peers']],
+             args.format, columns + ['interface'])
+    else:
+        emit(statuses[0]['peers'], args.format, columns)
+    return EXIT_OK
+
+def cmd_export(args):
+    exported, missing = export_clients(args.output, args.selectors, args.qr, args.workers, args.archive)
+    result = {'archive': args.output, 'exported': exported, 'missing': missing}
+    if args.output == '-':
+        # Архив уже занял stdout
+        print(json.dumps(result, ensure_ascii=False), file=sys.stderr)
+    else:
+        emit(result, args.format)
+    return EXIT_OK
+
+def cmd_compact(args):
+    if is_sharded():
+        emit([{'interface': shard.interface, 'compacted': get_journal(shard.conf).compact()} for shard in get_shards()],
+             args.format, ['interface', 'compacted'])
+        return EXIT_OK
+    emit({'compacted': get_journal().compact()}, args.format)
+    return EXIT_OK
+
+def cmd_exporter(args):
+    if is_sharded():
+        raise ValueError("Экспорт метрик работает с одним интерфейсом: запустите его для каждого шарда с --conf")
+    if args.once:
+        # Разовый вывод, например для textfile collector node_exporter
+        sys.stdout.write(MetricsCollector(args.dump_file, args.max_peers).collect().decode())
+        return EXIT_OK
+    run_exporter(args.listen, args.socket, args.dump_file, args.ttl, args.max_peers)
+    return EXIT_OK
+
+def cmd_daemon(args):
+    if is_sharded():
+        raise ValueError("Фоновый режим работает с одним интерфейсом: запустите его для каждого шарда с --conf")
+    run_daemon(args.listen, args.socket, load_daemon_token(args.token_file))
+    return EXIT_OK
+
+def cmd_watch(args):
+    hooks = {}
+    if args.hooks:
+        with open(args.hooks, 'r') as f:
+            hooks.update(json.load(f))
+    for hook in args.hook:
+        event, sep, command = hook.partition('=')
+        if not sep or event not in WATCH_EVENTS + ('*',):
+            raise ValueError(f"Некорректный обработчик {hook!r}: нужно СОБЫТИЕ=КОМАНДА, события: {', '.join(WATCH_EVENTS)} или *")
+        hooks.setdefault(event, []).append(command)
+    run_watcher(args.interval, hooks, args.output, args.replay, parse_duration(args.offline) if args.offline else None)
+    return EXIT_OK
+
+def cmd_import(args):
+    shard = find_shard(args.interface) if args.interface else None
+    if shard is None and is_sharded():
+        raise ValueError("Для нескольких шардов укажите интерфейс: --interface")
+    with use_shard(shard or Shard(CONF, SUBNET, ENDPOINT)):
+        rows, problems, applied, message = import_peers(
+            args.sources, args.type, args.reassign, args.skip_conflicts, args.dry_run,
+            args.name_template, parse_labels(args.label), args.client_profile, args.name_existing)
+    emit(rows, args.format, ['name', 'ip', 'public_key', 'source', 'status', 'detail'])
+    counts = collections.Counter(row['status'] for row in rows)
+    print(", ".join(f"{status}: {count}" for status, count in sorted(counts.items())) or "Пиры не найдены", file=sys.stderr)
+    if problems and not args.skip_conflicts:
+        print(f"Импорт отменён: проблем - {problems}. Исправьте их, используйте --reassign "
+              f"или --skip-conflicts, чтобы импортировать остальные", file=sys.stderr)
+        return EXIT_ERROR
+    if args.dry_run:
+        print("Проверка без записи (--dry-run)", file=sys.stderr)
+    return _report_not_applied(applied, message)
+
+def cmd_sample_usage(args):
+    run_usage_sampler(args.interval, args.once)
+    return EXIT_OK
+
+def cmd_usage(args):
+    until = parse_time(args.until) if args.until else time.time()
+    since = parse_time(args.since) if args.since else until - parse_duration(args.last)
+    if since >= until:
+        raise ValueError("Начало окна должно быть раньше конца")
+    selectors = list(args.selectors)
+    if args.file:
+        selectors.extend(load_client_names(args.file))
+    emit(usage_report(since, until, selectors or None, args.top), args.format,
+         ['name', 'public_key', 'interface', 'rx', 'tx', 'total'])
+    return EXIT_OK
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-f', '--format', choices=('json', 'tsv'), default='json', help="формат вывода (по умолчанию json)")
+    common.add_argument('--conf', help=f"серверный конфиг (по умолчанию {CONF})")
+    common.add_argument('--keys-dir', help=f"каталог конфигов клиентов (по умолчанию {KEYS_DIR})")
+    common.add_argument('--shards', help="JSON со списком шардов: [{\"conf\", \"subnet\", \"endpoint\"}, ...]")
+    common.add_argument('--profiles', help="JSON с профилями клиентов: {\"имя\": {\"rate\", \"upload\", \"mtu\", \"keepalive\", \"dns\"}}")
+    
+    parser = argparse.ArgumentParser(
+        prog='wg-manager',
+        description="WireGuard Manager. Без команды запускается интерактивное меню.",
+        epilog=f"Коды завершения: {EXIT_OK} - успех, {EXIT_ERROR} - ошибка, "
+               f"{EXIT_NOT_APPLIED} - конфиг изменён, но не применён к интерфейсу.")
+    parser.add_argument('--log', default=os.environ.get('WG_MANAGER_LOG'),
+                        help="JSON-лог операций и внешних команд: путь к файлу или - для stderr")
+    parser.add_argument('--trace', default=os.environ.get('WG_MANAGER_TRACE'),
+                        help="файл трассировки для отчёта об ошибке (с аргументами и выводом команд)")
+    parser.add_argument('--profile', action='store_true', help="профилирование со сводкой в stderr при выходе")
+    parser.add_argument('--profile-out', default=os.environ.get('WG_MANAGER_PROFILE'), metavar='FILE',
+                        help="сохранить профиль: FILE.prof - статистика cProfile, FILE.folded - стеки для flame graph")
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    
+    add = commands.add_parser('add', parents=[common], help="добавить клиентов")
+    add.add_argument('names', nargs='*', help="имена клиентов")
+    add.add_argument('--count', type=int, help="создать N клиентов с автоматическими именами")
+    add.add_argument('--file', help="CSV или JSON файл с именами")
+    add.add_argument('--interface', help="создать в указанном шарде (например, wg1)")
+    add.add_argument('--label', action='append', help="метка клиента ключ=значение (можно несколько)")
+    add.add_argument('--placement', choices=('peers', 'traffic'), help=f"выбор шарда (по умолчанию {SHARD_PLACEMENT})")
+    add.add_argument('--profile', dest='client_profile', help="профиль клиента: ограничение скорости, MTU, keepalive")
+    add.set_defaults(handler=cmd_add)
+    
+    commands.add_parser('list', parents=[common], help="список клиентов").set_defaults(handler=cmd_list)
+    
+    delete = commands.add_parser('delete', parents=[common], help="удалить клиентов")
+    delete.add_argument('selectors', nargs='*', help="имена, IP, публичные ключи или шаблоны (test-*)")
+    delete.add_argument('--file', help="CSV или JSON файл с именами")
+    delete.set_defaults(handler=cmd_delete)
+    
+    reap = commands.add_parser('reap', parents=[common], help="удалить клиентов без рукопожатий дольше порога")
+    reap.add_argument('--idle', required=True, help="порог неактивности: 3600, 12h, 30d, 2w")
+    reap.add_argument('--never', action='store_true', help="удалять и ни разу не подключавшихся (если конфиг старше порога)")
+    reap.add_argument('--limit', type=int, help="удалить не больше N самых давних")
+    reap.add_argument('--dry-run', action='store_true', help="только показать, кто будет удалён")
+    reap.add_argument('--force', action='store_true', help=f"разрешить удалить больше {REAP_MAX_SHARE:.0%} клиентов")
+    reap.set_defaults(handler=cmd_reap)
+    
+    show = commands.add_parser('show', parents=[common], help="ключи и конфиг клиента")
+    show.add_argument('name')
+    show.add_argument('--qr', action='store_true', help="вывести QR-код конфига в терминал")
+    show.set_defaults(handler=cmd_show)
+    
+    diagnose = commands.add_parser('diagnose', parents=[common], help="проверить конфигурацию")
+    diagnose.add_argument('--skip-network', action='store_true', help="не проверять доступность порта")
+    diagnose.set_defaults(handler=cmd_diagnose)
+    
+    validate = commands.add_parser('validate', parents=[common], help="отчёт о проблемах в конфиге и KEYS_DIR")
+    validate.add_argument('--workers', type=int, help="число процессов для проверки пиров")
+    validate.set_defaults(handler=cmd_validate)
+    
+    reload_cmd = commands.add_parser('reload', parents=[common], help="применить конфиг к интерфейсу без разрыва соединений")
+    reload_cmd.add_argument('--restart', action='store_true', help="полный перезапуск интерфейса")
+    reload_cmd.set_defaults(handler=cmd_reload)
+    
+    set_profile = commands.add_parser('set-profile', parents=[common], help="назначить клиентам профиль")
+    set_profile.add_argument('client_profile', metavar='profile', help="имя профиля или none, чтобы снять профиль")
+    set_profile.add_argument('selectors', nargs='*', help="имена, IP, публичные ключи или шаблоны (test-*)")
+    set_profile.add_argument('--file', help="CSV или JSON файл с именами")
+    set_profile.set_defaults(handler=cmd_set_profile)
+    
+    commands.add_parser('profiles', parents=[common], help="профили и число клиентов в каждом").set_defaults(handler=cmd_profiles)
+    
+    shape = commands.add_parser('shape', parents=[common], help="применить ограничения скорости профилей (tc -batch)")
+    shape.add_argument('--dry-run', action='store_true', help="вывести правила для tc -batch, не применяя")
+    shape.set_defaults(handler=cmd_shape)
+    
+    migrate = commands.add_parser('migrate-store', parents=[common], help=f"перенести конфиги <имя>.conf в {CLIENT_DB}")
+    migrate.add_argument('--remove', action='store_true', help="удалить перенесённые файлы")
+    migrate.set_defaults(handler=cmd_migrate_store)
+    
+    rebalance = commands.add_parser('rebalance', parents=[common], help="перенести неактивных клиентов между шардами")
+    rebalance.add_argument('--idle', default='7d', help="переносить клиентов без рукопожатий дольше порога (по умолчанию 7d)")
+    rebalance.add_argument('--limit', type=int, help="перенести не больше N клиентов")
+    rebalance.add_argument('--dry-run', action='store_true', help="только показать план")
+    rebalance.set_defaults(handler=cmd_rebalance)
+    
+    status = commands.add_parser('status', parents=[common], help="состояние подключений")
+    # Прежний вызов wg-manager.py status --json продолжает работать
+    status.add_argument('--json', dest='format', action='store_const', const='json', help="то же, что -f json")
+    status.set_defaults(handler=cmd_status)
+    export = commands.add_parser('export', parents=[common], help="выгрузить конфиги клиентов в tar.gz или zip")
+    export.add_argument('output', help="путь к архиву или - для вывода в stdout")
+    export.add_argument('selectors', nargs='*', help="имена, IP или шаблоны (по умолчанию все клиенты)")
+    export.add_argument('--qr', choices=['png', 'text'], help="добавить QR-коды")
+    export.add_argument('--archive', choices=['tar', 'zip'], help="формат архива (по умолчанию по расширению)")
+    export.add_argument('--workers', type=int, help="число процессов для построения QR-кодов")
+    export.set_defaults(handler=cmd_export)
+    
+    commands.add_parser('compact', parents=[common], help="перенести журнал изменений в конфиг").set_defaults(handler=cmd_compact)
+    
+    daemon = commands.add_parser('daemon', parents=[common], help="запустить API-сервер управления")
+    daemon.add_argument('--listen', help=f"адрес TCP, например {DAEMON_LISTEN} (нужен токен)")
+    daemon.add_argument('--socket', help=f"путь к Unix-сокету (по умолчанию {DAEMON_SOCKET})")
+    daemon.add_argument('--token-file', help="файл с токеном для заголовка Authorization: Bearer (или WG_MANAGER_TOKEN)")
+    daemon.set_defaults(handler=cmd_daemon)
+    
+    exporter = commands.add_parser('exporter', parents=[common], help="метрики для Prometheus на /metrics")
+    exporter.add_argument('--listen', help=f"адрес TCP (по умолчанию {EXPORTER_LISTEN})")
+    exporter.add_argument('--socket', help="путь к Unix-сокету вместо TCP")
+    exporter.add_argument('--ttl', type=float, help=f"время жизни кэша метрик, с (по умолчанию {EXPORTER_CACHE_TTL})")
+    exporter.add_argument('--max-peers', type=int, help=f"предел рядов по клиентам (по умолчанию {EXPORTER_MAX_PEERS})")
+    exporter.add_argument('--dump-file', help="брать состояние из сохранённого вывода wg show dump")
+    exporter.add_argument('--once', action='store_true', help="вывести метрики в stdout и завершиться")
+    exporter.set_defaults(handler=cmd_exporter)
+    
+    importer = commands.add_parser('import', parents=[common], help="импорт пиров из конфигов, wg show dump, конфигов клиентов и JSON")
+    importer.add_argument('sources', nargs='+', help="файлы или каталоги с конфигами клиентов")
+    importer.add_argument('--type', choices=IMPORT_TYPES, default='auto',
+                          help="conf - серверный конфиг, dump - wg show dump, clients - конфиги клиентов, json - экспорт другого менеджера")
+    importer.add_argument('--name-template', help=f"имя пира без имени: {{n}}, {{ip}}, {{key}} (по умолчанию {IMPORT_NAME_TEMPLATE})")
+    importer.add_argument('--reassign', action='store_true', help="выдать новый адрес пирам с занятым, чужим или отсутствующим адресом")
+    importer.add_argument('--skip-conflicts', action='store_true', help="импортировать остальных пиров, если у части есть проблемы")
+    importer.add_argument('--name-existing', action='store_true', help="дать имена безымянным пирам, которые уже есть в конфиге")
+    importer.add_argument('--dry-run', action='store_true', help="только проверить и показать результат")
+    importer.add_argument('--interface', help="импортировать в указанный шард (например, wg1)")
+    importer.add_argument('--label', action='append', help="метка клиентов ключ=значение (можно несколько)")
+    importer.add_argument('--profile', dest='client_profile', help="профиль импортированных клиентов")
+    importer.set_defaults(handler=cmd_import)
+    
+    watch = commands.add_parser('watch', parents=[common], help="поток событий подключения и отключения клиентов")
+    watch.add_argument('--interval', type=float, help=f"период опроса, с (по умолчанию {WATCH_INTERVAL})")
+    watch.add_argument('--offline', help=f"клиент отключён, если рукопожатия не было дольше (по умолчанию {ONLINE_HANDSHAKE_AGE}s)")
+    watch.add_argument('--hook', action='append', default=[], metavar='EVENT=COMMAND',
+                       help=f"команда для события ({', '.join(WATCH_EVENTS)} или *), данные - JSON в stdin и WG_* в окружении")
+    watch.add_argument('--hooks', help="JSON с обработчиками: {\"connect\": [\"команда\"], ...}")
+    watch.add_argument('--output', help="дописывать события в файл вместо stdout")
+    watch.add_argument('--replay', nargs='+', metavar='DUMP', help="проиграть сохранённые снимки wg show dump и завершиться")
+    watch.set_defaults(handler=cmd_watch)
+    
+    sampler = commands.add_parser('sample-usage', parents=[common], help="учёт трафика клиентов по часам и суткам")
+    sampler.add_argument('--interval', type=float, help=f"период замеров, с (по умолчанию {USAGE_INTERVAL})")
+    sampler.add_argument('--once', action='store_true', help="сделать один замер и завершиться (для cron/systemd timer)")
+    sampler.set_defaults(handler=cmd_sample_usage)
+    
+    usage = commands.add_parser('usage', parents=[common], help="трафик клиентов за период")
+    usage.add_argument('selectors', nargs='*', help="имена, IP, публичные ключи или шаблоны (test-*)")
+    usage.add_argument('--file', help="CSV или JSON файл с именами")
+    usage.add_argument('--last', default='1d', help="окно до --until: 12h, 7d, 2w (по умолчанию 1d)")
+    usage.add_argument('--since', help="начало окна: 2024-05-01, '2024-05-01 12:00' или unix-время")
+    usage.add_argument('--until', help="конец окна (по умолчанию сейчас)")
+    usage.add_argument('--top', type=int, help="только N клиентов с наибольшим трафиком")
+    usage.set_defaults(handler=cmd_usage)
+    return parser
+
+# Интерактивное меню
+def run_menu():
+    try:
+        ensure_keys_dir()
+        if os.path.exists(CONF):
+            get_journal().compact()
+        if os.environ.get('WG_MANAGER_BACKEND', BACKEND) != 'fake':
+            check_wg_command()
+        main_menu()
+    except KeyboardInterrupt:
+        clear_screen()
+        print("\nВыход из программы...")
+    return EXIT_OK
+
+def main(argv=None):
+    global CONF, KEYS_DIR, SHARDS, PROFILES
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    open_log_sink('log', args.log)
+    open_log_sink('trace', args.trace)
+    log_event('start', {'argv': sys.argv, 'python': sys.version, 'platform': sys.platform, 'cwd': os.getcwd()},
+              command=args.command or 'menu')
+    try:
+        with profiling(args.profile_out or ('-' if args.profile else None)):
+            # Без команды - интерактивное меню (с проверкой wg --version)
+            if not args.command:
+                return run_menu()
+            if args.conf:
+                CONF = args.conf
+            if args.keys_dir:
+                KEYS_DIR = args.keys_dir
+            if getattr(args, 'shards', None):
+                SHARDS = load_shards(args.shards)
+            if getattr(args, 'profiles', None):
+                PROFILES = load_profiles(args.profiles)
+            try:
+                with timed('operation', args.command):
+                    return args.handler(args)
+            except Exception as e:
+                print(f"Ошибка: {str(e)}", file=sys.stderr)
+                return EXIT_ERROR
+            finally:
+                # Фоновый режим переносит журнал сам по таймеру
+                if args.command != 'daemon':
+                    compact_journals()
+    finally:
+        close_instrumentation()
+
+if __name__ == "__main__":
+    sys.exit(main())